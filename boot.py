@@ -1,20 +1,26 @@
-import time
+# Finish or roll back an over-the-air update before anything else loads
+try:
+    import ota
+    ota.boot()
+except Exception as e:
+    print("OTA boot check failed:", e)
+
 import network
+import startup
 
 def connect_wifi(ssid, password):
+    # Only start association here; main.py waits for the link in the background
+    # while drivers and the SSL context are being set up.
     wlan = network.WLAN(network.STA_IF)
     wlan.active(True)
     if not wlan.isconnected():
-        wlan.connect(ssid, password)
-        print("WiFi bağlantısı yapılıyor...")
-        timeout = 10
-        while not wlan.isconnected() and timeout > 0:
-            time.sleep(1)
-            timeout -= 1
-    if wlan.isconnected():
-        print("WiFi bağlı:", wlan.ifconfig())
-    else:
-        print("WiFi bağlantısı başarısız!")
+        try:
+            import wifi
+            wifi.associate(wlan, ssid, password)
+        except ImportError:
+            wlan.connect(ssid, password)
+        print("WiFi bağlantısı başlatıldı...")
+    startup.mark("wifi_assoc_started")
 
 # config.py'den bilgileri al
 try:
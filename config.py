@@ -2,6 +2,15 @@
 WIFI_SSID = "X"
 WIFI_PASS = "X" 
 
+# --- Wi-Fi Supervisor (lib/wifi.py) ---
+WIFI_CHECK_MS = 2000              # Link/RSSI poll interval
+WIFI_FAST_TIMEOUT_MS = 5000       # Reconnect straight to the cached access point (no scan)
+WIFI_CONNECT_TIMEOUT_MS = 15000   # Reconnect with a full scan
+WIFI_BACKOFF_MIN_MS = 2000        # First delay after a failed reconnect (doubles each time)
+WIFI_BACKOFF_MAX_MS = 300000      # Upper bound for the reconnect delay
+WIFI_RSSI_WEAK_DBM = -80          # Count the link as weak below this
+WIFI_CACHE_FILE = "wifi.bin"      # BSSID + channel of the last access point
+
 # --- Blynk Project Configuration ---
 BLYNK_TEMPLATE_ID = "TMPL4TdDES3vm"
 BLYNK_TEMPLATE_NAME = "Plant"
@@ -9,6 +18,15 @@ BLYNK_AUTH_TOKEN = "6ySH9nvj1lCxlPRCtcbyCP0Ex3d6WZ-n"
 BLYNK_MQTT_BROKER = "fra1.blynk.cloud"  # Blynk server for MQTT and HTTP API
 DEVICE_ID = "Pico"                       # Unique Device Identifier for MQTT topics
 BLYNK_MQTT_PORT = 8883                   # Secure MQTT port
+BLYNK_MQTT_CA_FILE = "ISRG_Root_X1.der"  # CA certificate used to verify the broker
+BLYNK_HOSTS = ()                         # Candidate servers ("host" or "host:port"); empty = BLYNK_MQTT_BROKER only
+
+# --- Server Selection (only with several BLYNK_HOSTS) ---
+ENDPOINT_PROBE_INTERVAL_S = 3600  # Re-measure connect + TLS handshake time of every candidate
+ENDPOINT_PROBE_TIMEOUT_MS = 5000  # A probe slower than this counts as a failure
+ENDPOINT_SWITCH_MARGIN_PCT = 30   # Move only to a server at least this much faster...
+ENDPOINT_SWITCH_MIN_MS = 50       # ...and at least this many ms faster
+ENDPOINT_MAX_ERRORS = 3           # Consecutive failures before failing over to another server
 
 # --- Hardware Pin Configuration ---
 PIN_SOIL_MOISTURE_ADC = 28  # ADC pin for soil moisture sensor
@@ -54,13 +72,113 @@ WATERING_ALLOWED_HOUR_END = 20   # End time for allowed watering period (8 PM)
 DEFAULT_MIN_SECONDS_BETWEEN_WATERING = 18000   # Minimum time between watering cycles (5 hours)
 DEFAULT_PUMP_RUN_DURATION_AUTO_S = 5          # Default duration for automatic watering
 LDR_ADC_MAX_DARKNESS_FOR_WATERING = 40000     # Maximum darkness level for watering
+WATER_MIN_PERCENT = 20                        # Tank level below which no watering starts (auto and manual)
+
+# --- Control Rules (evaluated by lib/rules.py, see there for the format) ---
+# Facts: soil, water, light (%), water_raw, ldr_raw (ADC), pump (0/1), hour (local),
+# soil_thr (setting), lock_left_s / lock_left_h (watering lockout remaining)
+RULES = (
+    ("low_light", (("light", ">=", LDR_DAYTIME_MIN_LIGHT_PERCENT),
+                   ("light", "<", THRESHOLD_LIGHT_INSUFFICIENT_PERCENT)), "LOW LIGHT", None, ()),
+    ("low_water", (("water_raw", "<", WATER_ADC_LOW_THRESHOLD_VALUE),
+                   ("water_raw", "!=", 0)), "LOW WATER", "low_water_alarm", ()),
+    ("auto_water", (("soil", "<", "soil_thr"),), "AUTO", "auto_water", (
+        (("pump", "==", 1), None, "Pump is already running."),
+        (("water", "<", WATER_MIN_PERCENT), "NO WATER", "Water level is low."),
+        (("hour", "out", (WATERING_ALLOWED_HOUR_START, WATERING_ALLOWED_HOUR_END)), "NIGHT", "Not allowed time."),
+        (("lock_left_s", ">", 0), "LOCK {lock_left_h}h", "Locked ({lock_left_h}h left)."),
+        (("ldr_raw", ">=", LDR_ADC_MAX_DARKNESS_FOR_WATERING), "DARK", "Too dark."),
+    )),
+)
+
+# --- Time Service Configuration ---
+TIME_NTP_HOST = "pool.ntp.org"   # SNTP server
+TIME_NTP_PORT = 123              # SNTP port
+TIME_NTP_TIMEOUT_MS = 3000       # Timeout for a single SNTP request
+TIME_UTC_OFFSET_MIN = 180        # Standard time offset from UTC in minutes (Turkey: +3h)
+TIME_DST_RULE = None             # Daylight saving rule: None, "EU" or "US"
+TIME_MAX_ERROR_MS = 1000         # Allowed clock error before a resync is needed
+TIME_RESYNC_MIN_S = 3600         # Never resync more often than this
+TIME_RESYNC_MAX_S = 86400        # Always resync at least this often
 
 # --- System Timing Parameters ---
 SENSOR_POWER_ON_DELAY_MS = 100    # Delay after powering on sensors
 DHT_READ_INTERVAL_MS = 30000      # Interval between DHT sensor readings
+DHT_MIN_READ_INTERVAL_MS = 1100   # DHT11 minimum spacing between reads (also first retry delay)
 APP_LOOP_INTERVAL_S = 3           # Main application loop interval (increased frequency, but not too fast)
 LOW_WATER_ALARM_INTERVAL_S = 180  # Interval for low water alarm
 HTTP_BLYNK_UPDATE_INTERVAL_S = 15 # Blynk HTTP update interval (increased frequency, but not too fast)
+MQTT_RECONNECT_MIN_MS = 1000      # First MQTT reconnect delay (doubles on each failure)
+MQTT_RECONNECT_MAX_MS = 120000    # Upper bound for MQTT reconnect delay
+DOWNLINK_SETTLE_MS = 400          # Apply a setting downlink once its datastream was quiet this long (0 = at once)
+DOWNLINK_SETTLE_MAX_MS = 2000     # ...but at the latest this long after the first value of a burst
+
+# --- Dual-Core Execution ---
+DUALCORE_ENABLED = False          # Sample sensors and switch the pump on core 1 (_thread)
+DUALCORE_SAMPLE_MS = 1000         # Core 1 sampling period
+DUALCORE_FILTER_SHIFT = 2         # Raw ADC smoothing: EMA weight 1/2**N (0 = off)
+DUALCORE_RING_SIZE = 8            # Slots in the readings and command rings
+DUALCORE_PUMP_MAX_MS = 60000      # Core 1 stops a pump run without its own length after this
+DUALCORE_STALE_SAMPLES = 5        # Core 0 takes over when core 1's newest sample is this many periods old
+
+# --- DNS Cache ---
+DNS_SERVER = None                 # None = the server DHCP handed out
+DNS_TIMEOUT_MS = 2000             # Timeout of a background DNS query
+DNS_MIN_TTL_S = 60                # Clamp record TTLs to this range
+DNS_MAX_TTL_S = 86400
+DNS_DEFAULT_TTL_S = 300           # TTL for answers from the blocking resolver (TTL unknown)
+DNS_STALE_MAX_S = 86400           # Keep serving an expired answer this long while refreshing
+DNS_FALLBACK = {}                 # Host -> ["a.b.c.d", ...] if it can't be resolved at all
+
+# --- System Messages (V6) ---
+SYSMSG_QUEUE_SIZE = 8             # Pending messages kept; repeats are merged with a count
+SYSMSG_MAX_PER_MIN = 6            # Publish at most this many messages per minute
+SYSMSG_LOW_INTERVAL_S = 3600      # Errors/diagnostics go out at most once per this interval
+
+# --- OTA Updates (lib/ota.py, announced on downlink/ota/json) ---
+OTA_ENABLED = True                # Accept firmware bundles over the air
+OTA_CHUNK_BYTES = 1024            # Download/flash write size per step
+OTA_CHUNK_PAUSE_MS = 20           # Yield to MQTT and the app loop between chunks
+OTA_TIMEOUT_MS = 10000            # Give up if the server stalls this long
+OTA_MAX_BYTES = 524288            # Largest bundle accepted
+OTA_HEALTH_TIMEOUT_S = 300        # New firmware must report healthy this soon or it is rolled back
+OTA_STAGING_DIR = "ota_new"       # Downloaded files wait here until the swap
+OTA_BACKUP_DIR = "ota_old"        # Replaced files, kept until the update is confirmed
+OTA_STATE_FILE = "ota_state.json" # Update journal
+
+# --- Traffic Accounting (lib/netstats.py; overheads and radio figures are estimates) ---
+NET_PACKET_OVERHEAD = 40          # TCP/IP header bytes per packet
+NET_TLS_RECORD_OVERHEAD = 29      # TLS record header + AEAD tag per packet
+NET_TLS_HANDSHAKE_BYTES = 6000    # Full TLS handshake including the certificate chain
+NET_TLS_RESUMED_BYTES = 600       # Resumed TLS handshake
+NET_HTTP_HEADER_BYTES = 200       # Response headers urequests reads but doesn't expose
+NET_LINK_KBPS = 1000              # Effective Wi-Fi throughput for airtime
+NET_RADIO_TAIL_MS = 200           # Radio stays up this long after a transfer (power-save timeout)
+NET_RADIO_ACTIVE_MA = 70          # Average radio current while up, for the mAh estimate
+NET_HOURS_KEPT = 24               # Hourly totals kept in RAM
+NET_REPORT_VPIN = None            # Publish each finished hour as JSON to this virtual pin (None = off)
+
+# --- Persistent State ---
+PERSIST_FILE_BASE = "state"       # Saved as state_a.bin / state_b.bin on flash
+PERSIST_QUIET_MS = 5000           # Write after settings have been unchanged this long
+PERSIST_MAX_DELAY_MS = 60000      # Write at the latest this long after the first change
+
+# --- Garbage Collection ---
+GC_THRESHOLD_MARGIN = 2           # Automatic GC threshold: N x (idle trigger + largest per-cycle allocation)
+GC_IDLE_MIN_ALLOC = 8192          # Idle collection only if this much was allocated since the last one
+GC_FRAG_EVERY = 20                # Probe the largest free block every N idle collections (0 = never)
+GC_LOG_LEN = 8                    # Collections kept in gcpolicy.log
+
+# --- LAN Status Server ---
+STATUS_HTTP_ENABLED = True        # Serve /status and /metrics on the local network
+STATUS_HTTP_PORT = 8080           # TCP port of the status server
+STATUS_REFRESH_MS = 30000         # Re-render at least this often even if readings are unchanged
+STATUS_READ_TIMEOUT_MS = 5000     # Drop a client that hasn't sent its request headers by then
+
+# --- Sensor Trace Recording (replay with tools/replay.py) ---
+TRACE_ENABLED = False             # Record sensor cycles and downlinks to flash
+TRACE_FILE = "trace.bin"          # Trace file (rotated to trace.bin.old)
+TRACE_MAX_BYTES = 262144          # Rotate the trace file at this size
 
 # --- Buzzer Sound Configuration ---
 TONE_STARTUP_SEQUENCE = [(523, 100), (659, 100), (784, 100), (1046, 200)]  # C5, E5, G5, C6
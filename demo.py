@@ -1,11 +1,48 @@
 import machine
 import dht
 import config
+import timesvc
+from dht_reader import DHTReader
+import inputs
+import tones
+import tracelog
+import dualcore
+import rules
+import msgqueue
+import dnscache
+import endpoints
+import ota
+import netstats
+import wifi
+import snapshot
+import fastpath
+from persist import StateStore
 import urequests
-import gc
+import sys
 import utime
 import uasyncio as asyncio
 
+# Newer urequests only re-exports requests ("from requests import *"); the
+# socket calls are then made in requests, so that is the module to patch
+_http = sys.modules.get("requests")
+if _http is None or getattr(_http, "get", None) is not urequests.get:
+    _http = urequests
+dnscache.install(_http)
+
+# Tone sequences (frequency Hz, duration ms), built once at import
+SEQ_STARTUP = ((523, 100), (659, 100), (784, 150))         # C5, E5, G5
+SEQ_SHUTDOWN = ((784, 150), (659, 100), (523, 100))        # G5, E5, C5
+SEQ_AUTO_WATERING = ((880, 120), (988, 120), (1047, 200))  # A5, B5, C6
+SEQ_WATERING_END = ((600, 100),)
+SEQ_SETTING_CHANGE = ((1200, 50),)
+SEQ_PUMP_ON = ((659, 120),)
+SEQ_PUMP_OFF = ((523, 80),)
+SEQ_LOW_WATER = (config.TONE_LOW_WATER_ALARM,)
+SEQ_TEST = ((1000, 500),)
+
+# Persistent state: lockout_s, auto_s, manual_s, soil_threshold, last_watering_s, cloud_dirty
+STATE_FORMAT = "IHHBIB"
+
 class Device:
     def __init__(self, mqtt_client):
         self.mqtt = mqtt_client
@@ -58,6 +95,7 @@ class Device:
         self.LDR_ADC_MAX_DARKNESS_FOR_WATERING = config.LDR_ADC_MAX_DARKNESS_FOR_WATERING
         self.SENSOR_POWER_ON_DELAY_MS = config.SENSOR_POWER_ON_DELAY_MS
         self.DHT_READ_INTERVAL_MS = config.DHT_READ_INTERVAL_MS
+        self.DHT_MIN_READ_INTERVAL_MS = config.DHT_MIN_READ_INTERVAL_MS
         self.LOW_WATER_ALARM_INTERVAL_S = config.LOW_WATER_ALARM_INTERVAL_S
         self.DEVICE_ID = config.DEVICE_ID
 
@@ -67,24 +105,44 @@ class Device:
         self.water_adc = machine.ADC(self.PIN_WATER_LEVEL_ADC)
         self.ldr_adc = machine.ADC(self.PIN_LDR_ADC)
         self.dht_sensor = dht.DHT11(machine.Pin(self.PIN_DHT11_DATA))
+        self.dht_reader = DHTReader(self.dht_sensor, self.DHT_READ_INTERVAL_MS, self.DHT_MIN_READ_INTERVAL_MS)
         self.pump_pin = machine.Pin(self.PIN_PUMP_CONTROL, machine.Pin.OUT, value=0)
         self.buzzer_pwm = machine.PWM(machine.Pin(self.PIN_BUZZER))
         self.buzzer_pwm.duty_u16(0)
+        self.tones = tones.ToneSequencer(self.buzzer_pwm)
         self.power_button = machine.Pin(self.PIN_SYSTEM_POWER_BUTTON, machine.Pin.IN, machine.Pin.PULL_UP)
 
-        # Blynk URL
-        self.blynk_url = f"https://{config.BLYNK_MQTT_BROKER}/external/api/batch/update?token={config.BLYNK_AUTH_TOKEN}"
+        # Optional: sampling and pump switching on core 1 (started by main.py)
+        self.core1 = None
+        if config.DUALCORE_ENABLED:
+            self.core1 = dualcore.Core1(self, config.DUALCORE_SAMPLE_MS, config.DUALCORE_FILTER_SHIFT,
+                                        config.DUALCORE_RING_SIZE, config.DUALCORE_PUMP_MAX_MS,
+                                        config.DUALCORE_STALE_SAMPLES)
+        self._core1_ok = True   # False while core 0 has taken over from a stopped/stalled core 1
 
         # State variables
-        self.last_dht_read_ms = 0
-        self.cached_temp, self.cached_hum = None, None
         self.last_watering_s = 0
-        self.current_soil_percent, self.current_water_percent = 0, 0
-        self.current_light_percent, self.current_raw_ldr_adc = 0, 0
-        self.current_raw_soil_adc = 0
-        self.current_raw_water_adc = 0
-        self.rtc = machine.RTC()
-        self.last_system_message_s = 0  # Track last V6 message time
+        # Readings: one snapshot per sampling cycle; seq of the last one logic/HTTP handled
+        self.bus = snapshot.Bus()
+        self.bus.subscribe(self._trace_snapshot)
+        self._logic_seq = 0
+        self._http_seq = 0
+        self.last_system_message_s = 0  # Last terminal status print
+        self.messages = msgqueue.MessageQueue(config.SYSMSG_QUEUE_SIZE, config.SYSMSG_MAX_PER_MIN,
+                                              config.SYSMSG_LOW_INTERVAL_S)
+        self.stats = {"http_ok": 0, "http_err": 0, "mqtt_pub": 0, "mqtt_err": 0}
+        # Setting downlinks waiting out the settle window: topic -> [payload, first_ms, due_ms]
+        self._settling = {}
+        self._settle_event = asyncio.Event()
+        self.downlink_stats = {"received": 0, "applied": 0, "coalesced": 0}
+        self._downlink_handlers = {
+            "downlink/ds/Auto Watering Duration": self._handle_auto_duration,
+            "downlink/ds/Manual Watering Duration": self._handle_manual_duration,
+            "downlink/ds/Soil Moisture Threshold": self._handle_soil_threshold,
+            "downlink/ds/Watering Lockout": self._handle_lockout,
+            "downlink/ds/Water Pump Manual Control": self._handle_pump_control,
+            "downlink/ota/json": self._handle_ota,
+        }
 
         # Config variables
         self.min_seconds_between_watering_config = self.MIN_SECONDS_BETWEEN_WATERING_DEFAULT
@@ -92,186 +150,216 @@ class Device:
         self.pump_run_duration_manual_s = 10
         self.soil_watering_threshold_config = self.THRESHOLD_SOIL_MOISTURE_WATERING_DEFAULT
 
+        # Persistent settings; cloud_dirty has a bit per setting not yet echoed to Blynk
+        self._setting_bits = {
+            self.VPIN_WATERING_LOCKOUT_HOURS: 1,
+            self.VPIN_MANUAL_WATERING_DURATION_S: 2,
+            self.VPIN_AUTO_WATERING_DURATION_S: 4,
+            self.VPIN_SOIL_MOISTURE_THRESHOLD: 8,
+        }
+        self.cloud_dirty = 0x0F
+        self.store = StateStore(STATE_FORMAT, self._state_fields, config.PERSIST_FILE_BASE,
+                                quiet_ms=config.PERSIST_QUIET_MS, max_delay_ms=config.PERSIST_MAX_DELAY_MS)
+        self._load_state()
+
         # Alarm and system state
         self.low_water_alarm_active = False
         self.last_low_water_alarm_played_s = 0
         self.system_active = False
-        self.last_button_press_time_ms = 0
+        self.last_decision = []
+        self.rules = rules.Engine(config.RULES)
+        self._rule_actions = {
+            "low_water_alarm": self._act_low_water_alarm,
+            "auto_water": self._act_auto_water,
+        }
+        for rule in self.rules.rules:
+            if rule.action and rule.action not in self._rule_actions:
+                raise ValueError("unknown rule action " + rule.action)
         self.button_debounce_duration_ms = 250
+        inputs.bus.add(self.power_button, "power", self._on_power_button,
+                       inputs.FALLING, self.button_debounce_duration_ms)
 
         print("Device initialized.")
 
-    async def _play_tone_async(self, frequency, duration_ms, duty_cycle=32768):
-        if frequency <= 0:
+    def _state_fields(self):
+        return (self.min_seconds_between_watering_config, self.pump_run_duration_auto_s,
+                self.pump_run_duration_manual_s, self.soil_watering_threshold_config,
+                self.last_watering_s, self.cloud_dirty)
+
+    def _load_state(self):
+        # Restore settings and watering lockout saved before the last reboot
+        fields = self.store.load()
+        if fields is None:
+            print("No saved state, using defaults.")
             return
-        try:
-            self.buzzer_pwm.freq(frequency)
-            self.buzzer_pwm.duty_u16(duty_cycle)
-            await asyncio.sleep_ms(duration_ms)
-        except Exception as e:
-            pass
-        finally:
-            self.buzzer_pwm.duty_u16(0)
+        (self.min_seconds_between_watering_config, self.pump_run_duration_auto_s,
+         self.pump_run_duration_manual_s, self.soil_watering_threshold_config,
+         self.last_watering_s, self.cloud_dirty) = fields
+        print(f"State restored in {self.store.load_ms} ms.")
+
+    def _on_power_button(self, name, level):
+        # Called from the input bus task after a debounced press (inputs.py)
+        if level == 0:
+            self.toggle_system_power()
 
     async def test_buzzer(self):
         # Test buzzer with a simple tone
         print("Testing buzzer...")
-        await self._play_tone_async(1000, 500)  # 1000Hz, 500ms
-
-    async def play_sound_sequence_async(self, tones_sequence, inter_tone_delay_ms=50):
-        # Play tone sequence
-        print(f"Playing sound sequence: {tones_sequence}")
-        try:
-            for freq, duration in tones_sequence:
-                await self._play_tone_async(freq, duration)
-                if inter_tone_delay_ms > 0:
-                    await asyncio.sleep_ms(inter_tone_delay_ms)
-        except Exception as e:
-            print(f"Sound sequence error: {e}")
-        finally:
-            self.buzzer_pwm.duty_u16(0)
-            print("Sound sequence stopped.")
+        self.tones.play(SEQ_TEST, tones.PRIO_ACTION, replace=True)
 
     def stop_buzzer(self):
         # Buzzer'ı hemen durdur
-        try:
-            self.buzzer_pwm.duty_u16(0)
-        except Exception:
-            pass
+        self.tones.stop()
 
     def play_startup_sound(self):
         # Play three-note startup sequence
-        startup_sequence = [(523, 100), (659, 100), (784, 150)]  # C5, E5, G5
-        self.loop.create_task(self.play_sound_sequence_async(startup_sequence, 100))
+        self.tones.play(SEQ_STARTUP, tones.PRIO_ACTION, 100, replace=True)
 
     def play_shutdown_sound(self):
         # Play three-note shutdown sequence
-        shutdown_sequence = [(784, 150), (659, 100), (523, 100)]  # G5, E5, C5
-        self.loop.create_task(self.play_sound_sequence_async(shutdown_sequence, 100))
+        self.tones.play(SEQ_SHUTDOWN, tones.PRIO_ACTION, 100, replace=True)
 
     def play_watering_action_sound(self, start=True):
         # Sadece manuel sulama için ses
-        self.stop_buzzer()
         if not start:  # Sadece bitişte ses çal
-            self.loop.create_task(self._play_tone_async(600, 100))
+            self.tones.play(SEQ_WATERING_END, tones.PRIO_ACTION, replace=True)
 
     def play_setting_change_sound(self):
         # Ayar değişikliği sesi, çakışmayı önle
-        self.stop_buzzer()
-        self.loop.create_task(self._play_tone_async(1200, 50))
+        self.tones.play(SEQ_SETTING_CHANGE, tones.PRIO_UI, replace=True)
 
     def play_auto_watering_sound(self):
         # Otomatik sulama için farklı bir ses dizisi
-        self.stop_buzzer()
-        auto_sequence = [(880, 120), (988, 120), (1047, 200)]  # A5, B5, C6
-        self.loop.create_task(self.play_sound_sequence_async(auto_sequence, 80))
+        self.tones.play(SEQ_AUTO_WATERING, tones.PRIO_ACTION, 80, replace=True)
 
     async def low_water_alarm_task(self):
         # Low water alarm
         self.low_water_alarm_active = True
         print("Starting low water alarm task...")
         while self.low_water_alarm_active and self.system_active:
-            if self.current_raw_water_adc < self.WATER_ADC_LOW_THRESHOLD_VALUE and self.current_raw_water_adc != 0:
-                if hasattr(config, 'TONE_LOW_WATER_ALARM'):
-                    print(f"Playing low water alarm: {config.TONE_LOW_WATER_ALARM}")
-                    await self._play_tone_async(config.TONE_LOW_WATER_ALARM[0], config.TONE_LOW_WATER_ALARM[1])
+            raw_water = self.bus.latest.raw_water
+            if raw_water < self.WATER_ADC_LOW_THRESHOLD_VALUE and raw_water != 0:
+                print(f"Playing low water alarm: {config.TONE_LOW_WATER_ALARM}")
+                self.tones.play(SEQ_LOW_WATER, tones.PRIO_ALARM)
             else:
                 self.low_water_alarm_active = False
                 break
             await asyncio.sleep(self.LOW_WATER_ALARM_INTERVAL_S)
-        self.buzzer_pwm.duty_u16(0)
         print("Low water alarm task stopped.")
 
-    def _read_adc_avg_sync(self, adc_obj, samples=10, delay_ms=5):
-        # Read ADC average
-        total = 0
-        count = 0
-        for _ in range(samples):
-            try:
-                total += adc_obj.read_u16()
-                count += 1
-                if delay_ms > 0:
-                    utime.sleep_ms(delay_ms)
-            except OSError:
-                pass
-        return total // count if count > 0 else 32767
-
-    def _map_value(self, x, in_min, in_max, out_min, out_max, clamp=True):
-        # Map value
-        if clamp:
-            phys_min = min(in_min, in_max)
-            phys_max = max(in_min, in_max)
-            x = max(phys_min, min(x, phys_max))
-        if (in_max - in_min) == 0:
-            return out_min
-        return int(((x - in_min) * (out_max - out_min)) / (in_max - in_min) + out_min)
-
-    def read_soil_percentage(self):
-        # Read soil moisture
+    # Read ADC average / map value: compiled to machine code on the Pico (fastpath.py)
+    _read_adc_avg_sync = staticmethod(fastpath.adc_avg)
+    _map_value = staticmethod(fastpath.map_value)
+
+    def read_soil_raw(self):
+        # Read soil moisture; the probe is only powered while sampling
         self.soil_vcc.high()
         utime.sleep_ms(self.SENSOR_POWER_ON_DELAY_MS)
         raw = self._read_adc_avg_sync(self.soil_adc, samples=15)
         self.soil_vcc.low()
-        self.current_raw_soil_adc = raw
-        self.current_soil_percent = self._map_value(raw, self.CAL_SOIL_ADC_DRY, self.CAL_SOIL_ADC_WET, 0, 100)
-        return self.current_soil_percent
-
-    def read_light_percentage(self):
-        # Read light level
-        raw = self._read_adc_avg_sync(self.ldr_adc, samples=5)
-        self.current_raw_ldr_adc = raw
-        self.current_light_percent = self._map_value(raw, self.CAL_LDR_ADC_BRIGHT, self.CAL_LDR_ADC_DARK, 100, 10)
-        return self.current_light_percent
-
-    def read_temperature_humidity(self):
-        # Read temperature and humidity
-        if utime.ticks_diff(utime.ticks_ms(), self.last_dht_read_ms) > self.DHT_READ_INTERVAL_MS or self.cached_temp is None:
-            try:
-                self.dht_sensor.measure()
-                temp = self.dht_sensor.temperature()
-                hum = self.dht_sensor.humidity()
-                self.cached_temp = temp if -20 <= temp <= 60 else None
-                self.cached_hum = hum if 0 <= hum <= 100 else None
-                self.last_dht_read_ms = utime.ticks_ms()
-            except Exception:
-                self.cached_temp = None
-                self.cached_hum = None
-        return self.cached_temp, self.cached_hum
-
-    def read_water_level_percentage(self):
-        # Read water level
-        raw = self._read_adc_avg_sync(self.water_adc, samples=15)
-        self.current_raw_water_adc = raw
-        self.current_water_percent = self._map_value(raw, self.CAL_WATER_ADC_EMPTY, self.CAL_WATER_ADC_FULL, 0, 100)
-        return self.current_water_percent
+        return raw
+
+    def read_light_raw(self):
+        return self._read_adc_avg_sync(self.ldr_adc, samples=5)
+
+    def read_water_raw(self):
+        return self._read_adc_avg_sync(self.water_adc, samples=15)
+
+    def core1_active(self):
+        # Core 1 exists and keeps sampling; reports switching sides once
+        if not self.core1:
+            return False
+        self.core1.poll()
+        ok = self.core1.healthy()
+        if ok != self._core1_ok:
+            self._core1_ok = ok
+            if ok:
+                msg = "Core 1 recovered"
+            else:
+                msg = "Core 1 stalled, using core 0"
+                self.pump_pin.off()   # core 1 may no longer enforce the run's deadline
+            print(msg)
+            self.send_system_message_mqtt(msg)
+        return ok
+
+    def read_from_core1(self):
+        # Newest filtered (soil, water, ldr) sample from core 1; None before the
+        # first one, or when core 1 has stopped or stalled
+        if not self.core1_active():
+            return None
+        r = self.core1.latest
+        if r[0] == 0:
+            return None
+        return r[2], r[3], r[4]
 
     async def read_all_sensors_sequentially(self):
-        # Read all sensors
+        # Sample all sensors, then publish the cycle as one snapshot
         if not self.system_active:
             return
-        self.read_soil_percentage()
-        await asyncio.sleep_ms(50)
-        self.read_water_level_percentage()
-        await asyncio.sleep_ms(50)
-        self.read_light_percentage()
-        await asyncio.sleep_ms(50)
-        self.read_temperature_humidity()
+        raw = self.read_from_core1() if self.core1 else None
+        if not self.core1 or not self._core1_ok:
+            soil = self.read_soil_raw()
+            await asyncio.sleep_ms(50)
+            water = self.read_water_raw()
+            await asyncio.sleep_ms(50)
+            raw = (soil, water, self.read_light_raw())
+            await asyncio.sleep_ms(50)
+        prev = self.bus.latest
+        if raw is None:
+            raw = (prev.raw_soil, prev.raw_water, prev.raw_ldr)
+            pct = (prev.soil, prev.water, prev.light)
+        else:
+            pct = (self._map_value(raw[0], self.CAL_SOIL_ADC_DRY, self.CAL_SOIL_ADC_WET, 0, 100),
+                   self._map_value(raw[1], self.CAL_WATER_ADC_EMPTY, self.CAL_WATER_ADC_FULL, 0, 100),
+                   self._map_value(raw[2], self.CAL_LDR_ADC_BRIGHT, self.CAL_LDR_ADC_DARK, 100, 10))
+        # Latest good DHT values from the background reader (never blocks)
+        self.bus.publish(snapshot.Snapshot(
+            prev.seq + 1, utime.ticks_ms(), timesvc.utc_s(), raw[0], raw[1], raw[2], pct[0], pct[1], pct[2],
+            self.dht_reader.temperature, self.dht_reader.humidity, self.pump_state()))
+
+    def _trace_snapshot(self, snap):
+        tracelog.sensors(snap.utc, timesvc.utc_offset_min(), snap.raw_soil, snap.raw_water, snap.raw_ldr,
+                         snap.temp, snap.hum, snap.pump)
+
+    def pump_state(self):
+        if self.core1 and self._core1_ok:
+            return self.core1.pump_state
+        return self.pump_pin.value()
+
+    def pump_on(self, run_s=None):
+        # With core 1, the run time travels with the command and core 1 ends the run itself
+        if self.core1_active():
+            if not self.core1.pump_on(None if run_s is None else int(run_s * 1000)):
+                print("Pump command queue full!")
+        else:
+            self.pump_pin.on()
+
+    def pump_off(self):
+        if self.core1_active():
+            if not self.core1.pump_off():
+                print("Pump command queue full!")
+        else:
+            self.pump_pin.off()
 
     def update_blynk_http(self):
         # Update Blynk via HTTP
-        if not self.system_active:
+        if not self.system_active or not wifi.up():
+            return
+        # Nothing new since the last update
+        snap = self.bus.fresh(self._http_seq)
+        if snap is None:
             return
         payload = {}
-        if self.current_soil_percent is not None:
-            payload[f"V{config.VPIN_SOIL_MOISTURE_PERCENT}"] = self.current_soil_percent
-        if self.current_light_percent is not None:
-            payload[f"V{config.VPIN_LIGHT_LEVEL_PERCENT}"] = self.current_light_percent
-        if self.cached_temp is not None:
-            payload[f"V{config.VPIN_TEMPERATURE}"] = self.cached_temp
-        if self.cached_hum is not None:
-            payload[f"V{config.VPIN_HUMIDITY}"] = self.cached_hum
-        if self.current_water_percent is not None:
-            payload[f"V{config.VPIN_WATER_LEVEL_PERCENT}"] = self.current_water_percent
+        if snap.soil is not None:
+            payload[f"V{config.VPIN_SOIL_MOISTURE_PERCENT}"] = snap.soil
+        if snap.light is not None:
+            payload[f"V{config.VPIN_LIGHT_LEVEL_PERCENT}"] = snap.light
+        if snap.temp is not None:
+            payload[f"V{config.VPIN_TEMPERATURE}"] = snap.temp
+        if snap.hum is not None:
+            payload[f"V{config.VPIN_HUMIDITY}"] = snap.hum
+        if snap.water is not None:
+            payload[f"V{config.VPIN_WATER_LEVEL_PERCENT}"] = snap.water
         if self.last_watering_s > 0:
             elapsed_seconds = utime.time() - self.last_watering_s
             elapsed_hours = elapsed_seconds // 3600
@@ -285,22 +373,31 @@ class Device:
         payload[f"V{config.VPIN_SOIL_MOISTURE_THRESHOLD}"] = self.soil_watering_threshold_config
 
         if payload:
+            tx = 0
             try:
                 query = "&".join([f"{k}={v}" for k, v in payload.items()])
-                url = f"{self.blynk_url}&{query}"
+                host = endpoints.current()
+                url = f"https://{host}/external/api/batch/update?token={config.BLYNK_AUTH_TOKEN}&{query}"
                 print(f"[BLYNK HTTP] URL: {url}")
+                tx = len(url) + 17   # "GET <path> HTTP/1.0", Host header, blank line
                 resp = urequests.get(url, timeout=7)
                 print(f"[BLYNK HTTP] Response: {resp.text if hasattr(resp, 'text') else resp.content}")
+                netstats.add("http", tx, len(resp.content) + config.NET_HTTP_HEADER_BYTES, 2, 1, tls=True)
                 resp.close()
-                gc.collect()
+                self.stats["http_ok"] += 1
+                self._http_seq = snap.seq
+                endpoints.report(host, True)
                 self.last_sensor_update_s = utime.time()  # Update last sensor update time
             except Exception as e:
+                netstats.add("http", tx, 0, 1, 1, tls=True)
+                self.stats["http_err"] += 1
+                endpoints.report(host, False)
                 print(f"HTTP Error: {e}")
                 self.send_system_message_mqtt(f"HTTP Error: {e}")
 
     def test_blynk_http(self):
         # Manuel test fonksiyonu: sabit değerlerle Blynk'e veri gönderir
-        test_url = f"https://{config.BLYNK_MQTT_BROKER}/external/api/update?token={config.BLYNK_AUTH_TOKEN}&V0=55&V1=77"
+        test_url = f"https://{endpoints.current()}/external/api/update?token={config.BLYNK_AUTH_TOKEN}&V0=55&V1=77"
         print(f"[TEST] Blynk HTTP Test URL: {test_url}")
         try:
             resp = urequests.get(test_url, timeout=7)
@@ -326,44 +423,42 @@ class Device:
                 print("MQTT not ready.")
             self._mqtt_ready_log_state = ready
 
-    async def wait_for_mqtt(self):
-        # Wait for MQTT to be ready
-        for _ in range(10):
-            if self._is_mqtt_ready():
-                return True
-            await asyncio.sleep(1)
-        print("MQTT connection timeout.")
-        return False
-
     def update_blynk_mqtt_pump_status(self):
         # Update pump status instantly (V4)
-        if not self.system_active and self.pump_pin.value() == 1:
-            self.pump_pin.off()
+        if not self.system_active and self.pump_state() == 1:
+            self.pump_off()
         if self._is_mqtt_ready():
             try:
                 topic = f"ds/{self.DEVICE_ID}/dp/V{self.VPIN_PUMP_SWITCH}"
-                value = str(self.pump_pin.value())
+                value = str(self.pump_state())
                 print(f"Publishing pump status: topic={topic}, value={value}")
                 self.mqtt.publish(topic.encode('utf-8'), value.encode('utf-8'), qos=0)
+                self.stats["mqtt_pub"] += 1
             except Exception as e:
+                self.stats["mqtt_err"] += 1
                 print(f"MQTT Pump Error: {e}")
                 self.send_system_message_mqtt(f"MQTT Pump Error: {e}")
+            netstats.mqtt("pump", self.mqtt)
 
-    async def send_system_message_mqtt_async(self, message, force=False):
-        if not await self.wait_for_mqtt():
-            return
-        now_s = utime.time()
-        if force or (now_s - self.last_system_message_s >= 3600):  # 1 saatte bir normal mesaj
-            try:
-                now_dt = self.rtc.datetime()
-                timestamp = f"{now_dt[4]:02d}:{now_dt[5]:02d}> "
-                full_message = timestamp + str(message)[:64]
-                topic = f"ds/{self.DEVICE_ID}/dp/V{self.VPIN_SYSTEM_MESSAGE}"
-                print(f"Sending to V6: {full_message}")
-                self.mqtt.publish(topic.encode('utf-8'), full_message.encode('utf-8'), qos=1)
-                self.last_system_message_s = now_s
-            except Exception as e:
-                print(f"MQTT Error: {e}")
+    def _publish_system_message(self, message):
+        # Called by the message queue's sender task only
+        try:
+            now_dt = timesvc.localtime()
+            full_message = f"{now_dt[3]:02d}:{now_dt[4]:02d}> {message}"
+            topic = f"ds/{self.DEVICE_ID}/dp/V{self.VPIN_SYSTEM_MESSAGE}"
+            print(f"Sending to V6: {full_message}")
+            self.mqtt.publish(topic.encode('utf-8'), full_message.encode('utf-8'), qos=1)
+            self.stats["mqtt_pub"] += 1
+            return True
+        except Exception as e:
+            self.stats["mqtt_err"] += 1
+            print(f"MQTT Error: {e}")
+            return False
+        finally:
+            netstats.mqtt("sysmsg", self.mqtt)
+
+    async def message_task(self):
+        await self.messages.task(self._is_mqtt_ready, self._publish_system_message)
 
     def send_blynk_value_mqtt(self, vpin, value):
         # Send value to Blynk
@@ -372,37 +467,50 @@ class Device:
                 topic = f"ds/{self.DEVICE_ID}/dp/V{vpin}"
                 print(f"Sending MQTT: topic={topic}, value={value}")
                 self.mqtt.publish(topic.encode('utf-8'), str(value).encode('utf-8'), qos=0)
+                self.stats["mqtt_pub"] += 1
+                return True
             except Exception as e:
+                self.stats["mqtt_err"] += 1
                 print(f"MQTT V{vpin} Send Error: {e}")
                 self.send_system_message_mqtt(f"MQTT V{vpin} Send Error: {e}")
+            finally:
+                netstats.mqtt("mqtt", self.mqtt)
+        return False
 
-    def send_system_message_mqtt(self, message, force=False):
-        # Send system message to V6 (synchronous wrapper)
-        if self._is_mqtt_ready():
-            self.loop.create_task(self.send_system_message_mqtt_async(message, force))
-
-    def _is_daytime(self):
-        # Check if daytime
-        return self.current_light_percent >= self.LDR_DAYTIME_MIN_LIGHT_PERCENT
+    def _sync_setting(self, vpin, value, accepted=True):
+        # Echo a setting to Blynk and track whether the cloud matches the device
+        bit = self._setting_bits[vpin]
+        dirty = self.cloud_dirty
+        sent = self.send_blynk_value_mqtt(vpin, value)
+        if not accepted:
+            dirty |= bit  # cloud holds a rejected value; resend ours on next connect
+        elif sent:
+            dirty &= ~bit
+        if dirty != self.cloud_dirty:
+            self.cloud_dirty = dirty
+            self.store.mark_dirty()
 
-    def _is_efficient_time_for_watering(self):
-        # Check watering time
-        hour = self.rtc.datetime()[4]
-        return self.WATERING_ALLOWED_HOUR_START <= hour < self.WATERING_ALLOWED_HOUR_END
+    def send_system_message_mqtt(self, message, force=False):
+        # Queue a V6 message; forced ones are confirmations and go out first
+        self.messages.put(message, msgqueue.PRIO_HIGH if force else msgqueue.PRIO_LOW)
 
     def print_sensor_data_to_terminal(self, info_messages=None):
         # Print sensor data to terminal
         current_time = utime.time()
         if current_time - self.last_system_message_s >= 15 or info_messages:
+            snap = self.bus.latest
             print("\n=== System Status ===")
             # Format time nicely
-            dt = self.rtc.datetime()
-            print(f"Time: {dt[2]:02d}/{dt[1]:02d}/{dt[0]} {dt[4]:02d}:{dt[5]:02d}:{dt[6]:02d}")
-            print(f"Soil Moisture: {self.current_soil_percent}%")
-            print(f"Water Level: {self.current_water_percent}%")
-            print(f"Light Level: {self.current_light_percent}%")
-            print(f"Temperature: {self.cached_temp}°C")
-            print(f"Humidity: {self.cached_hum}%")
+            dt = timesvc.localtime()
+            print(f"Time: {dt[2]:02d}/{dt[1]:02d}/{dt[0]} {dt[3]:02d}:{dt[4]:02d}:{dt[5]:02d}")
+            print(f"Soil Moisture: {snap.soil}%")
+            print(f"Water Level: {snap.water}%")
+            print(f"Light Level: {snap.light}%")
+            print(f"Temperature: {snap.temp}°C")
+            print(f"Humidity: {snap.hum}%")
+            dht_age = self.dht_reader.age_ms()
+            if dht_age is not None and dht_age > 2 * self.DHT_READ_INTERVAL_MS:
+                print(f"DHT: stale {dht_age // 1000}s, {self.dht_reader.failures} errors")
             # Show last watering time in hours and minutes
             if self.last_watering_s > 0:
                 elapsed_seconds = current_time - self.last_watering_s
@@ -419,11 +527,11 @@ class Device:
             else:
                 print("Last Sensor Update: Never")
             # System messages
-            if self.current_water_percent < 20:
+            if snap.water < config.WATER_MIN_PERCENT:
                 print("WARNING: Low water level!")
-            if self.current_soil_percent < self.soil_watering_threshold_config:
+            if snap.soil < self.soil_watering_threshold_config:
                 print("INFO: Soil moisture below threshold")
-            if self.current_light_percent < self.THRESHOLD_LIGHT_INSUFFICIENT:
+            if snap.light < self.THRESHOLD_LIGHT_INSUFFICIENT:
                 print("INFO: Insufficient light level")
             # Print extra info messages (e.g. auto watering)
             if info_messages:
@@ -432,113 +540,174 @@ class Device:
             print("===================\n")
             self.last_system_message_s = current_time
 
+    def _update_facts(self, now_s, snap):
+        # Rule inputs; unchanged values don't trigger a re-evaluation
+        f = self.rules.set
+        f("soil", snap.soil)
+        f("water", snap.water)
+        f("light", snap.light)
+        f("water_raw", snap.raw_water)
+        f("ldr_raw", snap.raw_ldr)
+        f("pump", self.pump_state())
+        f("hour", timesvc.local_hour())
+        f("soil_thr", self.soil_watering_threshold_config)
+        left = max(0, self.min_seconds_between_watering_config - (now_s - self.last_watering_s))
+        f("lock_left_s", left)
+        f("lock_left_h", left // 3600)
+
     async def run_smart_plant_logic(self):
         if not self.system_active:
             return
-        messages = []
+        # Decide once per sampling cycle
+        snap = self.bus.fresh(self._logic_seq)
+        if snap is None:
+            return
+        self._logic_seq = snap.seq
         now_s = utime.time()
+        self._update_facts(now_s, snap)
+        self.rules.run()
         info_messages = []
-        # Light check
-        if self._is_daytime() and self.current_light_percent < self.THRESHOLD_LIGHT_INSUFFICIENT:
-            messages.append("LOW LIGHT")
-        # Water level check
-        if self.current_raw_water_adc < self.WATER_ADC_LOW_THRESHOLD_VALUE and self.current_raw_water_adc != 0:
-            messages.append("LOW WATER")
+        for rule in self.rules.rules:
+            if rule.action:
+                await self._rule_actions[rule.action](rule, now_s, info_messages)
+        self.last_decision = self.rules.messages()
+        # Print all status and info together
+        self.print_sensor_data_to_terminal(info_messages=info_messages)
+
+    async def _act_low_water_alarm(self, rule, now_s, info_messages):
+        if rule.state == rules.FIRE:
             if (not self.low_water_alarm_active and
                 now_s - self.last_low_water_alarm_played_s > self.LOW_WATER_ALARM_INTERVAL_S * 3):
                 self.loop.create_task(self.low_water_alarm_task())
                 self.last_low_water_alarm_played_s = now_s
-        elif self.low_water_alarm_active and self.current_raw_water_adc >= self.WATER_ADC_LOW_THRESHOLD_VALUE:
+        elif self.low_water_alarm_active and self.bus.latest.raw_water >= self.WATER_ADC_LOW_THRESHOLD_VALUE:
             self.low_water_alarm_active = False
-        # Soil moisture check and watering logic
-        if self.current_soil_percent < self.soil_watering_threshold_config:
-            info_messages.append("Automatic watering needed.")
-            if self.pump_pin.value() == 1:
-                info_messages.append("Pump is already running.")
-            elif self.current_water_percent < 20:
-                info_messages.append("Automatic watering could not start: Water level is low.")
-                messages.append("NO WATER")
-            elif not self._is_efficient_time_for_watering():
-                info_messages.append("Automatic watering could not start: Not allowed time.")
-                messages.append("NIGHT")
-            elif (now_s - self.last_watering_s) < self.min_seconds_between_watering_config:
-                remaining_time = self.min_seconds_between_watering_config - (now_s - self.last_watering_s)
-                info_messages.append(f"Automatic watering could not start: Locked ({remaining_time//3600}h left).")
-                messages.append(f"LOCK {remaining_time//3600}h")
-            elif self.current_raw_ldr_adc >= self.LDR_ADC_MAX_DARKNESS_FOR_WATERING:
-                info_messages.append("Automatic watering could not start: Too dark.")
-                messages.append("DARK")
-            else:
-                info_messages.append("Automatic watering started.")
-                self.play_auto_watering_sound()
-                messages.append("AUTO")
-                self.pump_pin.on()
-                self.update_blynk_mqtt_pump_status()
-                await asyncio.sleep(self.pump_run_duration_auto_s)
-                self.pump_pin.off()
-                self.play_watering_action_sound(start=False)
-                self.update_blynk_mqtt_pump_status()
-                self.last_watering_s = now_s
-        # Print all status and info together
-        self.print_sensor_data_to_terminal(info_messages=info_messages)
+
+    async def _act_auto_water(self, rule, now_s, info_messages):
+        if rule.state == rules.OFF:
+            return
+        info_messages.append("Automatic watering needed.")
+        if rule.state == rules.BLOCKED:
+            info_messages.append(f"Automatic watering could not start: {rule.reason}")
+            return
+        info_messages.append("Automatic watering started.")
+        self.play_auto_watering_sound()
+        self.pump_on(self.pump_run_duration_auto_s)
+        self.update_blynk_mqtt_pump_status()
+        await asyncio.sleep(self.pump_run_duration_auto_s)
+        self.pump_off()
+        self.play_watering_action_sound(start=False)
+        self.update_blynk_mqtt_pump_status()
+        self.last_watering_s = now_s
+        self.store.mark_dirty()
 
     def blynk_connected_callback(self):
         print("MQTT Connected")
         if self._is_mqtt_ready():
             try:
                 self.update_blynk_mqtt_pump_status()
-                self.send_blynk_value_mqtt(self.VPIN_WATERING_LOCKOUT_HOURS, self.min_seconds_between_watering_config // 3600)
-                self.send_blynk_value_mqtt(self.VPIN_MANUAL_WATERING_DURATION_S, self.pump_run_duration_manual_s)
-                self.send_blynk_value_mqtt(self.VPIN_AUTO_WATERING_DURATION_S, self.pump_run_duration_auto_s)
-                self.send_blynk_value_mqtt(self.VPIN_SOIL_MOISTURE_THRESHOLD, self.soil_watering_threshold_config)
+                # Only settings the cloud doesn't have yet (restored ones already match)
+                for vpin, value in ((self.VPIN_WATERING_LOCKOUT_HOURS, self.min_seconds_between_watering_config // 3600),
+                                    (self.VPIN_MANUAL_WATERING_DURATION_S, self.pump_run_duration_manual_s),
+                                    (self.VPIN_AUTO_WATERING_DURATION_S, self.pump_run_duration_auto_s),
+                                    (self.VPIN_SOIL_MOISTURE_THRESHOLD, self.soil_watering_threshold_config)):
+                    if self.cloud_dirty & self._setting_bits[vpin]:
+                        self._sync_setting(vpin, value)
             except Exception as e:
                 print(f"MQTT Error: {e}")
 
     def blynk_process_mqtt_message(self, topic_bytes, payload_bytes):
+        tracelog.downlink(timesvc.utc_s(), topic_bytes, payload_bytes)
         topic = topic_bytes.decode('utf-8')
         payload = payload_bytes.decode('utf-8')
         print(f"Received MQTT message: topic={topic}, payload={payload}")
 
-        # Topic mapping
-        topic_mapping = {
-            "downlink/ds/Auto Watering Duration": self._handle_auto_duration,
-            "downlink/ds/Manual Watering Duration": self._handle_manual_duration,
-            "downlink/ds/Soil Moisture Threshold": self._handle_soil_threshold,
-            "downlink/ds/Watering Lockout": self._handle_lockout,
-            "downlink/ds/Water Pump Manual Control": self._handle_pump_control
-        }
-
-        handler = topic_mapping.get(topic)
-        if handler:
-            handler(payload)
-        else:
+        handler = self._downlink_handlers.get(topic)
+        if not handler:
             print(f"Unknown MQTT topic: {topic}")
             self.send_system_message_mqtt(f"Unknown MQTT topic: {topic}")
+            return
+        self.downlink_stats["received"] += 1
+        if (handler == self._handle_pump_control or not topic.startswith("downlink/ds/")
+                or config.DOWNLINK_SETTLE_MS <= 0):
+            # Pump commands (and anything that isn't a setting) never wait
+            self.downlink_stats["applied"] += 1
+            handler(payload)
+            return
+        # A slider drag sends a burst on one datastream: keep only the latest
+        # value until the stream has been quiet for DOWNLINK_SETTLE_MS
+        now = utime.ticks_ms()
+        pending = self._settling.get(topic)
+        if pending:
+            self.downlink_stats["coalesced"] += 1
+            pending[0] = payload
+            pending[2] = utime.ticks_add(now, config.DOWNLINK_SETTLE_MS)
+            if utime.ticks_diff(pending[2], pending[1]) > config.DOWNLINK_SETTLE_MAX_MS:
+                pending[2] = utime.ticks_add(pending[1], config.DOWNLINK_SETTLE_MAX_MS)
+        else:
+            self._settling[topic] = [payload, now, utime.ticks_add(now, config.DOWNLINK_SETTLE_MS)]
+        self._settle_event.set()
+
+    def apply_settled_downlinks(self):
+        # Apply every setting whose settle window is over; returns ms until the next one, or None
+        wait = None
+        now = utime.ticks_ms()
+        for topic in list(self._settling):
+            payload, _, due = self._settling[topic]
+            left = utime.ticks_diff(due, now)
+            if left > 0:
+                wait = left if wait is None else min(wait, left)
+                continue
+            del self._settling[topic]
+            self.downlink_stats["applied"] += 1
+            self._downlink_handlers[topic](payload)
+        return wait
+
+    async def downlink_task(self):
+        while True:
+            self._settle_event.clear()
+            wait = self.apply_settled_downlinks()
+            if wait is None:
+                await self._settle_event.wait()
+            else:
+                try:
+                    await asyncio.wait_for_ms(self._settle_event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
 
     def _handle_pump_control(self, payload):
         # Handle pump control from Blynk
         try:
-            self.stop_buzzer()
             if payload == "1":
-                self.pump_pin.on()
+                self.pump_on()
                 # Hızlı ve kısa bir ses
-                self.loop.create_task(self._play_tone_async(659, 120))
+                self.tones.play(SEQ_PUMP_ON, tones.PRIO_ACTION, replace=True)
                 print("Pump turned ON via Blynk")
             else:
-                self.pump_pin.off()
-                self.loop.create_task(self._play_tone_async(523, 80))
+                self.pump_off()
+                self.tones.play(SEQ_PUMP_OFF, tones.PRIO_ACTION, replace=True)
                 print("Pump turned OFF via Blynk")
         except Exception as e:
             print(f"Pump control error: {e}")
 
+    def _handle_ota(self, payload):
+        # Firmware update announced by Blynk (or tools/ota_standin.py)
+        if not config.OTA_ENABLED:
+            print("OTA disabled, ignoring update")
+            return
+        self.send_system_message_mqtt("OTA update started", force=True)
+        asyncio.create_task(ota.update(payload))
+
     def _handle_lockout(self, payload):
         try:
             h = int(payload)
-            if 0 <= h <= 48:
+            accepted = 0 <= h <= 48
+            if accepted:
                 self.min_seconds_between_watering_config = h * 3600
+                self.store.mark_dirty()
                 self.send_system_message_mqtt(f"Lock: {h}h", force=True)
                 self.play_setting_change_sound()
-            self.send_blynk_value_mqtt(self.VPIN_WATERING_LOCKOUT_HOURS, h)
+            self._sync_setting(self.VPIN_WATERING_LOCKOUT_HOURS, h, accepted)
         except Exception as e:
             print(f"Lockout error: {e}")
             self.send_system_message_mqtt(f"Lockout error: {e}")
@@ -546,11 +715,13 @@ class Device:
     def _handle_manual_duration(self, payload):
         try:
             s = int(payload)
-            if 1 <= s <= 60:
+            accepted = 1 <= s <= 60
+            if accepted:
                 self.pump_run_duration_manual_s = s
+                self.store.mark_dirty()
                 self.send_system_message_mqtt(f"Manual: {s}s", force=True)
                 self.play_setting_change_sound()
-            self.send_blynk_value_mqtt(self.VPIN_MANUAL_WATERING_DURATION_S, s)
+            self._sync_setting(self.VPIN_MANUAL_WATERING_DURATION_S, s, accepted)
         except Exception as e:
             print(f"Manual duration error: {e}")
             self.send_system_message_mqtt(f"Manual duration error: {e}")
@@ -558,11 +729,13 @@ class Device:
     def _handle_auto_duration(self, payload):
         try:
             s = int(payload)
-            if 1 <= s <= 60:
+            accepted = 1 <= s <= 60
+            if accepted:
                 self.pump_run_duration_auto_s = s
+                self.store.mark_dirty()
                 self.send_system_message_mqtt(f"Auto: {s}s", force=True)
                 self.play_setting_change_sound()
-            self.send_blynk_value_mqtt(self.VPIN_AUTO_WATERING_DURATION_S, s)
+            self._sync_setting(self.VPIN_AUTO_WATERING_DURATION_S, s, accepted)
         except Exception as e:
             print(f"Auto duration error: {e}")
             self.send_system_message_mqtt(f"Auto duration error: {e}")
@@ -570,11 +743,13 @@ class Device:
     def _handle_soil_threshold(self, payload):
         try:
             threshold = int(payload)
-            if 5 <= threshold <= 70:
+            accepted = 5 <= threshold <= 70
+            if accepted:
                 self.soil_watering_threshold_config = threshold
+                self.store.mark_dirty()
                 self.send_system_message_mqtt(f"Soil: {threshold}%", force=True)
                 self.play_setting_change_sound()
-            self.send_blynk_value_mqtt(self.VPIN_SOIL_MOISTURE_THRESHOLD, threshold)
+            self._sync_setting(self.VPIN_SOIL_MOISTURE_THRESHOLD, threshold, accepted)
         except Exception as e:
             print(f"Soil threshold error: {e}")
             self.send_system_message_mqtt(f"Soil threshold error: {e}")
@@ -584,21 +759,22 @@ class Device:
             print("Cannot start manual water: System is OFF.")
             self.send_system_message_mqtt("Cannot start: System OFF", force=True)
             return
-        if self.current_water_percent < 20:
-            print("Cannot start manual water: Water level below 20%.")
+        if self.bus.latest.water < config.WATER_MIN_PERCENT:
+            print(f"Cannot start manual water: Water level below {config.WATER_MIN_PERCENT}%.")
             self.send_system_message_mqtt("Cannot start: Low water", force=True)
             return
-        if self.pump_pin.value() == 0:
+        if self.pump_state() == 0:
             print(f"Manual watering: {self.pump_run_duration_manual_s}s")
             self.send_system_message_mqtt(f"Manual watering: {self.pump_run_duration_manual_s}s", force=True)
             self.play_watering_action_sound(start=True)
-            self.pump_pin.on()
+            self.pump_on(self.pump_run_duration_manual_s)
             self.update_blynk_mqtt_pump_status()
             await asyncio.sleep(self.pump_run_duration_manual_s)
-            self.pump_pin.off()
+            self.pump_off()
             self.play_watering_action_sound(start=False)
             self.update_blynk_mqtt_pump_status()
             self.last_watering_s = utime.time()
+            self.store.mark_dirty()
             print("Manual watering finished.")
             self.send_system_message_mqtt("Manual watering done", force=True)
 
@@ -608,20 +784,17 @@ class Device:
         self.send_system_message_mqtt("Device: MQTT Connection Lost")
 
     def toggle_system_power(self):
-        current_time_ms = utime.ticks_ms()
-        if utime.ticks_diff(current_time_ms, self.last_button_press_time_ms) > self.button_debounce_duration_ms:
-            self.last_button_press_time_ms = current_time_ms
-            self.system_active = not self.system_active
-            if self.system_active:
-                print("System ON")
-                self.play_startup_sound()
-                self.loop.create_task(self.read_all_sensors_sequentially())
-                self.update_blynk_http()
-            else:
-                print("System OFF")
-                self.play_shutdown_sound()
-                self.pump_pin.off()
-                self.update_blynk_mqtt_pump_status()
-                self.low_water_alarm_active = False
-            return True
-        return False
+        # Button debouncing happens in the input bus
+        self.system_active = not self.system_active
+        tracelog.power(timesvc.utc_s(), self.system_active)
+        if self.system_active:
+            print("System ON")
+            self.play_startup_sound()
+            self.loop.create_task(self.read_all_sensors_sequentially())
+            self.update_blynk_http()
+        else:
+            print("System OFF")
+            self.play_shutdown_sound()
+            self.pump_off()
+            self.update_blynk_mqtt_pump_status()
+            self.low_water_alarm_active = False
@@ -1,5 +1,12 @@
-import gc, sys, time, machine, json, asyncio
+import sys, time, machine, json, asyncio, random
 import config
+import startup
+import timesvc
+import gcpolicy
+import dnscache
+import endpoints
+import netstats
+import wifi
 from umqtt.simple import MQTTClient, MQTTException
 
 def _dummy(*args):
@@ -11,6 +18,17 @@ on_message = _dummy
 firmware_version = "0.1.0"
 connection_count = 0
 
+# Reconnect instrumentation: connect+handshake+subscribe time in ms
+reconnect_stats = {
+    "attempts": 0,
+    "failures": 0,
+    "resumed": 0,
+    "last_ms": 0,
+    "min_ms": 0,
+    "max_ms": 0,
+    "total_ms": 0,
+}
+
 LOGO = r"""
       ___  __          __
      / _ )/ /_ _____  / /__
@@ -43,25 +61,44 @@ def _on_message(topic, payload):
         sys.print_exception(e)
 
 ssl_ctx = None
-if sys.platform in ("esp32", "rp2", "linux"):
-    import ssl
-    ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-    ssl_ctx.verify_mode = ssl.CERT_REQUIRED
-    ssl_ctx.load_verify_locations(cafile="ISRG_Root_X1.der")
 
-mqtt = MQTTClient(client_id="", server=config.BLYNK_MQTT_BROKER, ssl=ssl_ctx,
+def init_ssl():
+    # Build the SSL context on demand instead of at import time, so the
+    # caller decides when to spend the CPU on parsing the CA file.
+    global ssl_ctx
+    if ssl_ctx is None and sys.platform in ("esp32", "rp2", "linux"):
+        import ssl
+        ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ssl_ctx.verify_mode = ssl.CERT_REQUIRED
+        ssl_ctx.load_verify_locations(cafile=config.BLYNK_MQTT_CA_FILE)
+        mqtt.ssl = ssl_ctx
+    return ssl_ctx
+
+mqtt = MQTTClient(client_id="", server=config.BLYNK_MQTT_BROKER, port=config.BLYNK_MQTT_PORT,
                   user="device", password=config.BLYNK_AUTH_TOKEN, keepalive=45)
 mqtt.set_callback(_on_message)
+mqtt.getaddrinfo = dnscache.getaddrinfo
 
 async def _mqtt_connect():
     global connection_count
     mqtt.disconnect()
-    gc.collect()
+    netstats.mqtt("mqtt", mqtt)
+    # TLS needs large contiguous buffers; collect now rather than mid-handshake
+    gcpolicy.collect("mqtt_connect")
     print("Connecting to MQTT broker...")
+    reconnect_stats["attempts"] += 1
+    host = endpoints.current()
+    if mqtt.server != host or mqtt.port != endpoints.current_port():
+        mqtt.server = host
+        mqtt.port = endpoints.current_port()
+        mqtt.ssl_session = None   # a session from another server can't be resumed
+    t0 = time.ticks_ms()
     try:
         mqtt.connect()
         mqtt.subscribe("downlink/#")
-        print("Connected to Blynk.Cloud", "[secure]" if ssl_ctx else "[insecure]")
+        _record_connect(time.ticks_diff(time.ticks_ms(), t0))
+        print("Connected to Blynk.Cloud", "[secure]" if ssl_ctx else "[insecure]",
+              "[resumed]" if mqtt.ssl_reused else "", reconnect_stats["last_ms"], "ms")
 
         info = {
             "type": config.BLYNK_TEMPLATE_ID,
@@ -70,54 +107,86 @@ async def _mqtt_connect():
             "rxbuff": 1024
         }
         mqtt.publish("info/mcu", json.dumps(info))
+        netstats.mqtt("connect", mqtt, 1)
+        startup.mark("mqtt_connected")
+        endpoints.report(host, True, mqtt.port)
         connection_count += 1
         on_connected()
     except Exception as e:
+        netstats.mqtt("connect", mqtt, 1)
+        reconnect_stats["failures"] += 1
+        endpoints.report(host, False, mqtt.port)
         print("Connection failed:", e)
         raise
 
+def _record_connect(ms):
+    st = reconnect_stats
+    st["last_ms"] = ms
+    st["total_ms"] += ms
+    if st["min_ms"] == 0 or ms < st["min_ms"]:
+        st["min_ms"] = ms
+    if ms > st["max_ms"]:
+        st["max_ms"] = ms
+    if mqtt.ssl_reused:
+        st["resumed"] += 1
+
+def _backoff_ms(failures):
+    # Exponential backoff with equal jitter, so a fleet doesn't retry in lockstep
+    cap = min(config.MQTT_RECONNECT_MAX_MS, config.MQTT_RECONNECT_MIN_MS << min(failures, 16))
+    half = cap // 2
+    return half + (random.getrandbits(16) * (cap - half) >> 16)
+
 async def task():
     connected = False
+    failures = 0
+    init_ssl()
     while True:
         await asyncio.sleep_ms(10)
         if not connected:
+            await wifi.wait_up()
             if ssl_ctx:
                 while not update_ntp_time():
                     await asyncio.sleep(1)
             try:
                 await _mqtt_connect()
                 connected = True
+                failures = 0
             except Exception as e:
                 if isinstance(e, MQTTException) and (e.value == 4 or e.value == 5):
                     print("Invalid BLYNK_AUTH_TOKEN")
                     await asyncio.sleep(15 * 60)
                 else:
-                    print("Connection failed:", e)
-                    await asyncio.sleep(2)
+                    delay = _backoff_ms(failures)
+                    failures += 1
+                    print("Connection failed:", e, "- retry in", delay, "ms")
+                    await asyncio.sleep_ms(delay)
+        elif not wifi.up():
+            # The link is gone; drop the dead session now rather than waiting out the keepalive
+            try:
+                mqtt.sock.close()
+            except Exception:
+                pass
+            mqtt.sock = None
+            connected = False
+            failures = 0
+            on_disconnected()
+        elif mqtt.server != endpoints.current() or mqtt.port != endpoints.current_port():
+            # A faster server was selected; move over without counting a failure
+            print("Moving MQTT to", endpoints.current())
+            connected = False
         else:
             try:
                 mqtt.check_msg()
+                netstats.mqtt("mqtt", mqtt)
             except Exception as e:
                 connected = False
                 on_disconnected()
-                await asyncio.sleep(2)
+                await asyncio.sleep_ms(_backoff_ms(failures))
 
 def update_ntp_time():
+    # Time comes from the background SNTP service (timesvc.task); only check it
     Jan24 = 756_864_000 if (time.gmtime(0)[0] == 2000) else 1_704_067_200
-    if time.time() > Jan24:
-        return True
-
-    print("Getting NTP time...")
-    import ntptime
-    try:
-        ntptime.timeout = 5
-        ntptime.settime()
-        if time.time() > Jan24:
-            print("UTC Time:", time2str(time.gmtime()))
-            return True
-    except Exception as e:
-        print("NTP failed:", e)
-    return False
+    return timesvc.synced() or time.time() > Jan24
 
 def time2str(t):
     y, m, d, H, M, S, w, j = t
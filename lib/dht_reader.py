@@ -0,0 +1,66 @@
+import utime
+import uasyncio as asyncio
+
+# DHT11 sampled from its own task.
+#
+# The sensor needs ~1 s between measurements, so reads are spaced by at least
+# min_interval_ms. Failed reads back off exponentially up to interval_ms and
+# never clear the last good values; consumers read temperature/humidity and
+# age_ms() without ever touching the sensor.
+
+class DHTReader:
+    def __init__(self, sensor, interval_ms, min_interval_ms=1100):
+        self.sensor = sensor
+        self.interval_ms = interval_ms
+        self.min_interval_ms = min_interval_ms
+        self.temperature = None
+        self.humidity = None
+        self.last_good_ms = None
+        self.reads = 0
+        self.failures = 0
+        self.out_of_range = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+
+    def age_ms(self):
+        # ms since the last good reading, or None if there never was one
+        if self.last_good_ms is None:
+            return None
+        return utime.ticks_diff(utime.ticks_ms(), self.last_good_ms)
+
+    def read_once(self):
+        # Single measurement; returns True if a good value was stored
+        self.reads += 1
+        try:
+            self.sensor.measure()
+            temp = self.sensor.temperature()
+            hum = self.sensor.humidity()
+        except Exception as e:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = e
+            return False
+        if not (-20 <= temp <= 60 and 0 <= hum <= 100):
+            self.out_of_range += 1
+            self.consecutive_failures += 1
+            self.last_error = ValueError("out of range: %s/%s" % (temp, hum))
+            return False
+        self.temperature = temp
+        self.humidity = hum
+        self.last_good_ms = utime.ticks_ms()
+        self.consecutive_failures = 0
+        return True
+
+    def next_delay_ms(self):
+        if self.consecutive_failures == 0:
+            return self.interval_ms
+        backoff = self.min_interval_ms << min(self.consecutive_failures - 1, 8)
+        return min(backoff, self.interval_ms)
+
+    async def task(self):
+        # Let the sensor settle after power-up before the first read
+        await asyncio.sleep_ms(self.min_interval_ms)
+        while True:
+            if not self.read_once() and self.consecutive_failures in (1, 10, 100):
+                print(f"DHT read failed x{self.consecutive_failures}: {self.last_error}")
+            await asyncio.sleep_ms(self.next_delay_ms())
@@ -0,0 +1,202 @@
+import socket, struct, utime
+import uasyncio as asyncio
+import config
+import netstats
+import wifi
+
+# Shared DNS cache for MQTT, HTTP and NTP.
+#
+# getaddrinfo() is a drop-in for socket.getaddrinfo(). A cached answer is
+# returned without touching the network, even after its TTL ran out (up to
+# DNS_STALE_MAX_S): task() re-resolves such entries in the background with
+# its own non-blocking query, which also gives us the record's real TTL.
+# Only a host that was never resolved costs a blocking lookup; if that
+# fails, the last known or configured fallback addresses are used.
+#
+# install(module) points a library's "socket" global (requests/urequests)
+# at a wrapper whose getaddrinfo goes through the cache.
+
+_cache = {}   # host -> [ips, expires_ticks, refresh_ticks]
+_event = asyncio.Event()
+stats = {"hits": 0, "stale": 0, "misses": 0, "refreshes": 0, "failures": 0, "fallbacks": 0}
+
+def _is_ip(host):
+    parts = host.split(".")
+    if len(parts) != 4:
+        return False
+    for p in parts:
+        if not p.isdigit():
+            return False
+    return True
+
+def _put(host, ips, ttl_s):
+    # Refresh at 90% of the TTL so a running task() never lets it expire
+    ttl_s = max(config.DNS_MIN_TTL_S, min(ttl_s, config.DNS_MAX_TTL_S))
+    now = utime.ticks_ms()
+    _cache[host] = [ips, utime.ticks_add(now, ttl_s * 1000), utime.ticks_add(now, ttl_s * 900)]
+
+def _left_ms(entry):
+    return utime.ticks_diff(entry[1], utime.ticks_ms())
+
+def _result(ips, port, type):
+    return [(socket.AF_INET, type or socket.SOCK_STREAM, 0, "", (ip, port)) for ip in ips]
+
+def lookup(host):
+    # Cached IPs for host, resolving (blocking) only on a cold miss
+    if _is_ip(host):
+        return [host]
+    entry = _cache.get(host)
+    if entry and entry[0]:
+        left = _left_ms(entry)
+        if left > 0:
+            stats["hits"] += 1
+            return entry[0]
+        if -left < config.DNS_STALE_MAX_S * 1000:
+            stats["stale"] += 1
+            _event.set()   # wake the refresher
+            return entry[0]
+    stats["misses"] += 1
+    try:
+        ips = []
+        for ai in socket.getaddrinfo(host, 53):
+            if ai[-1][0] not in ips:
+                ips.append(ai[-1][0])
+        _put(host, ips, config.DNS_DEFAULT_TTL_S)
+        return ips
+    except OSError:
+        stats["failures"] += 1
+        if entry and entry[0]:
+            return entry[0]
+        ips = config.DNS_FALLBACK.get(host)
+        if ips:
+            stats["fallbacks"] += 1
+            return ips
+        raise
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    return _result(lookup(host), port, type)
+
+def prefetch(host):
+    # Resolve in the background before anyone needs the host
+    if not _is_ip(host) and host not in _cache:
+        now = utime.ticks_ms()
+        _cache[host] = [config.DNS_FALLBACK.get(host, []), now, now]
+        _event.set()
+
+def _server():
+    if config.DNS_SERVER:
+        return config.DNS_SERVER
+    import network
+    return network.WLAN(network.STA_IF).ifconfig()[3]
+
+def _skip_name(msg, pos):
+    while True:
+        n = msg[pos]
+        if n & 0xC0 == 0xC0:
+            return pos + 2
+        pos += 1 + n
+        if n == 0:
+            return pos
+
+async def query(host):
+    # One A-record lookup over non-blocking UDP; returns (ips, ttl_s)
+    addr = socket.getaddrinfo(_server(), 53, 0, socket.SOCK_DGRAM)[0][-1]
+    qid = utime.ticks_ms() & 0xFFFF
+    req = bytearray(struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0))
+    for label in host.split("."):
+        req.append(len(label))
+        req.extend(label.encode())
+    req.extend(b"\x00\x00\x01\x00\x01")
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setblocking(False)
+    try:
+        t0 = utime.ticks_ms()
+        s.sendto(req, addr)
+        while True:
+            try:
+                msg = s.recv(512)
+                if msg and len(msg) >= 12 and struct.unpack_from("!H", msg)[0] == qid:
+                    break
+            except OSError:
+                pass
+            if utime.ticks_diff(utime.ticks_ms(), t0) > config.DNS_TIMEOUT_MS:
+                netstats.add("dns", len(req), 0, 1)
+                raise OSError("DNS timeout")
+            await asyncio.sleep_ms(10)
+    finally:
+        s.close()
+    netstats.add("dns", len(req), len(msg), 2)
+    flags, qd, an = struct.unpack_from("!HHH", msg, 2)
+    if flags & 0x000F:
+        raise OSError("DNS rcode %d" % (flags & 0x000F))
+    pos = 12
+    for _ in range(qd):
+        pos = _skip_name(msg, pos) + 4
+    ips = []
+    ttl = config.DNS_MAX_TTL_S
+    for _ in range(an):
+        pos = _skip_name(msg, pos)
+        rtype, _, rttl, rlen = struct.unpack_from("!HHIH", msg, pos)
+        pos += 10
+        if rtype == 1 and rlen == 4:
+            ips.append("%d.%d.%d.%d" % tuple(msg[pos:pos + 4]))
+            ttl = min(ttl, rttl)
+        pos += rlen
+    if not ips:
+        raise OSError("DNS no A record")
+    return ips, ttl
+
+async def refresh(host):
+    try:
+        ips, ttl = await query(host)
+    except Exception as e:
+        stats["failures"] += 1
+        print(f"DNS refresh {host} failed: {e}")
+        entry = _cache.get(host)
+        if entry:
+            # Retry in a minute; until then the old answer keeps being served
+            entry[2] = utime.ticks_add(utime.ticks_ms(), 60000)
+        return False
+    stats["refreshes"] += 1
+    _put(host, ips, ttl)
+    return True
+
+async def task():
+    # Background refresher: one query per due entry, then sleep until the next is due
+    while True:
+        await wifi.wait_up()
+        _event.clear()
+        wait_ms = 60000
+        for host in list(_cache):
+            due = utime.ticks_diff(_cache[host][2], utime.ticks_ms())
+            if due <= 0:
+                await refresh(host)
+                due = utime.ticks_diff(_cache[host][2], utime.ticks_ms())
+            wait_ms = min(wait_ms, max(due, 1000))
+        try:
+            await asyncio.wait_for_ms(_event.wait(), wait_ms)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _SocketShim:
+    # Looks like the socket module, except that getaddrinfo is cached
+    getaddrinfo = staticmethod(getaddrinfo)
+
+    def __init__(self, mod):
+        self._mod = mod
+
+    def __getattr__(self, name):
+        return getattr(self._mod, name)
+
+def install(module):
+    # Returns how many socket globals were wrapped; with none, the module's
+    # lookups bypass the cache, so say so
+    n = 0
+    for name in ("socket", "usocket"):
+        if hasattr(module, name):
+            setattr(module, name, _SocketShim(getattr(module, name)))
+            n += 1
+    if not n:
+        print("DNS cache: no socket module in %s, its lookups are not cached" % module.__name__)
+    return n
@@ -0,0 +1,230 @@
+import _thread
+import utime
+from array import array
+
+# Sensing and pump control on the second core.
+#
+# Core 1 runs a plain loop (no uasyncio) that samples the ADCs, filters the
+# raw values and switches the pump; core 0 keeps uasyncio, TLS, MQTT and
+# HTTP. The cores only share two single-producer/single-consumer rings:
+#
+#   readings  core 1 -> core 0   (seq, ticks_ms, soil, water, ldr, pump)
+#   commands  core 0 -> core 1   (cmd, arg)
+#
+# A ring slot is written before the producer publishes it by storing the new
+# head index, and the consumer only stores the tail index, so no lock is
+# needed: each index has exactly one writer and a word store is atomic. A
+# full ring drops the new item (and counts it) instead of overwriting a slot
+# the other side may be reading.
+#
+# Pump runs carry their length: core 1 switches the pump off at the deadline
+# itself, so a stalled network call on core 0 cannot stretch a watering.
+# An exception in the core-1 loop is counted and the loop carries on. If
+# core 1 still stops or stalls, healthy() turns False once its newest sample
+# is stale_samples periods old, and Device samples and switches the pump on
+# core 0 instead.
+# The same code runs on CPython threads under tools/hostsim.py.
+
+CMD_PUMP_OFF = 0
+CMD_PUMP_ON = 1    # arg: run time in ms
+
+READING_FIELDS = 6
+
+class Ring:
+    def __init__(self, size, width):
+        self.size = size
+        self.width = width
+        self.buf = array("i", bytes(4 * size * width))
+        self.idx = array("I", (0, 0))   # [head (producer), tail (consumer)]
+        self.dropped = 0
+
+    def put(self, *fields):
+        # Producer side; returns False if the consumer is a full ring behind
+        head = self.idx[0]
+        nxt = (head + 1) % self.size
+        if nxt == self.idx[1]:
+            self.dropped += 1
+            return False
+        base = head * self.width
+        for i in range(self.width):
+            self.buf[base + i] = fields[i]
+        self.idx[0] = nxt
+        return True
+
+    def get(self, out):
+        # Consumer side; copies the oldest item into out, False if empty
+        tail = self.idx[1]
+        if tail == self.idx[0]:
+            return False
+        base = tail * self.width
+        for i in range(self.width):
+            out[i] = self.buf[base + i]
+        self.idx[1] = (tail + 1) % self.size
+        return True
+
+    def __len__(self):
+        return (self.idx[0] - self.idx[1]) % self.size
+
+
+class Core1:
+    def __init__(self, dev, sample_ms, filter_shift, ring_size, pump_max_ms, stale_samples=5):
+        self.dev = dev
+        self.sample_ms = sample_ms
+        self.stale_ms = sample_ms * stale_samples
+        self.shift = filter_shift
+        self.pump_max_ms = pump_max_ms
+        self.readings = Ring(ring_size, READING_FIELDS)
+        self.commands = Ring(ring_size, 2)
+        self.latest = array("i", bytes(4 * READING_FIELDS))
+        self.pump_state = 0   # commanded by core 0, corrected by core 1
+        self.running = False
+        self.stopped = True
+        self.loops = 0
+        self.max_loop_ms = 0
+        self.pump_deadline_stops = 0
+        self.errors = 0
+        self.last_error = None
+        self._started_ms = 0
+        self._seq = 0
+        self._filt = [None, None, None]
+        self._pump_until = None
+        self._cmd = array("i", (0, 0))
+
+    # --- core 0 side ---
+
+    def start(self):
+        self.running = True
+        self.stopped = False
+        self._started_ms = utime.ticks_ms()
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self, timeout_ms=2000):
+        # Ask core 1 to finish its loop (it leaves the pump off)
+        self.running = False
+        t0 = utime.ticks_ms()
+        while not self.stopped and utime.ticks_diff(utime.ticks_ms(), t0) < timeout_ms:
+            utime.sleep_ms(10)
+
+    def pump_on(self, run_ms=None):
+        if run_ms is None or run_ms > self.pump_max_ms:
+            run_ms = self.pump_max_ms
+        if not self.commands.put(CMD_PUMP_ON, run_ms):
+            return False
+        self.pump_state = 1
+        return True
+
+    def pump_off(self):
+        if not self.commands.put(CMD_PUMP_OFF, 0):
+            return False
+        self.pump_state = 0
+        return True
+
+    def poll(self):
+        # Drain the readings ring into self.latest; returns how many were new
+        n = 0
+        while self.readings.get(self.latest):
+            n += 1
+        return n
+
+    def healthy(self):
+        # Core 1 runs and its newest sample (or the start, before the first one) is recent
+        if self.stopped:
+            return False
+        since = self.latest[1] if self.latest[0] else self._started_ms
+        return utime.ticks_diff(utime.ticks_ms(), since) <= self.stale_ms
+
+    # --- core 1 side ---
+
+    def _filter(self, i, raw):
+        # Integer EMA with weight 1/2**shift; the first sample seeds it
+        f = self._filt[i]
+        if f is None:
+            f = raw
+        elif raw != 32767:   # every read failed; keep the filtered value
+            f += (raw - f) >> self.shift
+        self._filt[i] = f
+        return f
+
+    def _command(self, cmd):
+        pump = self.dev.pump_pin
+        if cmd[0] == CMD_PUMP_ON:
+            pump.on()
+            self._pump_until = utime.ticks_add(utime.ticks_ms(), cmd[1])
+        else:
+            pump.off()
+            self._pump_until = None
+        self.pump_state = pump.value()
+
+    def _check_pump(self):
+        if self._pump_until is not None and utime.ticks_diff(utime.ticks_ms(), self._pump_until) >= 0:
+            self.dev.pump_pin.off()
+            self._pump_until = None
+            self.pump_state = 0
+            self.pump_deadline_stops += 1
+
+    def _avg(self, adc, samples, delay_ms=5):
+        # Same averaging as Device._read_adc_avg_sync, but the gaps between
+        # samples service pump commands
+        total = 0
+        count = 0
+        for _ in range(samples):
+            try:
+                total += adc.read_u16()
+                count += 1
+            except OSError:
+                pass
+            self._wait(delay_ms)
+        return total // count if count > 0 else 32767
+
+    def _sample(self):
+        dev = self.dev
+        dev.soil_vcc.high()
+        self._wait(dev.SENSOR_POWER_ON_DELAY_MS)
+        soil = self._avg(dev.soil_adc, 15)
+        dev.soil_vcc.low()
+        water = self._avg(dev.water_adc, 15)
+        ldr = self._avg(dev.ldr_adc, 5)
+        self._seq += 1
+        self.readings.put(self._seq, utime.ticks_ms(), self._filter(0, soil),
+                          self._filter(1, water), self._filter(2, ldr), dev.pump_pin.value())
+
+    def _wait(self, ms):
+        # Sleep in short steps so pump commands and deadlines stay on time
+        end = utime.ticks_add(utime.ticks_ms(), ms)
+        cmd = self._cmd
+        while True:
+            while self.commands.get(cmd):
+                self._command(cmd)
+            self._check_pump()
+            left = utime.ticks_diff(end, utime.ticks_ms())
+            if left <= 0 or not self.running:
+                return
+            utime.sleep_ms(min(left, 10))
+
+    def _run(self):
+        try:
+            next_ms = utime.ticks_ms()
+            while self.running:
+                try:
+                    t0 = utime.ticks_ms()
+                    self._sample()
+                    dt = utime.ticks_diff(utime.ticks_ms(), t0)
+                    if dt > self.max_loop_ms:
+                        self.max_loop_ms = dt
+                    self.loops += 1
+                    next_ms = utime.ticks_add(next_ms, self.sample_ms)
+                    if utime.ticks_diff(next_ms, utime.ticks_ms()) < 0:
+                        next_ms = utime.ticks_ms()   # overran; don't try to catch up
+                    self._wait(utime.ticks_diff(next_ms, utime.ticks_ms()))
+                except Exception as e:
+                    # Keep sampling and enforcing pump deadlines; a dead loop would freeze both
+                    self.errors += 1
+                    self.last_error = e
+                    print("Core 1 error:", e)
+                    next_ms = utime.ticks_ms()
+                    utime.sleep_ms(self.sample_ms)
+        finally:
+            self.dev.pump_pin.off()
+            self._pump_until = None
+            self.pump_state = 0
+            self.stopped = True
@@ -0,0 +1,122 @@
+import utime
+import uasyncio as asyncio
+import config
+import dnscache
+import wifi
+
+# Blynk server selection.
+#
+# config.BLYNK_HOSTS lists candidate servers ("host" or "host:mqtt_port");
+# MQTT and the HTTP API always use the same one. task() periodically probes
+# every candidate (TCP connect + TLS handshake, no MQTT session) and keeps a
+# smoothed RTT per host. The current server only changes when another one is
+# clearly faster (ENDPOINT_SWITCH_MARGIN_PCT and ENDPOINT_SWITCH_MIN_MS), or
+# when ENDPOINT_MAX_ERRORS consecutive probes/connects to it failed.
+
+def _parse(entry):
+    if ":" in entry:
+        host, port = entry.split(":", 1)
+        return host, int(port)
+    return entry, config.BLYNK_MQTT_PORT
+
+hosts = [_parse(h) for h in (config.BLYNK_HOSTS or (config.BLYNK_MQTT_BROKER,))]
+rtt_ms = [None] * len(hosts)   # smoothed probe RTT; None until a probe succeeded
+errors = [0] * len(hosts)      # consecutive failures
+_current = 0
+stats = {"probes": 0, "probe_failures": 0, "switches": 0, "failovers": 0}
+
+def current():
+    return hosts[_current][0]
+
+def current_port():
+    return hosts[_current][1]
+
+def _index(host, port=None):
+    for i in range(len(hosts)):
+        if hosts[i][0] == host and (port is None or hosts[i][1] == port):
+            return i
+    return None
+
+def _healthy(i):
+    return errors[i] < config.ENDPOINT_MAX_ERRORS
+
+def _switch(i, why):
+    global _current
+    if i == _current:
+        return False
+    print("Endpoint: %s:%d -> %s:%d (%s)" % (hosts[_current] + hosts[i] + (why,)))
+    _current = i
+    stats["switches"] += 1
+    return True
+
+def _select():
+    # Fastest healthy host, with hysteresis against the current one
+    best = None
+    for i in range(len(hosts)):
+        if _healthy(i) and rtt_ms[i] is not None and (best is None or rtt_ms[i] < rtt_ms[best]):
+            best = i
+    if best is None or best == _current:
+        return False
+    cur = rtt_ms[_current]
+    if not _healthy(_current) or cur is None:
+        return _switch(best, "current unreachable")
+    if (rtt_ms[best] * 100 < cur * (100 - config.ENDPOINT_SWITCH_MARGIN_PCT)
+            and cur - rtt_ms[best] >= config.ENDPOINT_SWITCH_MIN_MS):
+        return _switch(best, f"{rtt_ms[best]} ms vs {cur} ms")
+    return False
+
+def report(host, ok, port=None):
+    # Outcome of a real MQTT/HTTP connection to host (port: the MQTT one)
+    i = _index(host, port)
+    if i is None:
+        return
+    if ok:
+        errors[i] = 0
+        return
+    errors[i] += 1
+    if i == _current and not _healthy(i):
+        stats["failovers"] += 1
+        if not _select():
+            # Nothing measured is healthy: try the next candidate in turn
+            for k in range(1, len(hosts)):
+                j = (i + k) % len(hosts)
+                if _healthy(j):
+                    _switch(j, "failover")
+                    break
+            else:
+                _switch((i + 1) % len(hosts), "failover")
+
+async def probe(i, ssl_ctx=None):
+    # TCP connect (+ TLS handshake) time to hosts[i] in ms, or None
+    host, port = hosts[i]
+    stats["probes"] += 1
+    t0 = utime.ticks_ms()
+    try:
+        ip = dnscache.lookup(host)[0]
+        if ssl_ctx:
+            conn = asyncio.open_connection(ip, port, ssl=ssl_ctx, server_hostname=host)
+        else:
+            conn = asyncio.open_connection(ip, port)
+        reader, writer = await asyncio.wait_for_ms(conn, config.ENDPOINT_PROBE_TIMEOUT_MS)
+        ms = utime.ticks_diff(utime.ticks_ms(), t0)
+        writer.close()
+        await writer.wait_closed()
+    except Exception as e:
+        stats["probe_failures"] += 1
+        errors[i] += 1
+        print(f"Endpoint probe {host}:{port} failed: {e}")
+        return None
+    errors[i] = 0
+    rtt_ms[i] = ms if rtt_ms[i] is None else (3 * rtt_ms[i] + ms) // 4
+    return ms
+
+async def task(ssl_ctx=None):
+    # Nothing to choose from with a single candidate
+    if len(hosts) < 2:
+        return
+    while True:
+        await wifi.wait_up()
+        for i in range(len(hosts)):
+            await probe(i, ssl_ctx)
+        _select()
+        await asyncio.sleep(config.ENDPOINT_PROBE_INTERVAL_S)
@@ -0,0 +1,122 @@
+import sys
+import utime
+
+# Hot inner loops, compiled to machine code on the Pico.
+#
+# Each function has a pure-Python reference (*_py). On MicroPython the
+# public name is an @micropython.native / @micropython.viper variant; on
+# CPython (hostsim tools) the reference is used. Both variants must return
+# the same results: tools/fastpath_bench.py checks that and times them.
+#
+#   adc_avg      Device._read_adc_avg_sync: average of n ADC reads
+#   map_value    Device._map_value: linear calibration with clamping
+#   put_varint   MQTT remaining-length encoding in CONNECT/PUBLISH headers
+#   recv_varint  MQTT remaining-length decoding in wait_msg()
+
+def adc_avg_py(adc, samples=10, delay_ms=5):
+    total = 0
+    count = 0
+    for _ in range(samples):
+        try:
+            total += adc.read_u16()
+            count += 1
+            if delay_ms > 0:
+                utime.sleep_ms(delay_ms)
+        except OSError:
+            pass
+    return total // count if count > 0 else 32767
+
+def map_value_py(x, in_min, in_max, out_min, out_max, clamp=True):
+    if clamp:
+        phys_min = min(in_min, in_max)
+        phys_max = max(in_min, in_max)
+        x = max(phys_min, min(x, phys_max))
+    if (in_max - in_min) == 0:
+        return out_min
+    return int(((x - in_min) * (out_max - out_min)) / (in_max - in_min) + out_min)
+
+def put_varint_py(buf, sz):
+    # Remaining length into buf[1:]; returns the index of its last byte
+    i = 1
+    while sz > 0x7F:
+        buf[i] = (sz & 0x7F) | 0x80
+        sz >>= 7
+        i += 1
+    buf[i] = sz
+    return i
+
+def recv_varint_py(read):
+    n = 0
+    sh = 0
+    while 1:
+        b = read(1)[0]
+        n |= (b & 0x7F) << sh
+        if not b & 0x80:
+            return n
+        sh += 7
+
+if sys.implementation.name == "micropython":
+    import micropython
+
+    @micropython.native
+    def adc_avg(adc, samples=10, delay_ms=5):
+        # Bound methods and a while loop: no lookups or range object per sample
+        read = adc.read_u16
+        sleep = utime.sleep_ms
+        total = 0
+        count = 0
+        n = 0
+        while n < samples:
+            n += 1
+            try:
+                total += read()
+                count += 1
+                if delay_ms > 0:
+                    sleep(delay_ms)
+            except OSError:
+                pass
+        return total // count if count else 32767
+
+    @micropython.native
+    def map_value(x, in_min, in_max, out_min, out_max, clamp=True):
+        # Compares instead of min()/max() calls; same float expression
+        if clamp:
+            if in_min < in_max:
+                lo, hi = in_min, in_max
+            else:
+                lo, hi = in_max, in_min
+            if x < lo:
+                x = lo
+            elif x > hi:
+                x = hi
+        span = in_max - in_min
+        if span == 0:
+            return out_min
+        return int(((x - in_min) * (out_max - out_min)) / span + out_min)
+
+    @micropython.viper
+    def put_varint(buf: ptr8, sz: int) -> int:
+        # No bounds check: callers size buf for the largest length they allow
+        i = 1
+        while sz > 0x7F:
+            buf[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        buf[i] = sz
+        return i
+
+    @micropython.native
+    def recv_varint(read):
+        n = 0
+        sh = 0
+        while True:
+            b = read(1)[0]
+            n |= (b & 0x7F) << sh
+            if not b & 0x80:
+                return n
+            sh += 7
+else:
+    adc_avg = adc_avg_py
+    map_value = map_value_py
+    put_varint = put_varint_py
+    recv_varint = recv_varint_py
@@ -0,0 +1,114 @@
+import gc, utime
+import config
+
+# Explicit garbage collection policy.
+#
+# The app loop calls idle_collect() between control cycles, and code about
+# to need a big contiguous buffer (TLS handshake) calls collect() first.
+#
+# MicroPython's default gc.threshold is -1: collect only when an allocation
+# fails, i.e. at a random point once the heap is full. setup() leaves that
+# in place until idle_collect() has measured how much one app cycle
+# allocates. It then sets the threshold to GC_THRESHOLD_MARGIN x (idle
+# trigger + largest per-cycle allocation seen), which normal cycles never
+# reach before idle_collect() runs. The automatic collection stays as a
+# backstop for unusual bursts and fires before the heap is exhausted.
+#
+# Every explicit collection is timed; the pause stats cover gc.collect()
+# alone. Every GC_FRAG_EVERY-th idle collection is followed by a
+# largest-free-block probe: a binary search with throwaway allocations that
+# costs about 14 collections, so it never runs outside idle windows and its
+# time and collections are kept apart in frag_us / frag_collections.
+# The last GC_LOG_LEN collections are kept as (reason, us, free,
+# largest_free), largest_free being the most recent probe result.
+
+stats = {
+    "count": 0,
+    "last_us": 0,
+    "max_us": 0,
+    "total_us": 0,
+    "free": 0,
+    "largest_free": 0,
+    "frag_us": 0,
+    "frag_collections": 0,
+    "threshold": -1,
+    "cycle_alloc": 0,
+    "max_reason": "",
+}
+log = []
+_alloc_after = 0   # live heap right after the last explicit collection
+_cycles = 0        # idle_collect() calls since then
+_idle_count = 0
+
+def setup():
+    gc.collect()
+    heap = gc.mem_free() + gc.mem_alloc()
+    stats["free"] = gc.mem_free()
+    print(f"GC: heap {heap} B, automatic threshold set once a cycle is measured")
+
+def largest_free_block():
+    # Biggest bytearray that can be allocated right now (16-byte resolution)
+    # and the number of collections that took: one per step, since a failed
+    # allocation also makes the allocator collect
+    lo, hi = 0, gc.mem_free()
+    n = 0
+    while hi - lo > 16:
+        mid = (lo + hi) // 2
+        n += 1
+        try:
+            buf = bytearray(mid)
+            buf = None
+            gc.collect()
+            lo = mid
+        except MemoryError:
+            hi = mid
+    return lo, n
+
+def collect(reason=""):
+    global _alloc_after, _cycles
+    t0 = utime.ticks_us()
+    gc.collect()
+    us = utime.ticks_diff(utime.ticks_us(), t0)
+    stats["count"] += 1
+    stats["last_us"] = us
+    stats["total_us"] += us
+    if us > stats["max_us"]:
+        stats["max_us"] = us
+        stats["max_reason"] = reason
+    stats["free"] = gc.mem_free()
+    _alloc_after = gc.mem_alloc()
+    _cycles = 0
+    log.append((reason, us, stats["free"], stats["largest_free"]))
+    if len(log) > config.GC_LOG_LEN:
+        log.pop(0)
+    return us
+
+def _tune(alloc, cycles):
+    # Keep the automatic threshold above what the app allocates between idle collections
+    per_cycle = alloc // cycles
+    if per_cycle <= stats["cycle_alloc"]:
+        return
+    stats["cycle_alloc"] = per_cycle
+    stats["threshold"] = config.GC_THRESHOLD_MARGIN * (config.GC_IDLE_MIN_ALLOC + per_cycle)
+    gc.threshold(stats["threshold"])
+
+def idle_collect():
+    # Called between control cycles; skips if little was allocated since last time
+    global _cycles, _idle_count
+    _cycles += 1
+    alloc = gc.mem_alloc() - _alloc_after
+    if stats["count"] and alloc < config.GC_IDLE_MIN_ALLOC:
+        return 0
+    # The first cycle carries the startup allocations; don't size the threshold on it
+    if stats["count"] and alloc > 0:
+        _tune(alloc, _cycles)
+    us = collect("idle")
+    _idle_count += 1
+    if config.GC_FRAG_EVERY and _idle_count % config.GC_FRAG_EVERY == 0:
+        # After the timed collection, so its pause is measured on a normal heap
+        t0 = utime.ticks_us()
+        stats["largest_free"], steps = largest_free_block()
+        stats["frag_us"] = utime.ticks_diff(utime.ticks_us(), t0)
+        stats["frag_collections"] += steps
+        log[-1] = log[-1][:3] + (stats["largest_free"],)
+    return us
@@ -0,0 +1,72 @@
+import utime
+import machine
+import micropython
+import uasyncio as asyncio
+
+# GPIO event bus.
+#
+# Edges are captured by a hard Pin.irq and debounced right in the handler (a
+# tick compare, no allocation). The IRQ fires on both edges: any edge
+# restarts the quiet period, and an edge counts only if the line was quiet
+# for debounce_ms before it and the pin now reads the triggering level. So
+# the bounce when a long-held button is released can't look like a new
+# press. Accepted events are recorded in a small preallocated ring and a
+# ThreadSafeFlag wakes the dispatcher task, which calls the registered
+# Python callbacks from normal uasyncio context.
+# Future inputs (e.g. a tank float switch) only need another add() call.
+
+RISING = machine.Pin.IRQ_RISING
+FALLING = machine.Pin.IRQ_FALLING
+
+_QUEUE_LEN = 8
+
+class InputBus:
+    def __init__(self):
+        self._inputs = []          # [pin, name, callback, debounce_ms, last_edge_ms, level wanted (2: any)]
+        self._ring = bytearray(_QUEUE_LEN)    # input index per event
+        self._levels = bytearray(_QUEUE_LEN)  # pin level per event
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0
+        self._flag = asyncio.ThreadSafeFlag()
+
+    def add(self, pin, name, callback, trigger=FALLING, debounce_ms=50):
+        # callback(name, level) runs in the dispatcher task, not in the IRQ
+        idx = len(self._inputs)
+        want = 2 if trigger == RISING | FALLING else (1 if trigger == RISING else 0)
+        self._inputs.append([pin, name, callback, debounce_ms, utime.ticks_ms(), want])
+        pin.irq(handler=lambda p, i=idx: self._irq(i), trigger=RISING | FALLING, hard=True)
+        return idx
+
+    @micropython.native
+    def _irq(self, idx):
+        entry = self._inputs[idx]
+        now = utime.ticks_ms()
+        quiet = utime.ticks_diff(now, entry[4]) >= entry[3]
+        entry[4] = now
+        level = entry[0].value()
+        if not quiet or (entry[5] != 2 and level != entry[5]):
+            return
+        nxt = (self._head + 1) % _QUEUE_LEN
+        if nxt == self._tail:
+            self.dropped += 1
+            return
+        self._ring[self._head] = idx
+        self._levels[self._head] = level
+        self._head = nxt
+        self._flag.set()
+
+    async def task(self):
+        while True:
+            await self._flag.wait()
+            while self._tail != self._head:
+                idx = self._ring[self._tail]
+                level = self._levels[self._tail]
+                self._tail = (self._tail + 1) % _QUEUE_LEN
+                _, name, callback, _, _ = self._inputs[idx]
+                try:
+                    callback(name, level)
+                except Exception as e:
+                    print(f"Input {name} handler error: {e}")
+
+bus = InputBus()
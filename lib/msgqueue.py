@@ -0,0 +1,170 @@
+import utime
+import uasyncio as asyncio
+
+# Bounded queue for the V6 system messages, drained by one sender task.
+#
+# put() never allocates beyond the fixed slots: a message already waiting is
+# merged into its slot (the repeat count goes up), and a full queue evicts
+# its oldest low-priority entry for a higher-priority one or drops the new
+# message. The sender publishes the highest-priority, oldest entry at most
+# max_per_min times a minute; low-priority messages additionally go out at
+# most once per low_interval_s (they keep coalescing while they wait).
+# A failed send costs no rate slot; a high-priority message goes back into
+# the queue and is retried after a second, a low-priority one is dropped.
+
+PRIO_LOW = 0    # diagnostics and errors
+PRIO_HIGH = 1   # confirmations the user is waiting for
+
+MAX_TEXT = 64
+
+class MessageQueue:
+    def __init__(self, size, max_per_min, low_interval_s):
+        self.size = size
+        self.max_per_min = max_per_min
+        self.low_interval_s = low_interval_s
+        self.text = [None] * size
+        self.prio = bytearray(size)
+        self.count = [0] * size
+        self.seq = [0] * size       # arrival order, for oldest-first
+        self._seq = 0
+        self._sent_ms = [None] * max_per_min   # ring of recent send times
+        self._sent_i = 0
+        self._last_low_s = None
+        self._event = asyncio.Event()
+        self.stats = {"queued": 0, "coalesced": 0, "dropped": 0, "sent": 0, "failed": 0}
+
+    def __len__(self):
+        n = 0
+        for t in self.text:
+            if t is not None:
+                n += 1
+        return n
+
+    def put(self, message, prio=PRIO_LOW):
+        text = str(message)[:MAX_TEXT]
+        free = None
+        victim = None
+        for i in range(self.size):
+            t = self.text[i]
+            if t is None:
+                if free is None:
+                    free = i
+            elif t == text:
+                self.count[i] += 1
+                if prio > self.prio[i]:
+                    self.prio[i] = prio
+                self.stats["coalesced"] += 1
+                return True
+            elif self.prio[i] < prio and (victim is None or self.seq[i] < self.seq[victim]):
+                victim = i
+        if free is None:
+            self.stats["dropped"] += 1
+            if victim is None:
+                return False
+            free = victim
+        self._seq += 1
+        self.text[free] = text
+        self.prio[free] = prio
+        self.count[free] = 1
+        self.seq[free] = self._seq
+        self.stats["queued"] += 1
+        self._event.set()
+        return True
+
+    def _next(self, low_ok):
+        best = None
+        for i in range(self.size):
+            if self.text[i] is None or (self.prio[i] == PRIO_LOW and not low_ok):
+                continue
+            if (best is None or self.prio[i] > self.prio[best] or
+                    (self.prio[i] == self.prio[best] and self.seq[i] < self.seq[best])):
+                best = i
+        return best
+
+    def _rate_wait_ms(self):
+        # 0 if a message may go out now, else ms until the oldest send leaves the window
+        oldest = self._sent_ms[self._sent_i]
+        if oldest is None:
+            return 0
+        return max(0, 60000 - utime.ticks_diff(utime.ticks_ms(), oldest))
+
+    async def task(self, ready, send):
+        # ready() -> bool: transport usable; send(text) -> bool: published
+        while True:
+            now_s = utime.time()
+            low_ok = self._last_low_s is None or now_s - self._last_low_s >= self.low_interval_s
+            i = self._next(low_ok)
+            if i is None:
+                self._event.clear()
+                if self._next(True) is None:
+                    await self._event.wait()
+                else:
+                    # Only throttled low-priority messages wait; recheck on news or later
+                    try:
+                        await asyncio.wait_for(self._event.wait(), 60)
+                    except asyncio.TimeoutError:
+                        pass
+                continue
+            wait = self._rate_wait_ms()
+            if wait:
+                await asyncio.sleep_ms(wait)
+                continue
+            if not ready():
+                await asyncio.sleep(1)
+                continue
+            base = text = self.text[i]
+            count = self.count[i]
+            if count > 1:
+                suffix = f" (x{count})"
+                text = text[:MAX_TEXT - len(suffix)] + suffix
+            prio = self.prio[i]
+            seq = self.seq[i]
+            self.text[i] = None
+            slot = self._sent_i
+            prev_ms = self._sent_ms[slot]
+            self._sent_ms[slot] = utime.ticks_ms()
+            self._sent_i = (slot + 1) % self.max_per_min
+            if send(text):
+                self.stats["sent"] += 1
+                if prio == PRIO_LOW:
+                    self._last_low_s = now_s
+                await asyncio.sleep_ms(0)
+                continue
+            self.stats["failed"] += 1
+            # Nothing went out: give the rate slot back, and keep confirmations for a retry
+            self._sent_ms[slot] = prev_ms
+            self._sent_i = slot
+            if prio == PRIO_HIGH:
+                self._restore(i, base, count, seq)
+            await asyncio.sleep(1)
+
+    def _restore(self, i, text, count, seq):
+        # Back into the queue as it was; send() may have queued messages meanwhile
+        victim = None
+        for j in range(self.size):
+            t = self.text[j]
+            if t == text:
+                self.count[j] += count
+                self.prio[j] = PRIO_HIGH
+                self.seq[j] = seq
+                return
+            if t is not None and self.prio[j] == PRIO_LOW and (victim is None or self.seq[j] < self.seq[victim]):
+                victim = j
+        if self.text[i] is not None:
+            i = self._next_free()
+        if i is None:
+            # Full: evict the oldest low-priority entry, as put() would
+            self.stats["dropped"] += 1
+            i = victim
+            if i is None:
+                return
+        self.text[i] = text
+        self.prio[i] = PRIO_HIGH
+        self.count[i] = count
+        self.seq[i] = seq
+
+    def _next_free(self):
+        for i in range(self.size):
+            if self.text[i] is None:
+                return i
+        return None
@@ -0,0 +1,138 @@
+import utime
+import uasyncio as asyncio
+import config
+
+# Per-subsystem network traffic and radio time accounting.
+#
+# Every network user reports what it sent and received: add() for HTTP,
+# NTP and DNS, and mqtt() for MQTT, which hands the byte/packet counters
+# MQTTClient keeps since the previous mqtt() call to one subsystem:
+#   http     telemetry batch updates (one TLS connection each)
+#   pump     V4 pump-status publishes
+#   sysmsg   V6 system messages
+#   mqtt     everything else on MQTT: echoes, downlinks, keepalive, info/mcu
+#   connect  MQTT (re)connects: CONNECT/SUBSCRIBE and the TLS handshake
+#   ntp, dns
+# Counters per subsystem: payload bytes sent/received, packets, connection
+# setups, and estimates of protocol overhead on the air (TCP/IP, TLS
+# records, handshakes; NET_* in config.py) and of radio-on time: each
+# transfer keeps the radio up for its airtime plus NET_RADIO_TAIL_MS, and
+# overlapping wake periods are only counted once.
+#
+# The counters roll over every hour into a ring of NET_HOURS_KEPT totals;
+# task() calls a publish callback with the finished hour.
+
+SUBSYSTEMS = ("http", "pump", "sysmsg", "mqtt", "connect", "ntp", "dns")
+FIELDS = ("tx", "rx", "pkts", "conns", "overhead", "radio_ms")
+TX, RX, PKTS, CONNS, OVERHEAD, RADIO_MS = range(6)
+
+def _zero():
+    return [[0] * len(FIELDS) for _ in SUBSYSTEMS]
+
+current = _zero()
+total = _zero()     # since boot, for /metrics
+hour_start = None   # utime.time() of the current hour, set by the first report
+hours = []          # [(hour_start, counters)], oldest first
+_published_until = None   # hour_start of the newest hour handed to publish
+_awake_until = None
+_mqtt_seen = [0, 0, 0, 0]   # MQTTClient tx_bytes, rx_bytes, tx_pkts, rx_pkts already accounted
+
+def _radio_ms(nbytes):
+    # How much this transfer extends the radio-on window
+    global _awake_until
+    now = utime.ticks_ms()
+    end = utime.ticks_add(now, nbytes * 8 // config.NET_LINK_KBPS + config.NET_RADIO_TAIL_MS)
+    if _awake_until is None or utime.ticks_diff(now, _awake_until) >= 0:
+        _awake_until = end
+        return utime.ticks_diff(end, now)
+    ms = utime.ticks_diff(end, _awake_until)
+    if ms <= 0:
+        return 0
+    _awake_until = end
+    return ms
+
+def _check_hour():
+    global hour_start, current
+    h = utime.time() // 3600 * 3600
+    if hour_start is None:
+        hour_start = h
+    elif h != hour_start:
+        hours.append((hour_start, current))
+        if len(hours) > config.NET_HOURS_KEPT:
+            hours.pop(0)
+        current = _zero()
+        hour_start = h
+        return True
+    return False
+
+def add(sub, tx, rx, pkts=1, conns=0, tls=False, resumed=False, overhead=0):
+    # Traffic of one exchange; pkts counts packets in both directions
+    _check_hour()
+    overhead += pkts * config.NET_PACKET_OVERHEAD
+    if tls:
+        overhead += pkts * config.NET_TLS_RECORD_OVERHEAD
+        if conns:
+            overhead += conns * (config.NET_TLS_RESUMED_BYTES if resumed else config.NET_TLS_HANDSHAKE_BYTES)
+    radio = _radio_ms(tx + rx + overhead)
+    i = SUBSYSTEMS.index(sub)
+    for row in (current[i], total[i]):
+        row[TX] += tx
+        row[RX] += rx
+        row[PKTS] += pkts
+        row[CONNS] += conns
+        row[OVERHEAD] += overhead
+        row[RADIO_MS] += radio
+
+def mqtt(sub, client, conns=0):
+    # Charge MQTT traffic since the previous call to sub
+    seen = _mqtt_seen
+    counts = (client.tx_bytes, client.rx_bytes, client.tx_pkts, client.rx_pkts)
+    d = [counts[i] - seen[i] for i in range(4)]
+    if d[0] < 0:
+        d = list(counts)   # counters were reset
+    _mqtt_seen[:] = counts
+    if d[0] or d[1] or conns:
+        add(sub, d[0], d[1], d[2] + d[3], conns, client.ssl is not None, client.ssl_reused)
+
+def totals(counters=None):
+    # {subsystem: {field: value}} for the current hour (or given counters)
+    counters = counters or current
+    return {SUBSYSTEMS[i]: dict(zip(FIELDS, counters[i])) for i in range(len(SUBSYSTEMS))}
+
+def summary(counters):
+    # Compact per-hour record for publishing: {"sub": [tx, rx, pkts, conns, overhead, radio_ms]}
+    return {SUBSYSTEMS[i]: counters[i] for i in range(len(SUBSYSTEMS)) if any(counters[i])}
+
+def energy_mah(radio_ms):
+    return radio_ms * config.NET_RADIO_ACTIVE_MA / 3600000
+
+def dump():
+    # Print the kept hours and the current one
+    print("hour        subsystem      tx B      rx B   pkts conns  ovh B  radio s    mAh")
+    for start, counters in hours + [(hour_start, current)]:
+        if start is None:
+            continue
+        t = utime.localtime(start)
+        for i in range(len(SUBSYSTEMS)):
+            r = counters[i]
+            if any(r):
+                print("%02d-%02d %02d:00 %-9s %9d %9d %6d %5d %6d %8.1f %6.2f" % (
+                    t[1], t[2], t[3], SUBSYSTEMS[i], r[TX], r[RX], r[PKTS], r[CONNS], r[OVERHEAD],
+                    r[RADIO_MS] / 1000, energy_mah(r[RADIO_MS])))
+
+async def task(publish=None):
+    # Roll the counters over on the hour; publish(start, counters) gets each finished hour.
+    # add() may roll over first, so publish whatever finished since the last report.
+    global _published_until
+    while True:
+        await asyncio.sleep(3600 - utime.time() % 3600 + 1)
+        _check_hour()
+        for start, counters in hours:
+            if _published_until is not None and start <= _published_until:
+                continue
+            _published_until = start
+            if publish:
+                try:
+                    publish(start, counters)
+                except Exception as e:
+                    print("Traffic report failed:", e)
@@ -0,0 +1,328 @@
+import os, json, struct, hashlib, binascii, utime
+import uasyncio as asyncio
+import config
+
+# Over-the-air updates of the firmware files.
+#
+# An update is a bundle (tools/ota_standin.py builds one):
+#   b"PPKG" + version:B + count:H, then per file name_len:B size:I name data
+# announced on downlink/ota/json as {"url", "size", "sha256", "ver"}.
+# download() streams it in OTA_CHUNK_BYTES pieces straight into files under
+# OTA_STAGING_DIR, hashing as it goes, and pauses between chunks so MQTT and
+# the pump keep running. Nothing outside the staging area changes until the
+# hash and size match.
+#
+# The swap happens at the next boot (boot() from boot.py) and is driven by
+# a small journal, OTA_STATE_FILE, replaced atomically by rename:
+#   swap     staged bundle verified: move live files to OTA_BACKUP_DIR and
+#            staged ones into place (repeatable if power fails midway)
+#   trial    swapped, the new firmware is about to boot for the first time
+#   booted   it booted; health_task() confirms once the firmware reports
+#            healthy (main.py: Blynk connected and the app loop running).
+#            A reset before that rolls back at the next boot.
+#   ok / rolledback
+
+MAGIC = b"PPKG\x01"
+FMT_HEADER = "<BI"
+HEADER_SIZE = 5
+
+stats = {"state": None, "ver": None, "bytes": 0, "chunks": 0, "updates": 0, "rollbacks": 0, "error": None}
+ssl_ctx = None   # client context for https bundle URLs (main.py sets the Blynk one)
+_busy = False
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+def _is_dir(path):
+    try:
+        return os.stat(path)[0] & 0x4000 != 0
+    except OSError:
+        return False
+
+def _makedirs(path):
+    # Parent directories of path (a file)
+    d = ""
+    for part in path.split("/")[:-1]:
+        d = d + "/" + part if d else part
+        if not _exists(d):
+            os.mkdir(d)
+
+def _rmtree(path):
+    if not _exists(path):
+        return
+    if _is_dir(path):
+        for name in os.listdir(path):
+            _rmtree(path + "/" + name)
+        os.rmdir(path)
+    else:
+        os.remove(path)
+
+def load_state():
+    try:
+        with open(config.OTA_STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_state(st):
+    tmp = config.OTA_STATE_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(st, f)
+    os.rename(tmp, config.OTA_STATE_FILE)
+    stats["state"] = st["state"]
+    stats["ver"] = st.get("ver")
+
+
+class _Unpacker:
+    # Writes bundle bytes into the staging directory as they arrive
+    def __init__(self, root):
+        self.root = root
+        self.head = bytearray()
+        self.phase = 0               # 0 bundle header, 1 file header, 2 file name
+        self.need = len(MAGIC) + 2   # bytes still missing from the current header
+        self.count = None
+        self.left = 0                # file bytes still to write
+        self.f = None
+        self.files = []
+
+    def _header_done(self):
+        h = bytes(self.head)
+        self.head = bytearray()
+        if self.phase == 0:
+            if h[:len(MAGIC)] != MAGIC:
+                raise ValueError("not an update bundle")
+            self.count = struct.unpack("<H", h[len(MAGIC):])[0]
+            self._next_file()
+        elif self.phase == 1:
+            self.need, self.left = struct.unpack(FMT_HEADER, h)
+            self.phase = 2
+        else:
+            name = h.decode()
+            if not name or name.startswith("/") or ".." in name:
+                raise ValueError("bad file name " + name)
+            path = self.root + "/" + name
+            _makedirs(path)
+            self.f = open(path, "wb")
+            self.files.append(name)
+            self._file_done()
+
+    def _next_file(self):
+        self.phase = 1
+        self.need = HEADER_SIZE if len(self.files) < self.count else 0
+
+    def _file_done(self):
+        if self.left:
+            return
+        self.f.close()
+        self.f = None
+        self._next_file()
+
+    def feed(self, data):
+        mv = memoryview(data)
+        pos = 0
+        while pos < len(mv):
+            if self.f:
+                n = min(self.left, len(mv) - pos)
+                self.f.write(mv[pos:pos + n])
+                self.left -= n
+                pos += n
+                self._file_done()
+            elif self.need:
+                n = min(self.need, len(mv) - pos)
+                self.head.extend(mv[pos:pos + n])
+                self.need -= n
+                pos += n
+                if not self.need:
+                    self._header_done()
+            else:
+                raise ValueError("data after the last file")
+
+    def done(self):
+        return self.count is not None and self.f is None and not self.need and len(self.files) == self.count
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+def _parse_url(url):
+    scheme, rest = url.split("://", 1)
+    if "/" in rest:
+        netloc, path = rest.split("/", 1)
+    else:
+        netloc, path = rest, ""
+    port = 443 if scheme == "https" else 80
+    if ":" in netloc:
+        netloc, port = netloc.split(":", 1)
+        port = int(port)
+    return scheme, netloc, port, "/" + path
+
+async def _read(reader, n):
+    return await asyncio.wait_for_ms(reader.read(n), config.OTA_TIMEOUT_MS)
+
+async def download(url, size, sha256):
+    # Stream the bundle into OTA_STAGING_DIR; returns the staged file names
+    scheme, host, port, path = _parse_url(url)
+    if size > config.OTA_MAX_BYTES:
+        raise ValueError("bundle too large: %d" % size)
+    _rmtree(config.OTA_STAGING_DIR)
+    os.mkdir(config.OTA_STAGING_DIR)
+    if scheme == "https":
+        conn = asyncio.open_connection(host, port, ssl=ssl_ctx, server_hostname=host)
+    else:
+        conn = asyncio.open_connection(host, port)
+    reader, writer = await asyncio.wait_for_ms(conn, config.OTA_TIMEOUT_MS)
+    unpack = _Unpacker(config.OTA_STAGING_DIR)
+    h = hashlib.sha256()
+    got = 0
+    try:
+        writer.write(("GET %s HTTP/1.0\r\nHost: %s\r\n\r\n" % (path, host)).encode())
+        await writer.drain()
+        line = await asyncio.wait_for_ms(reader.readline(), config.OTA_TIMEOUT_MS)
+        status = line.split(None, 2)
+        if len(status) < 2 or status[1] != b"200":
+            raise OSError(line.decode().strip())
+        while True:
+            line = await asyncio.wait_for_ms(reader.readline(), config.OTA_TIMEOUT_MS)
+            if not line or line == b"\r\n":
+                break
+        while got < size:
+            chunk = await _read(reader, min(config.OTA_CHUNK_BYTES, size - got))
+            if not chunk:
+                raise OSError("connection closed at %d of %d bytes" % (got, size))
+            h.update(chunk)
+            unpack.feed(chunk)
+            got += len(chunk)
+            stats["bytes"] = got
+            stats["chunks"] += 1
+            # Let MQTT keepalive, the app loop and pump timing run between chunks
+            await asyncio.sleep_ms(config.OTA_CHUNK_PAUSE_MS)
+    finally:
+        unpack.close()
+        writer.close()
+    digest = binascii.hexlify(h.digest()).decode()
+    if digest != sha256.lower():
+        raise ValueError("sha256 mismatch")
+    if not unpack.done():
+        raise ValueError("incomplete bundle")
+    return unpack.files
+
+def swap(st):
+    # Move the staged files into place; safe to repeat after a power cut
+    for name in st["files"]:
+        new = config.OTA_STAGING_DIR + "/" + name
+        old = config.OTA_BACKUP_DIR + "/" + name
+        if not _exists(new):
+            continue   # already moved
+        if _exists(name) and not _exists(old):
+            _makedirs(old)
+            os.rename(name, old)
+        _makedirs(name)
+        if _exists(name):
+            os.remove(name)
+        os.rename(new, name)
+    _rmtree(config.OTA_STAGING_DIR)
+
+def rollback(st):
+    # Restore the backed-up files; files the bundle added are removed
+    for name in st["files"]:
+        old = config.OTA_BACKUP_DIR + "/" + name
+        if _exists(old):
+            if _exists(name):
+                os.remove(name)
+            os.rename(old, name)
+        elif name not in st["backup"] and _exists(name):
+            os.remove(name)
+    _rmtree(config.OTA_BACKUP_DIR)
+    st["state"] = "rolledback"
+    _save_state(st)
+    stats["rollbacks"] += 1
+
+def boot():
+    # Called first thing by boot.py: finish a swap, or roll back a failed
+    # trial. Either one resets, so no module from before the change stays loaded.
+    st = load_state()
+    if st is None:
+        return None
+    state = st["state"]
+    stats["state"] = state
+    stats["ver"] = st.get("ver")
+    if state == "swap":
+        print("OTA: installing", st.get("ver"))
+        swap(st)
+        st["state"] = "trial"
+        _save_state(st)
+        _reset()
+    elif state == "trial":
+        st["state"] = "booted"
+        _save_state(st)
+    elif state == "booted":
+        print("OTA: update", st.get("ver"), "failed its health check, rolling back")
+        rollback(st)
+        _reset()
+    return st["state"]
+
+def _reset():
+    import machine
+    machine.reset()
+
+def confirm():
+    # The new firmware is healthy: drop the backup
+    st = load_state()
+    if st is None or st["state"] != "booted":
+        return False
+    _rmtree(config.OTA_BACKUP_DIR)
+    st["state"] = "ok"
+    _save_state(st)
+    print("OTA: update", st.get("ver"), "confirmed")
+    return True
+
+async def update(payload):
+    # Handle a downlink/ota/json announcement; reboots into the new files
+    global _busy
+    if _busy:
+        print("OTA: update already running")
+        return False
+    _busy = True
+    try:
+        info = json.loads(payload)
+        print("OTA: downloading", info.get("ver"), info["url"])
+        stats["bytes"] = stats["chunks"] = 0
+        stats["error"] = None
+        t0 = utime.ticks_ms()
+        files = await download(info["url"], int(info["size"]), info["sha256"])
+        print("OTA: %d files staged in %d ms" % (len(files), utime.ticks_diff(utime.ticks_ms(), t0)))
+        _rmtree(config.OTA_BACKUP_DIR)
+        backup = [name for name in files if _exists(name)]
+        _save_state({"state": "swap", "ver": info.get("ver"), "files": files, "backup": backup})
+        stats["updates"] += 1
+    except Exception as e:
+        stats["error"] = str(e)
+        print("OTA failed:", e)
+        _rmtree(config.OTA_STAGING_DIR)
+        return False
+    finally:
+        _busy = False
+    await asyncio.sleep_ms(500)
+    _reset()
+    return True
+
+async def health_task(healthy):
+    # healthy() -> bool; a trial boot that doesn't get there in time rolls back
+    st = load_state()
+    if st is None or st["state"] != "booted":
+        return
+    t0 = utime.ticks_ms()
+    while utime.ticks_diff(utime.ticks_ms(), t0) < config.OTA_HEALTH_TIMEOUT_S * 1000:
+        if healthy():
+            confirm()
+            return
+        await asyncio.sleep(1)
+    print("OTA: no health check within", config.OTA_HEALTH_TIMEOUT_S, "s, rolling back")
+    rollback(st)
+    _reset()
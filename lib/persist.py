@@ -0,0 +1,105 @@
+import struct, utime, binascii
+import uasyncio as asyncio
+
+# Double-buffered settings store with coalesced writes.
+#
+# A record is <version, seq, fields..., crc32> packed with struct. Writes
+# alternate between two slot files, so a torn write only ever damages the
+# older copy; load() picks the valid slot with the highest sequence number.
+# mark_dirty() is cheap; the task writes once changes have been quiet for
+# quiet_ms (or max_delay_ms after the first change) and skips writes whose
+# payload is identical to what is already on flash.
+
+class StateStore:
+    def __init__(self, fmt, getter, base="state", version=1, quiet_ms=5000, max_delay_ms=60000):
+        self._payload_fmt = "<" + fmt.lstrip("<")
+        self._fmt = "<HI" + fmt.lstrip("<")
+        self._size = struct.calcsize(self._fmt)
+        self._getter = getter
+        self._paths = (base + "_a.bin", base + "_b.bin")
+        self.version = version
+        self.quiet_ms = quiet_ms
+        self.max_delay_ms = max_delay_ms
+        self._seq = 0
+        self._slot = 0          # slot the next write goes to
+        self._payload = None    # bytes of the last record on flash
+        self._dirty = False
+        self._first_ms = 0
+        self._last_ms = 0
+        self.writes = 0
+        self.skipped = 0
+        self.load_ms = 0
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read(self._size + 4)
+        except OSError:
+            return None
+        if len(data) != self._size + 4:
+            return None
+        crc = struct.unpack_from("<I", data, self._size)[0]
+        if binascii.crc32(data[:self._size]) & 0xFFFFFFFF != crc:
+            return None
+        rec = struct.unpack_from(self._fmt, data)
+        if rec[0] != self.version:
+            return None
+        return rec
+
+    def load(self):
+        # Returns the newest valid field tuple, or None on first boot
+        t0 = utime.ticks_ms()
+        best = None
+        for i, path in enumerate(self._paths):
+            rec = self._read(path)
+            if rec is not None and (best is None or rec[1] > best[1][1]):
+                best = (i, rec)
+        self.load_ms = utime.ticks_diff(utime.ticks_ms(), t0)
+        if best is None:
+            return None
+        slot, rec = best
+        self._seq = rec[1]
+        self._slot = 1 - slot
+        fields = rec[2:]
+        self._payload = struct.pack(self._payload_fmt, *fields)
+        return fields
+
+    def mark_dirty(self):
+        now = utime.ticks_ms()
+        if not self._dirty:
+            self._dirty = True
+            self._first_ms = now
+        self._last_ms = now
+
+    def flush(self):
+        # Write now if the payload differs from flash
+        self._dirty = False
+        fields = self._getter()
+        payload = struct.pack(self._payload_fmt, *fields)
+        if payload == self._payload:
+            self.skipped += 1
+            return False
+        self._seq += 1
+        data = struct.pack(self._fmt, self.version, self._seq, *fields)
+        try:
+            with open(self._paths[self._slot], "wb") as f:
+                f.write(data)
+                f.write(struct.pack("<I", binascii.crc32(data) & 0xFFFFFFFF))
+        except OSError as e:
+            print(f"State save error: {e}")
+            self.mark_dirty()
+            return False
+        self._slot = 1 - self._slot
+        self._payload = payload
+        self.writes += 1
+        return True
+
+    async def task(self):
+        while True:
+            await asyncio.sleep_ms(500)
+            if not self._dirty:
+                continue
+            now = utime.ticks_ms()
+            if (utime.ticks_diff(now, self._last_ms) >= self.quiet_ms or
+                    utime.ticks_diff(now, self._first_ms) >= self.max_delay_ms):
+                self.flush()
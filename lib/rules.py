@@ -0,0 +1,170 @@
+# Incremental rule engine for the watering/alert logic.
+#
+# A rule is declared in config.RULES as
+#
+#   (name, when, code, action, blockers)
+#
+#   when      clauses that must all hold: (fact, op, value[, hysteresis])
+#   code      decision message while the rule fires ("LOCK {lock_left_h}h"
+#             style fields are filled from the facts)
+#   action    name of a Device action run every cycle with the rule, or None
+#   blockers  ((fact, op, value[, hysteresis]), code, reason) tried in
+#             order; the first one that holds keeps the rule from firing and
+#             becomes its explanation
+#
+# value is a number, a (lo, hi) pair for "in"/"out", or the name of another
+# fact. With hysteresis h a clause that holds keeps holding until the value
+# is h past its threshold (for < <= > >=), so a reading hovering around the
+# threshold doesn't flip the result every cycle.
+#
+# The device feeds facts with set() once per cycle; run() only re-evaluates
+# rules with an input that changed since the last cycle.
+
+OFF = 0
+FIRE = 1
+BLOCKED = 2
+
+_OPS = ("<", "<=", ">", ">=", "==", "!=", "in", "out")
+
+class Clause:
+    def __init__(self, spec):
+        self.fact, self.op, self.value = spec[0], spec[1], spec[2]
+        self.hyst = spec[3] if len(spec) > 3 else 0
+        if self.op not in _OPS:
+            raise ValueError("rule op %r" % (self.op,))
+        self.held = False
+
+    def inputs(self):
+        if isinstance(self.value, str):
+            return (self.fact, self.value)
+        return (self.fact,)
+
+    def test(self, facts):
+        x = facts.get(self.fact)
+        v = self.value
+        if isinstance(v, str):
+            v = facts.get(v)
+        if x is None or v is None:
+            self.held = False
+            return False
+        op = self.op
+        h = self.hyst if self.held else 0
+        if op == "<":
+            r = x < v + h
+        elif op == "<=":
+            r = x <= v + h
+        elif op == ">":
+            r = x > v - h
+        elif op == ">=":
+            r = x >= v - h
+        elif op == "==":
+            r = x == v
+        elif op == "!=":
+            r = x != v
+        elif op == "in":
+            r = v[0] <= x < v[1]
+        else:
+            r = not (v[0] <= x < v[1])
+        self.held = r
+        return r
+
+
+class Rule:
+    def __init__(self, spec):
+        self.name, when, self.fire_code, self.action, blockers = spec
+        self.when = [Clause(c) for c in when]
+        self.blockers = [(Clause(c), code, reason) for c, code, reason in blockers]
+        self.state = OFF
+        self.code = None      # decision message for the current state
+        self.reason = None    # why a BLOCKED rule did not fire
+        self.evaluations = 0
+
+    def inputs(self):
+        names = []
+        for c in self.when + [b[0] for b in self.blockers]:
+            for n in c.inputs():
+                if n not in names:
+                    names.append(n)
+        return names
+
+    def evaluate(self, facts):
+        self.evaluations += 1
+        # Every clause is tested (not short-circuited) so hysteresis state stays current
+        ok = True
+        for c in self.when:
+            if not c.test(facts):
+                ok = False
+        block = None
+        for b in self.blockers:
+            if b[0].test(facts) and block is None:
+                block = b
+        if not ok:
+            state, code, reason = OFF, None, None
+        elif block:
+            state, code, reason = BLOCKED, block[1], block[2]
+        else:
+            state, code, reason = FIRE, self.fire_code, None
+        if code and "{" in code:
+            code = code.format(**facts)
+        if reason and "{" in reason:
+            reason = reason.format(**facts)
+        changed = state != self.state or code != self.code
+        self.state, self.code, self.reason = state, code, reason
+        return changed
+
+
+class Engine:
+    def __init__(self, specs):
+        self.rules = [Rule(s) for s in specs]
+        self.facts = {}
+        self._deps = {}       # fact -> rules that read it
+        for r in self.rules:
+            for n in r.inputs():
+                self._deps.setdefault(n, []).append(r)
+        self._dirty = list(self.rules)
+        self._messages = []
+        self.cycles = 0
+        self.evaluations = 0
+
+    def set(self, name, value):
+        if name in self.facts and self.facts[name] == value:
+            return
+        self.facts[name] = value
+        for r in self._deps.get(name, ()):
+            if r not in self._dirty:
+                self._dirty.append(r)
+
+    def run(self):
+        # Re-evaluate rules whose inputs changed; returns how many were evaluated
+        self.cycles += 1
+        n = len(self._dirty)
+        changed = False
+        for r in self._dirty:
+            if r.evaluate(self.facts):
+                changed = True
+        self._dirty = []
+        self.evaluations += n
+        if changed:
+            self._messages = [r.code for r in self.rules if r.code]
+        return n
+
+    def messages(self):
+        return self._messages
+
+    def rule(self, name):
+        for r in self.rules:
+            if r.name == name:
+                return r
+        return None
+
+    def explain(self, name):
+        # Why a rule is not firing right now
+        r = self.rule(name)
+        if r is None:
+            return "no rule " + name
+        if r.state == BLOCKED:
+            return r.reason
+        if r.state == OFF:
+            return "conditions not met: " + ", ".join(
+                "%s %s %s" % (c.fact, c.op, c.value) for c in r.when if not c.held)
+        return None
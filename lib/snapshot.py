@@ -0,0 +1,54 @@
+# Per-cycle sensor snapshots.
+#
+# Every sampling cycle ends in one Snapshot holding all readings of that
+# cycle, and Bus.publish() swaps it in as bus.latest in a single assignment.
+# Telemetry, the watering logic, the terminal display and /status all read
+# bus.latest, so none of them can see half an update. Snapshots are
+# read-only once built. Consumers remember the seq they last handled and
+# use fresh(seq) to skip a cycle they have already processed.
+
+class Snapshot:
+    __slots__ = ("seq", "ms", "utc", "raw_soil", "raw_water", "raw_ldr",
+                 "soil", "water", "light", "temp", "hum", "pump")
+
+    def __init__(self, seq, ms, utc, raw_soil, raw_water, raw_ldr, soil, water, light, temp, hum, pump):
+        s = object.__setattr__
+        s(self, "seq", seq)          # 1, 2, ... per published cycle; 0 = nothing sampled yet
+        s(self, "ms", ms)            # utime.ticks_ms() when sampled
+        s(self, "utc", utc)
+        s(self, "raw_soil", raw_soil)
+        s(self, "raw_water", raw_water)
+        s(self, "raw_ldr", raw_ldr)
+        s(self, "soil", soil)        # percent
+        s(self, "water", water)
+        s(self, "light", light)
+        s(self, "temp", temp)        # DHT, None until the first good read
+        s(self, "hum", hum)
+        s(self, "pump", pump)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("snapshot is read-only")
+
+
+class Bus:
+    def __init__(self):
+        self.latest = Snapshot(0, 0, 0, 0, 0, 0, 0, 0, 0, None, None, 0)
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        # callback(snap) runs inside publish(), so keep it short
+        self._subscribers.append(callback)
+
+    def publish(self, snap):
+        self.latest = snap
+        for cb in self._subscribers:
+            try:
+                cb(snap)
+            except Exception as e:
+                print("Snapshot subscriber error:", e)
+
+    def fresh(self, seen_seq):
+        # The latest snapshot, or None if seen_seq is already it
+        snap = self.latest
+        return None if snap.seq == seen_seq else snap
+
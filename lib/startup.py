@@ -0,0 +1,59 @@
+import utime
+import uasyncio as asyncio
+
+# Boot timeline shared by boot.py, main.py and the libraries.
+# t0 is taken when this module is first imported (boot.py does it first).
+_t0 = utime.ticks_ms()
+timeline = []   # [(phase, ms_since_boot), ...] in the order phases completed
+_results = {}   # step name -> result, so each step runs exactly once
+_running = {}   # async steps currently in flight
+
+def elapsed_ms():
+    return utime.ticks_diff(utime.ticks_ms(), _t0)
+
+def mark(phase):
+    # Record a phase the first time it is reached; returns True if new
+    if reached(phase):
+        return False
+    timeline.append((phase, elapsed_ms()))
+    return True
+
+def reached(phase):
+    for name, _ in timeline:
+        if name == phase:
+            return True
+    return False
+
+def done(name):
+    return name in _results
+
+def result(name, default=None):
+    return _results.get(name, default)
+
+def once(name, fn, *args):
+    # Run a synchronous step once; later callers get the cached result
+    if name not in _results:
+        _results[name] = fn(*args)
+        mark(name)
+    return _results[name]
+
+async def once_async(name, fn, *args):
+    # Async variant; concurrent callers wait for the first run to finish
+    while name in _running:
+        await asyncio.sleep_ms(20)
+    if name not in _results:
+        _running[name] = True
+        try:
+            _results[name] = await fn(*args)
+        finally:
+            del _running[name]
+        mark(name)
+    return _results[name]
+
+def report():
+    print("=== Boot timeline ===")
+    prev = 0
+    for name, ms in timeline:
+        print(f"{ms:7d} ms  (+{ms - prev:5d})  {name}")
+        prev = ms
+    print("=====================")
@@ -0,0 +1,192 @@
+import gc, json, utime
+import uasyncio as asyncio
+import config
+import blynk_mqtt
+import timesvc
+import gcpolicy
+import dnscache
+import endpoints
+import ota
+import netstats
+import wifi
+
+# Tiny LAN status server.
+#
+#   GET /status   -> JSON snapshot
+#   GET /metrics  -> Prometheus text exposition
+#
+# Both responses (headers included) are rendered by update() from the app
+# loop, only when readings or publish counters changed (memory and loop
+# timings are refreshed at least every STATUS_REFRESH_MS). Requests just
+# write the cached bytes, so scrape frequency doesn't add formatting work.
+
+loop_stats = {"last_ms": 0, "max_ms": 0, "cycles": 0}
+requests = 0
+
+_key = None
+_rendered_ms = 0
+_status = b""
+_metrics = b""
+_NOT_FOUND = b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+def _response(ctype, body):
+    return (b"HTTP/1.0 200 OK\r\nContent-Type: " + ctype +
+            b"\r\nContent-Length: " + str(len(body)).encode() +
+            b"\r\nConnection: close\r\n\r\n" + body)
+
+def record_loop(ms):
+    loop_stats["last_ms"] = ms
+    loop_stats["cycles"] += 1
+    if ms > loop_stats["max_ms"]:
+        loop_stats["max_ms"] = ms
+
+def update(dev):
+    # Re-render the cached responses if the snapshot differs from the last one
+    global _key, _status, _metrics, _rendered_ms
+    rs = blynk_mqtt.reconnect_stats
+    st = dev.stats
+    ms = dev.messages.stats
+    snap = dev.bus.latest
+    key = (snap.seq, dev.pump_pin.value(), dev.system_active, dev.last_watering_s,
+           st["http_ok"], st["http_err"], st["mqtt_pub"], st["mqtt_err"], rs["attempts"], dev.last_decision)
+    now = utime.ticks_ms()
+    if key == _key and utime.ticks_diff(now, _rendered_ms) < config.STATUS_REFRESH_MS:
+        return False
+    _key = key
+    _rendered_ms = now
+    mem_free = gc.mem_free()
+    mem_alloc = gc.mem_alloc()
+    status = {
+        "device": config.DEVICE_ID,
+        "time": timesvc.utc_s(),
+        "system_active": dev.system_active,
+        "pump": dev.pump_pin.value(),
+        "cycle": snap.seq,
+        "sampled": snap.utc,
+        "soil_percent": snap.soil,
+        "water_percent": snap.water,
+        "light_percent": snap.light,
+        "temperature": snap.temp,
+        "humidity": snap.hum,
+        "raw": {"soil": snap.raw_soil, "water": snap.raw_water, "ldr": snap.raw_ldr},
+        "last_watering_s": dev.last_watering_s,
+        "decision": dev.last_decision,
+        "watering": dev.rules.explain("auto_water") or "allowed",
+        "loop": loop_stats,
+        "publish": st,
+        "mqtt": rs,
+        "messages": dev.messages.stats,
+        "downlinks": dev.downlink_stats,
+        "ota": ota.stats,
+        "traffic": netstats.totals(),
+        "wifi": wifi.stats,
+        "mem": {"free": mem_free, "alloc": mem_alloc},
+        "gc": gcpolicy.stats,
+        "gc_log": gcpolicy.log,
+        "dns": dnscache.stats,
+        "endpoint": {"current": endpoints.current(), "rtt_ms": endpoints.rtt_ms,
+                     "errors": endpoints.errors, "stats": endpoints.stats},
+    }
+    _status = _response(b"application/json", json.dumps(status).encode())
+    lines = [
+        "# TYPE plant_soil_moisture_percent gauge",
+        f"plant_soil_moisture_percent {snap.soil}",
+        f"plant_water_level_percent {snap.water}",
+        f"plant_light_percent {snap.light}",
+        f'plant_raw_adc{{sensor="soil"}} {snap.raw_soil}',
+        f'plant_raw_adc{{sensor="water"}} {snap.raw_water}',
+        f'plant_raw_adc{{sensor="ldr"}} {snap.raw_ldr}',
+        f"plant_sensor_cycles_total {snap.seq}",
+        f"plant_pump_on {dev.pump_pin.value()}",
+        f"plant_system_active {int(dev.system_active)}",
+        f"plant_last_watering_timestamp_seconds {dev.last_watering_s}",
+        f"plant_loop_duration_ms {loop_stats['last_ms']}",
+        f"plant_loop_duration_max_ms {loop_stats['max_ms']}",
+        "# TYPE plant_loop_cycles_total counter",
+        f"plant_loop_cycles_total {loop_stats['cycles']}",
+        "# TYPE plant_publish_total counter",
+        f'plant_publish_total{{path="http",result="ok"}} {st["http_ok"]}',
+        f'plant_publish_total{{path="http",result="error"}} {st["http_err"]}',
+        f'plant_publish_total{{path="mqtt",result="ok"}} {st["mqtt_pub"]}',
+        f'plant_publish_total{{path="mqtt",result="error"}} {st["mqtt_err"]}',
+        "# TYPE plant_system_messages_total counter",
+        f'plant_system_messages_total{{result="sent"}} {ms["sent"]}',
+        f'plant_system_messages_total{{result="failed"}} {ms["failed"]}',
+        f'plant_system_messages_total{{result="coalesced"}} {ms["coalesced"]}',
+        f'plant_system_messages_total{{result="dropped"}} {ms["dropped"]}',
+        f"plant_system_messages_queued {len(dev.messages)}",
+        "# TYPE plant_downlinks_total counter",
+        f'plant_downlinks_total{{result="applied"}} {dev.downlink_stats["applied"]}',
+        f'plant_downlinks_total{{result="coalesced"}} {dev.downlink_stats["coalesced"]}',
+        "# TYPE plant_mqtt_connect_attempts_total counter",
+        f"plant_mqtt_connect_attempts_total {rs['attempts']}",
+        f"plant_mqtt_connect_last_ms {rs['last_ms']}",
+        f"plant_mem_free_bytes {mem_free}",
+        f"plant_mem_alloc_bytes {mem_alloc}",
+        f"plant_mem_largest_free_block_bytes {gcpolicy.stats['largest_free']}",
+        "# TYPE plant_gc_collections_total counter",
+        f"plant_gc_collections_total {gcpolicy.stats['count']}",
+        f"plant_gc_pause_last_us {gcpolicy.stats['last_us']}",
+        f"plant_gc_pause_max_us {gcpolicy.stats['max_us']}",
+        f"plant_gc_pause_total_us {gcpolicy.stats['total_us']}",
+        "# TYPE plant_dns_lookups_total counter",
+        f'plant_dns_lookups_total{{result="hit"}} {dnscache.stats["hits"]}',
+        f'plant_dns_lookups_total{{result="stale"}} {dnscache.stats["stale"]}',
+        f'plant_dns_lookups_total{{result="miss"}} {dnscache.stats["misses"]}',
+        "# TYPE plant_wifi_drops_total counter",
+        f"plant_wifi_drops_total {wifi.stats['drops']}",
+        f"plant_wifi_reconnects_total {wifi.stats['reconnects']}",
+    ]
+    if wifi.stats["rssi"] is not None:
+        lines.append(f"plant_wifi_rssi_dbm {wifi.stats['rssi']}")
+    lines.append("# TYPE plant_net_bytes_total counter")
+    for i, sub in enumerate(netstats.SUBSYSTEMS):
+        r = netstats.total[i]
+        lines.append(f'plant_net_bytes_total{{subsystem="{sub}",dir="tx"}} {r[netstats.TX]}')
+        lines.append(f'plant_net_bytes_total{{subsystem="{sub}",dir="rx"}} {r[netstats.RX]}')
+        lines.append(f'plant_net_overhead_bytes_total{{subsystem="{sub}"}} {r[netstats.OVERHEAD]}')
+        lines.append(f'plant_net_connections_total{{subsystem="{sub}"}} {r[netstats.CONNS]}')
+        lines.append(f'plant_net_radio_ms_total{{subsystem="{sub}"}} {r[netstats.RADIO_MS]}')
+    if snap.temp is not None:
+        lines.append(f"plant_temperature_celsius {snap.temp}")
+    if snap.hum is not None:
+        lines.append(f"plant_humidity_percent {snap.hum}")
+    lines.append("")
+    _metrics = _response(b"text/plain; version=0.0.4", "\n".join(lines).encode())
+    return True
+
+async def _read_request(reader):
+    # Request line; the headers are read and ignored
+    line = await reader.readline()
+    while True:
+        h = await reader.readline()
+        if not h or h == b"\r\n":
+            return line
+
+async def _handle(reader, writer):
+    global requests
+    try:
+        # A client that never finishes its headers must not hold the socket forever
+        line = await asyncio.wait_for_ms(_read_request(reader), config.STATUS_READ_TIMEOUT_MS)
+        parts = line.split(b" ")
+        path = parts[1] if len(parts) > 1 else b""
+        requests += 1
+        if path == b"/status":
+            writer.write(_status)
+        elif path == b"/metrics":
+            writer.write(_metrics)
+        else:
+            writer.write(_NOT_FOUND)
+        await writer.drain()
+    except asyncio.TimeoutError:
+        print("Status server: request timed out")
+    except Exception as e:
+        print(f"Status server error: {e}")
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def serve():
+    server = await asyncio.start_server(_handle, "0.0.0.0", config.STATUS_HTTP_PORT)
+    print(f"Status server on port {config.STATUS_HTTP_PORT}")
+    return server
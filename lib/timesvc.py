@@ -0,0 +1,193 @@
+import socket, struct, utime, machine
+import uasyncio as asyncio
+import config
+import startup
+import dnscache
+import netstats
+import wifi
+
+# Non-blocking SNTP time service.
+#
+# UTC is kept as an anchor (seconds + ms remainder) taken at a ticks_ms()
+# instant, so reading the time never touches the RTC or the network. Each
+# sync compares the prediction with the server and feeds a drift estimate
+# (ppm) back into the prediction; the next sync is scheduled when the
+# predicted error would reach TIME_MAX_ERROR_MS.
+
+NTP_DELTA = 3155673600 if utime.gmtime(0)[0] == 2000 else 2208988800
+
+_synced = False
+_base_s = 0          # UTC seconds at _base_ticks
+_base_ms = 0         # ms remainder at _base_ticks (0..999)
+_base_ticks = 0
+_drift_ppm = 0       # estimated local clock error, + means ticks run slow
+_next_sync_ms = 0    # ticks_ms deadline of the next sync
+
+stats = {"syncs": 0, "failures": 0, "last_rtt_ms": 0, "last_err_ms": 0, "interval_s": 0}
+
+_cache_s = -1
+_cache_tm = None
+
+def synced():
+    return _synced
+
+def _elapsed_ms():
+    dt = utime.ticks_diff(utime.ticks_ms(), _base_ticks)
+    return dt + (dt // 1000) * _drift_ppm // 1000
+
+def _reanchor():
+    # Keep ticks_diff() well inside its valid range (ticks_ms wraps)
+    global _base_s, _base_ms, _base_ticks
+    now = utime.ticks_ms()
+    total = _base_ms + _elapsed_ms()
+    _base_s += total // 1000
+    _base_ms = total % 1000
+    _base_ticks = now
+
+def utc_s():
+    # Current UTC seconds since the port's epoch
+    if not _synced:
+        return utime.time()
+    if utime.ticks_diff(utime.ticks_ms(), _base_ticks) > 86400000:
+        _reanchor()
+    return _base_s + (_base_ms + _elapsed_ms()) // 1000
+
+def _last_sunday(y, m):
+    # Day of month of the last Sunday in month m
+    days = 31 if m in (3, 10) else 30
+    wd = utime.localtime(utime.mktime((y, m, days, 0, 0, 0, 0, 0)))[6]
+    return days - (wd + 1) % 7
+
+def _nth_sunday(y, m, n):
+    wd = utime.localtime(utime.mktime((y, m, 1, 0, 0, 0, 0, 0)))[6]
+    return 1 + (6 - wd) % 7 + (n - 1) * 7
+
+_dst_year = -1
+_dst_start = _dst_end = 0
+
+def _dst_active(t_utc):
+    # DST window boundaries are computed once per year and cached
+    global _dst_year, _dst_start, _dst_end
+    rule = config.TIME_DST_RULE
+    if not rule:
+        return False
+    y = utime.gmtime(t_utc)[0]
+    if y != _dst_year:
+        if rule == "EU":
+            # Last Sunday of March 01:00 UTC .. last Sunday of October 01:00 UTC
+            _dst_start = utime.mktime((y, 3, _last_sunday(y, 3), 1, 0, 0, 0, 0))
+            _dst_end = utime.mktime((y, 10, _last_sunday(y, 10), 1, 0, 0, 0, 0))
+        elif rule == "US":
+            # Second Sunday of March 02:00 local .. first Sunday of November 02:00 local
+            std = config.TIME_UTC_OFFSET_MIN * 60
+            _dst_start = utime.mktime((y, 3, _nth_sunday(y, 3, 2), 2, 0, 0, 0, 0)) - std
+            _dst_end = utime.mktime((y, 11, _nth_sunday(y, 11, 1), 2, 0, 0, 0, 0)) - std - 3600
+        else:
+            _dst_start = _dst_end = 0
+        _dst_year = y
+    return _dst_start <= t_utc < _dst_end
+
+def utc_offset_min(t=None):
+    # Local offset from UTC in minutes, including DST
+    if t is None:
+        t = utc_s()
+    return config.TIME_UTC_OFFSET_MIN + (60 if _dst_active(t) else 0)
+
+def localtime():
+    # Cached local time tuple, recomputed at most once per second
+    global _cache_s, _cache_tm
+    t = utc_s()
+    if t != _cache_s:
+        _cache_tm = utime.localtime(t + utc_offset_min(t) * 60)
+        _cache_s = t
+    return _cache_tm
+
+def local_hour():
+    return localtime()[3]
+
+def _set_rtc(t):
+    tm = utime.gmtime(t)
+    machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6], tm[3], tm[4], tm[5], 0))
+
+async def _query(host, port, timeout_ms):
+    # One SNTP exchange; returns (utc_s, utc_ms_remainder, rtt_ms) at receive time
+    addr = dnscache.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0][-1]
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setblocking(False)
+    try:
+        req = bytearray(48)
+        req[0] = 0x1B
+        t1 = utime.ticks_ms()
+        s.sendto(req, addr)
+        while True:
+            try:
+                msg = s.recv(48)
+                if msg and len(msg) >= 48:
+                    break
+            except OSError:
+                pass
+            if utime.ticks_diff(utime.ticks_ms(), t1) > timeout_ms:
+                netstats.add("ntp", len(req), 0, 1)
+                raise OSError("NTP timeout")
+            await asyncio.sleep_ms(10)
+        rtt = utime.ticks_diff(utime.ticks_ms(), t1)
+        netstats.add("ntp", len(req), len(msg), 2)
+        rx_s, rx_f, tx_s, tx_f = struct.unpack("!IIII", msg[32:48])
+        if tx_s == 0:
+            raise OSError("NTP bad reply")
+        rx_ms = (rx_f >> 22) * 1000 >> 10
+        tx_ms = (tx_f >> 22) * 1000 >> 10
+        hold = (tx_s - rx_s) * 1000 + tx_ms - rx_ms
+        total = tx_ms + max(0, rtt - hold) // 2
+        return tx_s - NTP_DELTA + total // 1000, total % 1000, rtt
+    finally:
+        s.close()
+
+async def sync():
+    # Query the server, update anchor + drift estimate and schedule the next sync
+    global _synced, _base_s, _base_ms, _base_ticks, _drift_ppm, _next_sync_ms
+    try:
+        secs, ms, rtt = await _query(config.TIME_NTP_HOST, config.TIME_NTP_PORT, config.TIME_NTP_TIMEOUT_MS)
+    except Exception as e:
+        stats["failures"] += 1
+        print("NTP failed:", e)
+        return False
+    now = utime.ticks_ms()
+    interval_s = config.TIME_RESYNC_MAX_S
+    if _synced:
+        since = utime.ticks_diff(now, _base_ticks)
+        predicted = _base_ms + _elapsed_ms()
+        err = (secs - _base_s) * 1000 + ms - predicted
+        stats["last_err_ms"] = err
+        if since > 60000:
+            # Exponential smoothing of the residual drift
+            _drift_ppm += (err * 1000 // (since // 1000)) // 2
+        if err:
+            interval_s = config.TIME_MAX_ERROR_MS * (since // 1000) // abs(err)
+    _base_s, _base_ms, _base_ticks = secs, ms, now
+    _set_rtc(secs)
+    interval_s = max(config.TIME_RESYNC_MIN_S, min(interval_s, config.TIME_RESYNC_MAX_S))
+    _next_sync_ms = utime.ticks_add(now, interval_s * 1000)
+    stats["syncs"] += 1
+    stats["last_rtt_ms"] = rtt
+    stats["interval_s"] = interval_s
+    if not _synced:
+        _synced = True
+        startup.mark("time_synced")
+        tm = localtime()
+        print(f"Local time: {tm[2]:02d}/{tm[1]:02d} {tm[3]:02d}:{tm[4]:02d} (rtt {rtt} ms)")
+    return True
+
+async def task():
+    # Background resync loop; retries quickly until the first sync succeeds
+    retry_s = 2
+    while True:
+        await wifi.wait_up()
+        if not _synced or utime.ticks_diff(_next_sync_ms, utime.ticks_ms()) <= 0:
+            if await sync():
+                retry_s = 2
+            else:
+                await asyncio.sleep(retry_s)
+                retry_s = min(retry_s * 2, 300)
+                continue
+        await asyncio.sleep(min(60, max(1, utime.ticks_diff(_next_sync_ms, utime.ticks_ms()) // 1000)))
@@ -0,0 +1,111 @@
+import uasyncio as asyncio
+from array import array
+
+# Single-task buzzer sequencer.
+#
+# Tones are queued as records in fixed-size arrays (frequency, duration,
+# trailing gap, priority) and played by one long-lived task, so callers
+# never spawn tasks and nothing is allocated per tone. A request with a
+# higher priority than the one playing cuts the current tone and flushes
+# queued lower-priority tones; replace=True does the same for equal priority
+# (used for UI chirps so bursts don't pile up).
+
+PRIO_UI = 0
+PRIO_ACTION = 1
+PRIO_ALARM = 2
+
+_SLICE_MS = 10
+
+class ToneSequencer:
+    def __init__(self, pwm, size=16, duty=32768):
+        self.pwm = pwm
+        self.size = size
+        self.duty = duty
+        self._freq = array("H", bytes(2 * size))
+        self._dur = array("H", bytes(2 * size))
+        self._gap = array("H", bytes(2 * size))
+        self._prio = bytearray(size)
+        self._head = 0
+        self._tail = 0
+        self._cur_prio = -1
+        self._cut = False
+        self.dropped = 0
+        self._flag = asyncio.ThreadSafeFlag()
+
+    def _flush(self, max_prio):
+        # Drop queued tones with priority <= max_prio, keeping order of the rest
+        n = self.size
+        r = w = self._tail
+        while r != self._head:
+            if self._prio[r] > max_prio:
+                self._freq[w] = self._freq[r]
+                self._dur[w] = self._dur[r]
+                self._gap[w] = self._gap[r]
+                self._prio[w] = self._prio[r]
+                w = (w + 1) % n
+            r = (r + 1) % n
+        self._head = w
+
+    def play(self, sequence, priority=PRIO_UI, gap_ms=0, replace=False):
+        # sequence: iterable of (frequency_hz, duration_ms); frequency 0 is a rest
+        limit = priority if replace else priority - 1
+        if self._cur_prio >= 0 and self._cur_prio <= limit:
+            self._cut = True
+        self._flush(limit)
+        n = self.size
+        for freq, dur in sequence:
+            nxt = (self._head + 1) % n
+            if nxt == self._tail:
+                self.dropped += 1
+                break
+            i = self._head
+            self._freq[i] = freq
+            self._dur[i] = dur
+            self._gap[i] = gap_ms
+            self._prio[i] = priority
+            self._head = nxt
+        self._flag.set()
+
+    def stop(self):
+        # Silence now and forget everything queued
+        self._tail = self._head
+        self._cut = True
+        try:
+            self.pwm.duty_u16(0)
+        except Exception:
+            pass
+
+    def busy(self):
+        return self._cur_prio >= 0 or self._tail != self._head
+
+    async def task(self):
+        pwm = self.pwm
+        n = self.size
+        while True:
+            if self._tail == self._head:
+                self._cur_prio = -1
+                await self._flag.wait()
+                continue
+            i = self._tail
+            freq = self._freq[i]
+            remaining = self._dur[i]
+            gap = self._gap[i]
+            self._cur_prio = self._prio[i]
+            self._tail = (i + 1) % n
+            self._cut = False
+            try:
+                if freq > 0:
+                    pwm.freq(freq)
+                    pwm.duty_u16(self.duty)
+                # Sleep in short slices so a preempting request can cut in
+                while remaining > 0 and not self._cut:
+                    step = _SLICE_MS if remaining > _SLICE_MS else remaining
+                    await asyncio.sleep_ms(step)
+                    remaining -= step
+            except Exception:
+                pass
+            pwm.duty_u16(0)
+            while gap > 0 and not self._cut:
+                step = _SLICE_MS if gap > _SLICE_MS else gap
+                await asyncio.sleep_ms(step)
+                gap -= step
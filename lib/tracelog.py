@@ -0,0 +1,108 @@
+import os, struct
+import config
+
+# Compact binary trace of what the control logic sees.
+#
+# File layout: b"PTRC" + version byte, then records of one type byte
+# followed by a fixed struct (variable-length tails for downlinks):
+#   C  config:   lockout_s:I auto_s:H manual_s:H soil_thr:B last_watering_s:I
+#   S  sensors:  utc:I tz_min:h soil:H water:H ldr:H temp:b hum:B pump:B
+#   D  downlink: utc:I topic_len:B payload_len:B topic payload
+#   P  power:    utc:I active:B
+# temp -128 / hum 255 mean "no reading". Records are packed into a RAM
+# buffer and appended to flash only when it fills up. tools/replay.py reads
+# the same format on a PC.
+
+MAGIC = b"PTRC\x01"
+FMT_CONFIG = "<IHHBI"
+FMT_SENSOR = "<IhHHHbBB"
+FMT_DOWNLINK = "<IBB"
+FMT_POWER = "<IB"
+
+_buf = bytearray(512)
+_n = 0
+_f = None
+_dev = None
+_size = 0
+records = 0
+
+def start(dev):
+    # Open (or rotate) the trace file and write the current settings
+    global _f, _dev, _size
+    if not config.TRACE_ENABLED or _f is not None:
+        return
+    _dev = dev
+    try:
+        _size = os.stat(config.TRACE_FILE)[6]
+    except OSError:
+        _size = 0
+    if _size >= config.TRACE_MAX_BYTES:
+        _rotate()
+    _f = open(config.TRACE_FILE, "ab")
+    if _size == 0:
+        _f.write(MAGIC)
+        _size = len(MAGIC)
+    _put_config()
+
+def _put_config():
+    d = _dev
+    _put(b"C", FMT_CONFIG, d.min_seconds_between_watering_config, d.pump_run_duration_auto_s,
+         d.pump_run_duration_manual_s, d.soil_watering_threshold_config, d.last_watering_s)
+
+def _rotate():
+    global _size
+    try:
+        os.remove(config.TRACE_FILE + ".old")
+    except OSError:
+        pass
+    try:
+        os.rename(config.TRACE_FILE, config.TRACE_FILE + ".old")
+    except OSError:
+        pass
+    _size = 0
+
+def _put(kind, fmt, *values, tail=None):
+    global _n, records
+    need = 1 + struct.calcsize(fmt) + (len(tail) if tail else 0)
+    if _n + need > len(_buf):
+        flush()
+    _buf[_n] = kind[0]
+    struct.pack_into(fmt, _buf, _n + 1, *values)
+    _n += need
+    if tail:
+        _buf[_n - len(tail):_n] = tail
+    records += 1
+
+def flush():
+    global _n, _size, _f
+    if _f is None or _n == 0:
+        return
+    _f.write(memoryview(_buf)[:_n])
+    _f.flush()
+    _size += _n
+    _n = 0
+    if _size >= config.TRACE_MAX_BYTES:
+        _f.close()
+        _rotate()
+        _f = open(config.TRACE_FILE, "ab")
+        _f.write(MAGIC)
+        _size = len(MAGIC)
+        _put_config()
+
+def sensors(utc, tz_min, soil, water, ldr, temp, hum, pump):
+    if _f is None:
+        return
+    _put(b"S", FMT_SENSOR, utc, tz_min, soil, water, ldr,
+         -128 if temp is None else int(temp), 255 if hum is None else int(hum), pump)
+
+def downlink(utc, topic, payload):
+    if _f is None:
+        return
+    topic = topic[:255]
+    payload = payload[:255]
+    _put(b"D", FMT_DOWNLINK, utc, len(topic), len(payload), tail=topic + payload)
+
+def power(utc, active):
+    if _f is None:
+        return
+    _put(b"P", FMT_POWER, utc, 1 if active else 0)
@@ -1,5 +1,6 @@
 import socket, struct, sys
 from binascii import hexlify
+from fastpath import put_varint, recv_varint
 
 class MQTTException(Exception):
     pass
@@ -39,20 +40,36 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        self.ssl_session = None
+        self.ssl_resume = True
+        self.ssl_reused = False
+        self.getaddrinfo = socket.getaddrinfo
+        # Traffic counters (lib/netstats.py charges them to subsystems)
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.tx_pkts = 0
+        self.rx_pkts = 0
+
+    def _write(self, buf, n=None):
+        if n is None:
+            n = len(buf)
+            self.sock.write(buf)
+        else:
+            self.sock.write(buf, n)
+        self.tx_bytes += n
+
+    def _read(self, n):
+        res = self.sock.read(n)
+        if res:
+            self.rx_bytes += len(res)
+        return res
 
     def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+        self._write(struct.pack("!H", len(s)))
+        self._write(s)
 
     def _recv_len(self):
-        n = 0
-        sh = 0
-        while 1:
-            b = self.sock.read(1)[0]
-            n |= (b & 0x7F) << sh
-            if not b & 0x80:
-                return n
-            sh += 7
+        return recv_varint(self._read)
 
     def set_callback(self, f):
         self.cb = f
@@ -69,10 +86,10 @@ class MQTTClient:
         if sock is None:
             sock = socket.socket()
         self.sock = sock
-        addr = socket.getaddrinfo(self.server, self.port)[0][-1]
+        addr = self.getaddrinfo(self.server, self.port)[0][-1]
         self.sock.connect(addr)
         if self.ssl:
-            self.sock = self.ssl.wrap_socket(self.sock, server_hostname=self.server)
+            self.sock = self._wrap_ssl(self.sock)
         premsg = bytearray(b"\x10\0\0\0\0\0")
         msg = bytearray(b"\x04MQTT\x04\x02\0\0")
 
@@ -90,15 +107,11 @@ class MQTTClient:
             msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
             msg[6] |= self.lw_retain << 5
 
-        i = 1
-        while sz > 0x7F:
-            premsg[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
+        assert sz < 268435456   # 4 length bytes fit premsg
+        i = put_varint(premsg, sz)
 
-        self.sock.write(premsg, i + 2)
-        self.sock.write(msg)
+        self._write(premsg, i + 2)
+        self._write(msg)
         self._send_str(self.client_id)
         if self.lw_topic:
             self._send_str(self.lw_topic)
@@ -106,22 +119,48 @@ class MQTTClient:
         if self.user:
             self._send_str(self.user)
             self._send_str(self.pswd)
-        resp = self.sock.read(4)
+        self.tx_pkts += 1
+        resp = self._read(4)
+        self.rx_pkts += 1
         assert resp[0] == 0x20 and resp[1] == 0x02
         if resp[3] != 0:
             raise MQTTException(resp[3])
+        if self.ssl and self.ssl_resume:
+            # TLS 1.3 tickets arrive after the handshake, so grab the session late
+            self.ssl_session = getattr(self.sock, "session", None)
+            self.ssl_reused = bool(getattr(self.sock, "session_reused", False))
         return resp[2] & 1
 
+    def _wrap_ssl(self, sock):
+        if self.ssl_resume and self.ssl_session is not None:
+            try:
+                return self.ssl.wrap_socket(sock, server_hostname=self.server, session=self.ssl_session)
+            except TypeError:
+                # Port has no session resumption, stop trying
+                self.ssl_resume = False
+                self.ssl_session = None
+            except ValueError:
+                # Session not usable with this context, do a full handshake
+                self.ssl_session = None
+            except OSError:
+                # Handshake died mid-way; next attempt starts from scratch
+                self.ssl_session = None
+                raise
+        self.ssl_reused = False
+        return self.ssl.wrap_socket(sock, server_hostname=self.server)
+
     def disconnect(self):
         try:
-            self.sock.write(b"\xe0\0")
+            self._write(b"\xe0\0")
+            self.tx_pkts += 1
             self.sock.close()
         except:
             pass
         self.sock = None
 
     def ping(self):
-        self.sock.write(b"\xc0\0")
+        self._write(b"\xc0\0")
+        self.tx_pkts += 1
 
     def publish(self, topic, msg, retain=False, qos=0):
         topic = _raw(topic)
@@ -132,27 +171,23 @@ class MQTTClient:
         if qos > 0:
             sz += 2
         assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        self.sock.write(pkt, i + 1)
+        i = put_varint(pkt, sz)
+        self._write(pkt, i + 1)
         self._send_str(topic)
         if qos > 0:
             self.pid = (self.pid % 0xFFFF) + 1
             pid = self.pid
             struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
+            self._write(pkt, 2)
+        self._write(msg)
+        self.tx_pkts += 1
         if qos == 1:
             while 1:
                 op = self.wait_msg()
                 if op == 0x40:
-                    sz = self.sock.read(1)
+                    sz = self._read(1)
                     assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
+                    rcv_pid = self._read(2)
                     rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
                     if pid == rcv_pid:
                         return
@@ -165,42 +200,44 @@ class MQTTClient:
         pkt = bytearray(b"\x82\0\0\0")
         self.pid = (self.pid % 0xFFFF) + 1
         struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        self.sock.write(pkt)
+        self._write(pkt)
         self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+        self._write(qos.to_bytes(1, "little"))
+        self.tx_pkts += 1
         while 1:
             op = self.wait_msg()
             if op == 0x90:
-                resp = self.sock.read(4)
+                resp = self._read(4)
                 assert resp[1] == pkt[2] and resp[2] == pkt[3]
                 if resp[3] == 0x80:
                     raise MQTTException(resp[3])
                 return
 
     def wait_msg(self):
-        res = self.sock.read(1)
+        res = self._read(1)
         self.sock.setblocking(True)
         if res is None:
             return None
         if res == b"":
             raise OSError(-1)
+        self.rx_pkts += 1
         if res == b"\xd0":
-            sz = self.sock.read(1)[0]
+            sz = self._read(1)[0]
             assert sz == 0
             return None
         op = res[0]
         if op & 0xF0 != 0x30:
             return op
         sz = self._recv_len()
-        topic_len = self.sock.read(2)
+        topic_len = self._read(2)
         topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self.sock.read(topic_len)
+        topic = self._read(topic_len)
         sz -= topic_len + 2
         if op & 6:
-            pid = self.sock.read(2)
+            pid = self._read(2)
             pid = pid[0] << 8 | pid[1]
             sz -= 2
-        msg = self.sock.read(sz)
+        msg = self._read(sz)
         try:
             self.cb(topic, msg)
         except Exception as e:
@@ -208,7 +245,8 @@ class MQTTClient:
         if op & 6 == 2:
             pkt = bytearray(b"\x40\x02\0\0")
             struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
+            self._write(pkt)
+            self.tx_pkts += 1
         elif op & 6 == 4:
             assert 0
         return op
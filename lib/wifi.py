@@ -0,0 +1,160 @@
+import struct, random, utime
+import network
+import uasyncio as asyncio
+import config
+
+# Wi-Fi link supervisor.
+#
+# task() polls WLAN.status() and RSSI every WIFI_CHECK_MS. When the link
+# drops it reconnects in the background: first straight to the cached
+# access point (BSSID + channel from WIFI_CACHE_FILE, no scan), then with a
+# full scan, backing off exponentially between attempts. Link changes are
+# published to subscribe()rs, and network clients wait_up() instead of
+# running into connect timeouts while the link is down.
+#
+# up() is True until set_link(False) (supervisor, or main.py when the first
+# connect fails), so code on a PC without a supervisor behaves as before.
+
+stats = {"rssi": None, "rssi_min": None, "weak": 0, "drops": 0, "reconnects": 0,
+         "fast": 0, "full": 0, "failures": 0, "bssid": None, "channel": None, "down_ms": 0}
+_up = True
+_event = asyncio.Event()
+_event.set()
+_listeners = []
+_hint = None   # (bssid bytes, channel) of the last good association
+
+def up():
+    return _up
+
+async def wait_up():
+    while not _up:
+        await _event.wait()
+
+def subscribe(callback):
+    # callback(up) runs in the supervisor task on every link change
+    _listeners.append(callback)
+
+def set_link(state):
+    global _up
+    if state == _up:
+        return
+    _up = state
+    if state:
+        _event.set()
+    else:
+        _event.clear()
+    print("WiFi link", "up" if state else "down")
+    for cb in _listeners:
+        try:
+            cb(state)
+        except Exception as e:
+            print("WiFi listener error:", e)
+
+def _load_hint():
+    global _hint
+    try:
+        with open(config.WIFI_CACHE_FILE, "rb") as f:
+            data = f.read()
+        if len(data) == 7:
+            _hint = (data[:6], data[6])
+    except OSError:
+        pass
+    return _hint
+
+def _save_hint(wlan):
+    # Remember the access point we got for a scan-free reconnect
+    global _hint
+    try:
+        hint = (bytes(wlan.config("bssid")), wlan.config("channel"))
+    except Exception:
+        return
+    stats["bssid"] = ":".join("%02x" % b for b in hint[0])
+    stats["channel"] = hint[1]
+    if hint == _hint:
+        return
+    _hint = hint
+    try:
+        with open(config.WIFI_CACHE_FILE, "wb") as f:
+            f.write(hint[0] + struct.pack("B", hint[1]))
+    except OSError as e:
+        print("WiFi cache write failed:", e)
+
+def associate(wlan, ssid, key, fast=True):
+    # Start connecting; with fast and a cached AP, skip the scan. True if fast.
+    if fast and (_hint or _load_hint()):
+        try:
+            wlan.connect(ssid, key, bssid=_hint[0], channel=_hint[1])
+            return True
+        except TypeError:
+            pass   # port without bssid/channel arguments
+    wlan.connect(ssid, key)
+    return False
+
+async def _attempt(wlan, fast):
+    # One (re)association; True once we have an IP
+    try:
+        wlan.disconnect()
+    except OSError:
+        pass
+    fast = associate(wlan, config.WIFI_SSID, config.WIFI_PASS, fast)
+    stats["fast" if fast else "full"] += 1
+    timeout = config.WIFI_FAST_TIMEOUT_MS if fast else config.WIFI_CONNECT_TIMEOUT_MS
+    t0 = utime.ticks_ms()
+    while utime.ticks_diff(utime.ticks_ms(), t0) < timeout:
+        status = wlan.status()
+        if status == network.STAT_GOT_IP:
+            return True
+        if status in (network.STAT_WRONG_PASSWORD, network.STAT_NO_AP_FOUND, network.STAT_CONNECT_FAIL):
+            break
+        await asyncio.sleep_ms(100)
+    stats["failures"] += 1
+    return False
+
+def _backoff_ms(failures):
+    cap = min(config.WIFI_BACKOFF_MAX_MS, config.WIFI_BACKOFF_MIN_MS << min(failures, 16))
+    return cap // 2 + random.getrandbits(16) * (cap - cap // 2) // 65536
+
+async def task():
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    _load_hint()
+    failures = 0
+    down_since = None
+    while True:
+        if wlan.isconnected():
+            if not _up:
+                stats["reconnects"] += 1
+                if down_since is not None:
+                    stats["down_ms"] += utime.ticks_diff(utime.ticks_ms(), down_since)
+                    down_since = None
+                _save_hint(wlan)
+                set_link(True)
+            elif stats["bssid"] is None:
+                _save_hint(wlan)
+            failures = 0
+            rssi = wlan.status("rssi")
+            stats["rssi"] = rssi
+            if stats["rssi_min"] is None or rssi < stats["rssi_min"]:
+                stats["rssi_min"] = rssi
+            if rssi < config.WIFI_RSSI_WEAK_DBM:
+                stats["weak"] += 1
+            await asyncio.sleep_ms(config.WIFI_CHECK_MS)
+            continue
+        if _up:
+            stats["drops"] += 1
+            down_since = utime.ticks_ms()
+            set_link(False)
+        elif down_since is None:
+            down_since = utime.ticks_ms()
+        # Cached AP first; after that it may have moved, so scan
+        try:
+            if await _attempt(wlan, failures == 0):
+                continue
+        except OSError as e:
+            # connect() itself can fail (driver busy, radio reset); back off like any failure
+            stats["failures"] += 1
+            print("WiFi reconnect error:", e)
+        failures += 1
+        delay = _backoff_ms(failures - 1)
+        print("WiFi reconnect failed (status %d), retry in %d ms" % (wlan.status(), delay))
+        await asyncio.sleep_ms(delay)
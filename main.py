@@ -1,14 +1,25 @@
 import sys
+import json
 import utime
 import uasyncio as asyncio
-import machine
 import network
-import ntptime
 import config
+import startup
+import timesvc
+import inputs
+import statusd
+import tracelog
+import gcpolicy
+import dnscache
+import endpoints
+import ota
+import netstats
+import wifi
 import blynk_mqtt
 from demo import Device
 
 BLYNK_FIRMWARE_VERSION = "PicoPlant"
+app_loops = 0   # app_task cycles, for the OTA health check
 
 # Check MQTT instance
 if not hasattr(blynk_mqtt, 'mqtt') or blynk_mqtt.mqtt is None:
@@ -17,6 +28,7 @@ if not hasattr(blynk_mqtt, 'mqtt') or blynk_mqtt.mqtt is None:
 
 mqtt_client = blynk_mqtt.mqtt
 plant_device = Device(mqtt_client)
+startup.mark("drivers")
 
 def on_mqtt_message(topic_bytes, payload_bytes):
     # Handle MQTT message
@@ -40,57 +52,58 @@ if hasattr(blynk_mqtt, 'on_disconnected'):
 if hasattr(blynk_mqtt, 'firmware_version'):
     blynk_mqtt.firmware_version = BLYNK_FIRMWARE_VERSION
 
-def setup_network_and_time():
-    # Connect to WiFi and sync time
+async def connect_wifi_async(timeout_s=25):
+    # Wait for the association boot.py started; only (re)connect if it isn't in progress
     sta_if = network.WLAN(network.STA_IF)
-    wifi_conn = sta_if.isconnected()
-    if not wifi_conn:
+    if not sta_if.isconnected():
         sta_if.active(True)
-        try:
-            sta_if.disconnect()
-            utime.sleep_ms(200)
-        except OSError:
-            pass
-        sta_if.connect(config.WIFI_SSID, config.WIFI_PASS)
-        t = 25
-        while not sta_if.isconnected() and t > 0:
-            utime.sleep(1)
-            t -= 1
+        if sta_if.status() != network.STAT_CONNECTING:
+            wifi.associate(sta_if, config.WIFI_SSID, config.WIFI_PASS)
+        t0 = utime.ticks_ms()
+        while not sta_if.isconnected() and utime.ticks_diff(utime.ticks_ms(), t0) < timeout_s * 1000:
+            await asyncio.sleep_ms(100)
     if sta_if.isconnected():
-        if not wifi_conn:
-            print(f"WiFi connected! IP: {sta_if.ifconfig()[0]}")
-        ntp_ok = False
-        for _ in range(3):
-            try:
-                ntptime.timeout = 7
-                ntptime.settime()
-                utc_dt = machine.RTC().datetime()
-                utc_ts = utime.mktime((utc_dt[0], utc_dt[1], utc_dt[2], utc_dt[4], utc_dt[5], utc_dt[6], utc_dt[3], 0))
-                local_ts = utc_ts + (3 * 3600)
-                y, m, d, hr, mi, s, wd, _ = utime.localtime(local_ts)
-                machine.RTC().datetime((y, m, d, wd, hr, mi, s, 0))
-                dt_local = machine.RTC().datetime()
-                print(f"RTC local time: {dt_local[2]:02d}/{dt_local[1]:02d} {dt_local[4]:02d}:{dt_local[5]:02d}")
-                ntp_ok = True
-                break
-            except Exception as e:
-                if _ == 2:
-                    print(f"NTP error: {e}")
-                if _ < 2:
-                    utime.sleep(3)
-        if not ntp_ok:
-            print("NTP sync failed.")
+        print(f"WiFi connected! IP: {sta_if.ifconfig()[0]}")
         return True
-    else:
-        print("WiFi failed!")
-        return False
+    print("WiFi failed!")
+    return False
+
+async def network_task():
+    # Bring up WiFi -> time -> MQTT while sensing already runs
+    if sys.platform != "linux":
+        if not await startup.once_async("wifi", connect_wifi_async):
+            # Keep sensing and watering locally; the supervisor brings the link up
+            print("CRITICAL: No WiFi. Running in local-only mode until it comes back.")
+            wifi.set_link(False)
+        asyncio.create_task(wifi.task())
+        await wifi.wait_up()
+        # Resolve the cloud hosts in the background while NTP starts up
+        asyncio.create_task(dnscache.task())
+        for host, port in endpoints.hosts:
+            dnscache.prefetch(host)
+        dnscache.prefetch(config.TIME_NTP_HOST)
+        asyncio.create_task(timesvc.task())
+    startup.mark("network_ready")
+    asyncio.create_task(endpoints.task(blynk_mqtt.ssl_ctx))
+    asyncio.create_task(blynk_mqtt.task())
+    asyncio.create_task(mqtt_check_task())
+    if config.STATUS_HTTP_ENABLED:
+        # Optional; a busy port must not take the cloud tasks down with it
+        try:
+            await statusd.serve()
+        except OSError as e:
+            print(f"Status server not started: {e}")
 
 async def mqtt_check_task():
     # Check MQTT messages
     while True:
         try:
+            if not wifi.up():
+                await wifi.wait_up()
+                continue
             if mqtt_client and hasattr(mqtt_client, 'sock') and mqtt_client.sock is not None:
                 mqtt_client.check_msg()
+                netstats.mqtt("mqtt", mqtt_client)
             else:
                 print("MQTT not connected, skipping check.")
         except Exception as e:
@@ -98,25 +111,46 @@ async def mqtt_check_task():
             await asyncio.sleep(1)
         await asyncio.sleep_ms(100)
 
+def firmware_healthy():
+    # A new OTA firmware counts as good once it reached Blynk and the app loop runs
+    return blynk_mqtt.connection_count > 0 and app_loops > 1
+
+def publish_traffic(hour_start, counters):
+    # Hourly traffic totals as JSON on NET_REPORT_VPIN
+    if config.NET_REPORT_VPIN is not None:
+        report = netstats.summary(counters)
+        report["hour"] = hour_start
+        plant_device.send_blynk_value_mqtt(config.NET_REPORT_VPIN, json.dumps(report))
+
 async def app_task():
     # Main application loop
+    global app_loops
     interval_s = config.APP_LOOP_INTERVAL_S  # config.py'den alınan değer
     http_interval_s = config.HTTP_BLYNK_UPDATE_INTERVAL_S
     last_http_update_s = utime.time() - http_interval_s
 
     while True:
         current_s = utime.time()
+        cycle_start_ms = utime.ticks_ms()
         if plant_device.system_active:
             try:
                 await plant_device.read_all_sensors_sequentially()
-                if (current_s - last_http_update_s) >= http_interval_s:
+                startup.mark("first_reading")
+                if startup.reached("network_ready") and (current_s - last_http_update_s) >= http_interval_s:
                     plant_device.update_blynk_http()
                     last_http_update_s = current_s
+                    if plant_device.last_sensor_update_s and startup.mark("first_publish"):
+                        startup.report()
                 plant_device.update_blynk_mqtt_pump_status()
                 await plant_device.run_smart_plant_logic()
                 plant_device.print_sensor_data_to_terminal()
             except Exception as e:
                 print(f"App task error: {e}")
+            statusd.record_loop(utime.ticks_diff(utime.ticks_ms(), cycle_start_ms))
+        app_loops += 1
+        statusd.update(plant_device)
+        # Idle window between control cycles: collect here, not mid-cycle
+        gcpolicy.idle_collect()
         await asyncio.sleep(interval_s)
 
 async def start_system():
@@ -127,19 +161,31 @@ async def start_system():
         print("ERROR: 'urequests' missing!")
         return
 
-    if sys.platform != "linux":
-        if not setup_network_and_time():
-            print("CRITICAL: No WiFi. System will wait for power button.")
-            return
+    # CA parsing runs while the radio is still associating (started in boot.py)
+    startup.once("ssl", blynk_mqtt.init_ssl)
+    ota.ssl_ctx = blynk_mqtt.ssl_ctx
+    gcpolicy.setup()
 
     # System will start OFF, wait for power button
     plant_device.system_active = False
+    tracelog.start(plant_device)
     print("System ready. Waiting for power button press.")
 
+    # Local sensing/control comes up first; network follows in the background
     loop = asyncio.get_event_loop()
-    loop.create_task(blynk_mqtt.task())
-    loop.create_task(mqtt_check_task())
+    loop.create_task(inputs.bus.task())
+    loop.create_task(plant_device.tones.task())
+    loop.create_task(plant_device.store.task())
+    loop.create_task(plant_device.dht_reader.task())
+    loop.create_task(plant_device.message_task())
+    loop.create_task(plant_device.downlink_task())
+    if plant_device.core1:
+        plant_device.core1.start()
+        print("Sensing and pump control running on core 1.")
     loop.create_task(app_task())
+    loop.create_task(network_task())
+    loop.create_task(ota.health_task(firmware_healthy))
+    loop.create_task(netstats.task(publish_traffic))
 
     try:
         loop.run_forever()
@@ -152,9 +198,13 @@ async def start_system():
                 print("MQTT closed.")
             except:
                 pass
+        if plant_device.core1:
+            plant_device.core1.stop()
         if hasattr(plant_device, 'pump_pin'):
             plant_device.pump_pin.off()
             print("Pump off.")
+        plant_device.store.flush()
+        tracelog.flush()
         loop.close()
         print("App terminated.")
 
@@ -0,0 +1,239 @@
+# Local Blynk.Cloud stand-in for offline integration and load tests.
+#
+# Serves what the firmware uses from Blynk.Cloud:
+#   HTTP  GET /external/api/batch/update?token=...&V0=..   (update_blynk_http)
+#         GET /external/api/get?token=...&V4               (read a datastream)
+#         GET /external/api/update?token=...&V4=1          (app-side write:
+#             forwarded to the device as downlink/ds/<datastream name>)
+#   MQTT  ds/<device>/dp/V<n>, info/mcu from the device, downlink/ds/... to it,
+#         token auth: CONNACK 4 for a wrong token, 5 for a --disabled one
+#         (the codes blynk_mqtt.task treats as "Invalid BLYNK_AUTH_TOKEN")
+#
+#   python tools/blynk_standin.py --token <BLYNK_AUTH_TOKEN> --record traffic.jsonl
+#   python tools/blynk_standin.py --cert cert.pem --key key.pem --http-port 8443
+# Then point config.BLYNK_HOSTS at "localhost:<mqtt port>" (with a matching
+# BLYNK_MQTT_CA_FILE) and the HTTP API at the same host (--http-port 443, or
+# hostsim.http_target on a PC).
+#
+# Every packet and request is recorded as one JSON line: t (s since start),
+# proto, dir, kind, bytes and topic/path. Typed commands on stdin push
+# downlinks: "V4 1" or "Soil Moisture Threshold 35".
+#
+# Fault injection: --delay-ms delays every reply, --drop-after closes MQTT
+# connections after N s, --max-per-s throttles PUBLISHes (excess dropped) and
+# HTTP requests (429), --http-fail answers that share of HTTP requests with 500.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import unquote, urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import broker_standin
+
+# Datastreams the firmware receives as downlinks (names as in the Blynk template)
+DATASTREAMS = {
+    4: "Water Pump Manual Control",
+    8: "Watering Lockout",
+    9: "Manual Watering Duration",
+    10: "Auto Watering Duration",
+    11: "Soil Moisture Threshold",
+}
+
+
+class Recorder:
+    def __init__(self, path=None):
+        self.t0 = time.monotonic()
+        self.f = open(path, "w", buffering=1) if path else None   # line buffered: usable while running
+        self.totals = {}   # (proto, dir) -> [messages, bytes]
+
+    def add(self, proto, direction, kind, nbytes, **extra):
+        tot = self.totals.setdefault((proto, direction), [0, 0])
+        tot[0] += 1
+        tot[1] += nbytes
+        if self.f:
+            rec = {"t": round(time.monotonic() - self.t0, 4), "proto": proto, "dir": direction,
+                   "kind": kind, "bytes": nbytes}
+            rec.update(extra)
+            self.f.write(json.dumps(rec) + "\n")
+
+    def summary(self):
+        wall = max(time.monotonic() - self.t0, 1e-6)
+        lines = []
+        for (proto, direction), (n, b) in sorted(self.totals.items()):
+            lines.append("%-5s %-4s %7d msgs %9d bytes  %.2f msgs/s  %.1f B/s"
+                         % (proto, direction, n, b, n / wall, b / wall))
+        return "\n".join(lines)
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+
+class BlynkCloud:
+    def __init__(self, token, disabled=(), delay_ms=0, drop_after=0, max_per_s=0, http_fail=0.0, record=None):
+        self.token = token
+        self.delay_ms = delay_ms
+        self.max_per_s = max_per_s
+        self.http_fail = http_fail
+        self.rec = Recorder(record)
+        self.broker = broker_standin.Broker(token, drop_after, delay_ms, max_per_s)
+        self.broker.disabled = tuple(disabled)
+        self.broker.on_packet = self._mqtt_packet
+        self.broker.on_publish = self._mqtt_publish
+        self.values = {}     # "V0" -> last value from the device
+        self.mcu_info = None
+        self.http_throttled = 0
+        self._http_window = (0, 0)
+
+    # --- MQTT ---
+
+    def _mqtt_packet(self, direction, kind, nbytes, topic):
+        extra = {"topic": topic.decode(errors="replace")} if topic else {}
+        self.rec.add("mqtt", direction, kind, nbytes, **extra)
+
+    def _mqtt_publish(self, topic, payload):
+        topic = topic.decode(errors="replace")
+        value = payload.decode(errors="replace")
+        if topic == "info/mcu":
+            try:
+                self.mcu_info = json.loads(value)
+            except ValueError:
+                self.mcu_info = value
+            print("[blynk] info/mcu", value)
+        elif topic.startswith("ds/"):
+            self.values[topic.rsplit("/", 1)[-1]] = value
+
+    def downlink(self, stream, value):
+        # Push a datastream write to every connected device (stream: "V4" or a name)
+        if stream[:1] in "Vv" and stream[1:].isdigit():
+            stream = DATASTREAMS.get(int(stream[1:]), stream)
+        for writer in list(self.broker.clients):
+            self.broker.publish(writer, "downlink/ds/" + stream, str(value))
+        return len(self.broker.clients)
+
+    # --- HTTP ---
+
+    def _http_allowed(self):
+        if not self.max_per_s:
+            return True
+        now_s = int(time.monotonic())
+        start, n = self._http_window
+        if now_s != start:
+            start, n = now_s, 0
+        self._http_window = (start, n + 1)
+        return n < self.max_per_s
+
+    def _api(self, path, query):
+        # Returns (status, body) like blynk.cloud's external API
+        params = []
+        for part in query.split("&"):
+            if part:
+                k, _, v = part.partition("=")
+                params.append((unquote(k), unquote(v)))
+        token = dict(params).get("token")
+        if token != self.token or token in self.broker.disabled:
+            return 400, b'{"error":{"message":"Invalid token."}}'
+        pins = [(k, v) for k, v in params if k != "token"]
+        if path == "/external/api/batch/update":
+            for k, v in pins:
+                self.values[k.upper()] = v
+            return 200, b""
+        if path == "/external/api/update":
+            for k, v in pins:
+                self.downlink(k.upper(), v)
+            return 200, b""
+        if path == "/external/api/get":
+            if len(pins) == 1:
+                return 200, str(self.values.get(pins[0][0].upper(), "")).encode()
+            return 200, json.dumps({k.upper(): self.values.get(k.upper()) for k, _ in pins}).encode()
+        return 404, b'{"error":{"message":"Not found."}}'
+
+    async def http_handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        target = head.split(b" ", 2)[1].decode()
+        url = urlsplit(target)
+        self.rec.add("http", "in", "GET", len(head), path=url.path)
+        if self.delay_ms:
+            await asyncio.sleep(self.delay_ms / 1000)
+        if not self._http_allowed():
+            self.http_throttled += 1
+            status, body = 429, b'{"error":{"message":"Too many requests."}}'
+        elif self.http_fail and random.random() < self.http_fail:
+            status, body = 500, b""
+        else:
+            status, body = self._api(url.path, url.query)
+        reply = (b"HTTP/1.1 %d %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                 % (status, b"OK" if status == 200 else b"Error", len(body))) + body
+        self.rec.add("http", "out", str(status), len(reply), path=url.path)
+        writer.write(reply)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+async def _console(cloud):
+    # "V4 1" / "Soil Moisture Threshold 35" on stdin -> downlink
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            return
+        line = line.strip()
+        if not line:
+            continue
+        if line == "stats":
+            print(cloud.rec.summary())
+            continue
+        stream, _, value = line.rpartition(" ")
+        n = cloud.downlink(stream, value)
+        print("[blynk] downlink %s=%s to %d device(s)" % (stream, value, n))
+
+
+async def _main(args):
+    cloud = BlynkCloud(args.token, args.disabled, args.delay_ms, args.drop_after, args.max_per_s,
+                       args.http_fail, args.record)
+    ssl_ctx = broker_standin.make_ssl(args.cert, args.key)
+    mqtt = await broker_standin.serve(args.host, args.mqtt_port, cloud.broker, ssl_ctx)
+    http = await asyncio.start_server(cloud.http_handle, args.host, args.http_port,
+                                      ssl=broker_standin.make_ssl(args.cert, args.key))
+    print("[blynk] MQTT on %s:%d, HTTP on %s:%d%s" % (args.host, args.mqtt_port, args.host, args.http_port,
+                                                     " (TLS)" if ssl_ctx else ""))
+    try:
+        await _console(cloud)
+        await asyncio.Event().wait()
+    finally:
+        mqtt.close()
+        http.close()
+        print(cloud.rec.summary())
+        cloud.rec.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local Blynk.Cloud stand-in (HTTP API + MQTT)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--mqtt-port", type=int, default=8883)
+    ap.add_argument("--http-port", type=int, default=8080)
+    ap.add_argument("--cert")
+    ap.add_argument("--key")
+    ap.add_argument("--token", required=True, help="valid device auth token")
+    ap.add_argument("--disabled", nargs="*", default=(), help="tokens refused with CONNACK 5")
+    ap.add_argument("--record", help="write the traffic log (JSON lines) here")
+    ap.add_argument("--delay-ms", type=int, default=0, help="delay every reply by N ms")
+    ap.add_argument("--drop-after", type=float, default=0, help="close MQTT connections after N s")
+    ap.add_argument("--max-per-s", type=int, default=0, help="throttle to N publishes/requests per second")
+    ap.add_argument("--http-fail", type=float, default=0, help="share of HTTP requests answered with 500")
+    try:
+        asyncio.run(_main(ap.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,231 @@
+# Minimal MQTT 3.1.1 broker stand-in for exercising blynk_mqtt reconnects on a PC.
+#
+# Run with TLS (self-signed):
+#   openssl req -x509 -newkey rsa:2048 -nodes -days 30 -subj "/CN=localhost" \
+#       -keyout key.pem -out cert.pem
+#   python tools/broker_standin.py --port 8883 --cert cert.pem --key key.pem
+# Then point config.BLYNK_MQTT_BROKER at "localhost" and BLYNK_MQTT_CA_FILE at cert.pem.
+#
+# --drop-after closes each client connection after N seconds to force reconnects.
+# --delay-ms delays every reply, and with TLS also the server side of the
+# handshake, so several instances on different ports can stand in for near
+# and far regions (lib/endpoints.py probes connect + handshake time):
+#   python tools/broker_standin.py --port 8001 --cert cert.pem --key key.pem
+#   python tools/broker_standin.py --port 8002 --cert cert.pem --key key.pem --delay-ms 300
+#   config.BLYNK_HOSTS = ("localhost:8001", "localhost:8002")
+# The log shows handshake time and whether the TLS session was resumed.
+import argparse
+import asyncio
+import ssl
+import struct
+import time
+
+
+def _encode_len(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+async def _read_packet(reader):
+    hdr = await reader.readexactly(1)
+    n = 0
+    sh = 0
+    while True:
+        b = (await reader.readexactly(1))[0]
+        n |= (b & 0x7F) << sh
+        if not b & 0x80:
+            break
+        sh += 7
+    body = await reader.readexactly(n) if n else b""
+    return hdr[0], body
+
+
+PACKET_NAMES = {0x10: "CONNECT", 0x20: "CONNACK", 0x30: "PUBLISH", 0x40: "PUBACK", 0x80: "SUBSCRIBE",
+                0x90: "SUBACK", 0xC0: "PINGREQ", 0xD0: "PINGRESP", 0xE0: "DISCONNECT"}
+
+
+class Broker:
+    def __init__(self, token=None, drop_after=0, delay_ms=0, max_per_s=0):
+        self.token = token
+        self.disabled = ()   # tokens refused with rc 5 (device disabled/not authorised)
+        self.drop_after = drop_after
+        self.delay_ms = delay_ms
+        self.max_per_s = max_per_s   # PUBLISHes per second and client; excess is dropped
+        self.connections = 0
+        self.resumed = 0
+        self.throttled = 0
+        self.on_publish = None
+        self.on_packet = None   # on_packet(direction "in"/"out", packet type, bytes, topic or None)
+        self.clients = []   # writers of connected (CONNACKed) clients
+        self.tls = None   # TLS context applied after the handshake delay
+
+    def _check_auth(self, body):
+        # Returns CONNACK return code (0 ok, 4 bad credentials, 5 not authorised)
+        if self.token is None:
+            return 0
+        flags = body[7]
+        pos = 10
+        fields = []
+        while pos + 2 <= len(body):
+            ln = struct.unpack_from("!H", body, pos)[0]
+            fields.append(body[pos + 2:pos + 2 + ln])
+            pos += 2 + ln
+        if not flags & 0x40:
+            return 5
+        password = fields[-1].decode()
+        if password in self.disabled:
+            return 5
+        return 0 if password == self.token else 4
+
+    def _packet(self, direction, op, nbytes, topic=None):
+        if self.on_packet:
+            self.on_packet(direction, PACKET_NAMES.get(op & 0xF0, hex(op)), nbytes, topic)
+
+    def _send(self, writer, data):
+        writer.write(data)
+        self._packet("out", data[0], len(data))
+
+    async def handle(self, reader, writer):
+        t0 = time.monotonic()
+        self.connections += 1
+        peer = writer.get_extra_info("peername")
+        sslobj = writer.get_extra_info("ssl_object")
+        if sslobj is not None and sslobj.session_reused:
+            self.resumed += 1
+        print("[broker] client", peer, "tls" if sslobj else "plain",
+              "resumed" if sslobj is not None and sslobj.session_reused else "")
+        dropper = None
+        if self.drop_after:
+            dropper = asyncio.get_running_loop().call_later(self.drop_after, writer.close)
+        window_s = 0
+        window_n = 0
+        try:
+            while True:
+                op, body = await _read_packet(reader)
+                nbytes = 1 + len(_encode_len(len(body))) + len(body)
+                if self.delay_ms:
+                    await asyncio.sleep(self.delay_ms / 1000)
+                kind = op & 0xF0
+                if kind != 0x30:
+                    self._packet("in", op, nbytes)
+                if kind == 0x10:
+                    rc = self._check_auth(body)
+                    self._send(writer, bytes((0x20, 2, 0, rc)))
+                    print("[broker] CONNECT rc=%d after %.1f ms" % (rc, (time.monotonic() - t0) * 1000))
+                    if rc:
+                        await writer.drain()
+                        break
+                    self.clients.append(writer)
+                elif kind == 0x80:
+                    pid = body[:2]
+                    self._send(writer, b"\x90\x03" + pid + b"\x00")
+                elif kind == 0x30:
+                    tl = struct.unpack_from("!H", body, 0)[0]
+                    topic = body[2:2 + tl]
+                    pos = 2 + tl
+                    self._packet("in", op, nbytes, topic)
+                    if op & 6:
+                        self._send(writer, b"\x40\x02" + body[pos:pos + 2])
+                        pos += 2
+                    now_s = int(time.monotonic())
+                    if now_s != window_s:
+                        window_s, window_n = now_s, 0
+                    window_n += 1
+                    if self.max_per_s and window_n > self.max_per_s:
+                        self.throttled += 1
+                    elif self.on_publish:
+                        self.on_publish(topic, body[pos:])
+                elif kind == 0xC0:
+                    self._send(writer, b"\xd0\x00")
+                elif kind == 0xE0:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if writer in self.clients:
+                self.clients.remove(writer)
+            if dropper:
+                dropper.cancel()
+            writer.close()
+
+    async def delayed_tls(self, transport):
+        # Server side of the TLS handshake, started delay_ms after the accept
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(self.delay_ms / 1000)
+        reader = asyncio.StreamReader()
+        proto = asyncio.StreamReaderProtocol(reader)
+        try:
+            tls = await loop.start_tls(transport, proto, self.tls, server_side=True)
+        except (ssl.SSLError, ConnectionError):
+            transport.close()
+            return
+        proto.connection_made(tls)
+        await self.handle(reader, asyncio.StreamWriter(tls, proto, reader, loop))
+
+    def publish(self, writer, topic, payload):
+        # Push a downlink to a connected client
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(payload, str):
+            payload = payload.encode()
+        body = struct.pack("!H", len(topic)) + topic + payload
+        data = b"\x30" + _encode_len(len(body)) + body
+        writer.write(data)
+        self._packet("out", 0x30, len(data), topic)
+
+
+class _HeldConnection(asyncio.Protocol):
+    # Keeps the ClientHello unread in the socket until delayed_tls() runs
+    def __init__(self, broker):
+        self.broker = broker
+
+    def connection_made(self, transport):
+        transport.pause_reading()
+        asyncio.ensure_future(self.broker.delayed_tls(transport))
+
+
+def make_ssl(cert, key):
+    if not cert:
+        return None
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    return ctx
+
+
+async def serve(host, port, broker, ssl_ctx=None):
+    if ssl_ctx and broker.delay_ms:
+        # Handshake by hand so it can be delayed like the replies
+        broker.tls = ssl_ctx
+        return await asyncio.get_running_loop().create_server(lambda: _HeldConnection(broker), host, port)
+    return await asyncio.start_server(broker.handle, host, port, ssl=ssl_ctx)
+
+
+async def _main(args):
+    broker = Broker(args.token, args.drop_after, args.delay_ms)
+    srv = await serve(args.host, args.port, broker, make_ssl(args.cert, args.key))
+    print("[broker] listening on %s:%d" % (args.host, args.port))
+    async with srv:
+        await srv.serve_forever()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local MQTT broker stand-in")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8883)
+    ap.add_argument("--cert")
+    ap.add_argument("--key")
+    ap.add_argument("--token", help="require this password (Blynk auth token)")
+    ap.add_argument("--drop-after", type=float, default=0, help="close connections after N s")
+    ap.add_argument("--delay-ms", type=int, default=0, help="delay every reply by N ms")
+    try:
+        asyncio.run(_main(ap.parse_args()))
+    except KeyboardInterrupt:
+        pass
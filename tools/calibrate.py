@@ -0,0 +1,177 @@
+# Fleet calibration from recorded raw ADC data (needs NumPy).
+#
+#   python tools/calibrate.py ingest fleet.npy traces/*.bin
+#   python tools/calibrate.py fit fleet.npy --out calibration/
+#
+# ingest reads lib/tracelog.py traces (one file per device, the device name
+# is the file name) and appends the raw soil/water/LDR samples to a single
+# memory-mapped .npy table. fit then computes every device's calibration in
+# one batched pass: each sensor column is sorted once by (device, value) and
+# robust percentiles are read out per device, so outliers (spikes, the
+# 32767 "ADC read failed" value) don't move the end points. The result is a
+# config.py fragment per device plus a JSON summary.
+import argparse
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from replay import FORMATS, MAGIC  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SENSOR_RECORD = np.dtype([("kind", "u1"), ("utc", "<u4"), ("tz", "<i2"), ("soil", "<u2"),
+                          ("water", "<u2"), ("ldr", "<u2"), ("temp", "i1"), ("hum", "u1"),
+                          ("pump", "u1")])
+SAMPLE = np.dtype([("dev", "<u2"), ("utc", "<u4"), ("soil", "<u2"), ("water", "<u2"), ("ldr", "<u2")])
+ADC_FAILED = 32767   # what Device._read_adc_avg_sync returns when every read failed
+S = ord("S")
+
+
+def _scan_trace(data):
+    # Yield (offset, count) of each run of consecutive S records in a
+    # memory-mapped trace; the few other records are stepped over one by one
+    pos = 0
+    n = len(data)
+    stride = SENSOR_RECORD.itemsize
+    while pos < n:
+        if data[pos:pos + len(MAGIC)].tobytes() == MAGIC:
+            pos += len(MAGIC)
+            continue
+        kind = int(data[pos])
+        if kind == S:
+            # Length of the run found vectorised: type byte of every 16th byte
+            count = (n - pos) // stride
+            breaks = np.flatnonzero(data[pos:pos + count * stride:stride] != S)
+            run = int(breaks[0]) if breaks.size else count
+            yield pos, run
+            pos += run * stride
+            if run == count:
+                break
+            continue
+        fmt = FORMATS.get(kind)
+        if fmt is None:
+            raise ValueError("bad record type 0x%02x at offset %d" % (kind, pos))
+        size = 1 + struct.calcsize(fmt)
+        if kind == ord("D"):
+            if pos + size > n:
+                break
+            size += int(data[pos + 5]) + int(data[pos + 6])
+        pos += size
+
+
+def ingest(out_path, traces):
+    # Two passes over memory-mapped traces: find the S runs, then copy them
+    # straight into the memory-mapped output table
+    names = [os.path.splitext(os.path.basename(p))[0] for p in traces]
+    runs = []
+    for path in traces:
+        data = np.memmap(path, np.uint8, mode="r")
+        runs.append(list(_scan_trace(data)))
+    total = sum(c for r in runs for _, c in r)
+    table = np.lib.format.open_memmap(out_path, mode="w+", dtype=SAMPLE, shape=(total,))
+    pos = 0
+    for dev, (path, file_runs) in enumerate(zip(traces, runs)):
+        data = np.memmap(path, np.uint8, mode="r")
+        for off, count in file_runs:
+            recs = np.frombuffer(data, SENSOR_RECORD, count, off)
+            out = table[pos:pos + count]
+            out["dev"] = dev
+            for name in ("utc", "soil", "water", "ldr"):
+                out[name] = recs[name]
+            pos += count
+    table.flush()
+    with open(out_path + ".devices.json", "w") as f:
+        json.dump(names, f)
+    print("ingested %d samples from %d devices into %s" % (total, len(names), out_path))
+
+
+def grouped_percentiles(dev, values, n_dev, qs):
+    # Percentiles of values per device in one sort: returns (n_dev, len(qs)), counts
+    ok = values != ADC_FAILED
+    key = (dev[ok].astype(np.uint32) << 16) | values[ok]
+    key.sort()
+    sdev = (key >> 16).astype(np.int64)
+    svals = (key & 0xFFFF).astype(np.int64)
+    counts = np.bincount(sdev, minlength=n_dev)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    q = np.asarray(qs, dtype=np.float64)
+    idx = starts[:, None] + np.floor(q[None, :] * np.maximum(counts - 1, 0)[:, None]).astype(np.int64)
+    idx = np.clip(idx, 0, max(len(svals) - 1, 0))
+    out = svals[idx] if len(svals) else np.zeros((n_dev, len(qs)), np.int64)
+    return out, counts
+
+
+def fit(table_path, out_dir, lo, hi, min_samples, min_span):
+    import importlib.util
+    spec = importlib.util.spec_from_file_location("config", os.path.join(ROOT, "config.py"))
+    cfg = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cfg)
+    table = np.load(table_path, mmap_mode="r")
+    with open(table_path + ".devices.json") as f:
+        names = json.load(f)
+    n_dev = len(names)
+    dev = np.asarray(table["dev"])
+    soil, soil_n = grouped_percentiles(dev, np.asarray(table["soil"]), n_dev, (lo, hi))
+    water, water_n = grouped_percentiles(dev, np.asarray(table["water"]), n_dev, (lo, hi))
+    ldr, ldr_n = grouped_percentiles(dev, np.asarray(table["ldr"]), n_dev, (lo, hi))
+
+    # Keep the low-water threshold at the same fraction of the tank range
+    low_frac = ((cfg.WATER_ADC_LOW_THRESHOLD_VALUE - cfg.CAL_WATER_ADC_EMPTY) /
+                (cfg.CAL_WATER_ADC_FULL - cfg.CAL_WATER_ADC_EMPTY))
+    water_low = np.rint(water[:, 0] + low_frac * (water[:, 1] - water[:, 0])).astype(np.int64)
+
+    os.makedirs(out_dir, exist_ok=True)
+    summary = {}
+    for i, name in enumerate(names):
+        cal = {}
+        notes = []
+        # Soil: dry reads high, wet reads low
+        if soil_n[i] >= min_samples and soil[i, 1] - soil[i, 0] >= min_span:
+            cal["CAL_SOIL_ADC_DRY"], cal["CAL_SOIL_ADC_WET"] = int(soil[i, 1]), int(soil[i, 0])
+        else:
+            notes.append("soil: not enough range/samples, keeping defaults")
+        if water_n[i] >= min_samples and water[i, 1] - water[i, 0] >= min_span:
+            cal["CAL_WATER_ADC_EMPTY"], cal["CAL_WATER_ADC_FULL"] = int(water[i, 0]), int(water[i, 1])
+            cal["WATER_ADC_LOW_THRESHOLD_VALUE"] = int(water_low[i])
+        else:
+            notes.append("water: not enough range/samples, keeping defaults")
+        # LDR: bright reads low, dark reads high
+        if ldr_n[i] >= min_samples and ldr[i, 1] - ldr[i, 0] >= min_span:
+            cal["CAL_LDR_ADC_BRIGHT"], cal["CAL_LDR_ADC_DARK"] = int(ldr[i, 0]), int(ldr[i, 1])
+        else:
+            notes.append("ldr: not enough range/samples, keeping defaults")
+        summary[name] = {"calibration": cal, "samples": int(soil_n[i]), "notes": notes}
+        with open(os.path.join(out_dir, name + ".py"), "w") as f:
+            f.write("# Calibration for %s from %d samples (p%g/p%g)\n"
+                    % (name, soil_n[i], lo * 100, hi * 100))
+            for n in notes:
+                f.write("# %s\n" % n)
+            for k, v in cal.items():
+                f.write("%s = %d\n" % (k, v))
+    with open(os.path.join(out_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=1)
+    print("calibrated %d devices from %d samples -> %s" % (n_dev, len(table), out_dir))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Batch calibration fitting for a fleet of plants")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    a_in = sub.add_parser("ingest", help="collect raw samples from trace files")
+    a_in.add_argument("table")
+    a_in.add_argument("traces", nargs="+")
+    a_fit = sub.add_parser("fit", help="fit per-device calibration")
+    a_fit.add_argument("table")
+    a_fit.add_argument("--out", default="calibration")
+    a_fit.add_argument("--lo", type=float, default=0.005, help="low percentile (0..1)")
+    a_fit.add_argument("--hi", type=float, default=0.995, help="high percentile (0..1)")
+    a_fit.add_argument("--min-samples", type=int, default=1000)
+    a_fit.add_argument("--min-span", type=int, default=2000, help="minimum raw ADC range to trust")
+    a = ap.parse_args()
+    if a.cmd == "ingest":
+        ingest(a.table, a.traces)
+    else:
+        fit(a.table, a.out, a.lo, a.hi, a.min_samples, a.min_span)
@@ -0,0 +1,346 @@
+# End-to-end latency benchmark: the real firmware tasks (main.app_task,
+# main.network_task -> blynk_mqtt.task, the message queue, ...) run on
+# CPython under tools/hostsim.py in real-time mode, against a local MQTT
+# broker (tools/broker_standin.py) and HTTP stand-in reached through a link
+# emulator that adds delay and loss.
+#
+#   python tools/e2e_bench.py                          # default matrix
+#   python tools/e2e_bench.py --delay-ms 0,50,200 --loss 0,0.05 --duration 30
+#   python tools/e2e_bench.py --tls /tmp/cert.pem /tmp/key.pem
+#
+# Measured per configuration:
+#   uplink http   soil ADC sample -> batch update arriving at the HTTP stand-in
+#   uplink mqtt   soil ADC sample -> next pump-status publish at the broker
+#   downlink      downlink publish at the broker -> pump pin switching
+# plus delivered messages/bytes per second. Every sample cycle gets its own
+# soil percentage, so an uplink value can be traced back to its ADC read.
+#
+# The link emulator delays each chunk by --delay-ms one way; a "lost" chunk
+# (probability --loss) is held for another --rto-ms, like a TCP retransmit.
+# Each configuration runs in a fresh subprocess (the firmware is stateful).
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+
+class Link:
+    # TCP forwarder with one-way delay and retransmit-style loss
+    def __init__(self, upstream_port, delay_ms, loss, rto_ms, seed=1):
+        self.upstream_port = upstream_port
+        self.delay = delay_ms / 1000.0
+        self.loss = loss
+        self.rto = rto_ms / 1000.0
+        self.rand = random.Random(seed)
+
+    async def _pipe(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        q = asyncio.Queue()
+        last = 0.0
+
+        async def deliver():
+            while True:
+                due, data = await q.get()
+                if data is None:
+                    writer.close()
+                    return
+                wait = due - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                writer.write(data)
+                await writer.drain()
+
+        sender = asyncio.ensure_future(deliver())
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                due = loop.time() + self.delay
+                if self.loss and self.rand.random() < self.loss:
+                    due += self.rto
+                last = max(last, due)   # TCP keeps order
+                q.put_nowait((last, data))
+        except ConnectionError:
+            pass
+        q.put_nowait((last, None))
+        try:
+            await sender
+        except ConnectionError:
+            pass
+
+    async def handle(self, reader, writer):
+        try:
+            up_r, up_w = await asyncio.open_connection("127.0.0.1", self.upstream_port)
+        except OSError:
+            writer.close()
+            return
+        await asyncio.gather(self._pipe(reader, up_w), self._pipe(up_r, writer))
+
+
+class HTTPStandin:
+    # Answers every request with 200 and records (time, path, bytes)
+    def __init__(self):
+        self.requests = []
+
+    async def handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        t = time.monotonic()
+        path = head.split(b" ", 2)[1].decode()
+        self.requests.append((t, path, len(head)))
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+def _servers(args, broker, http, ready):
+    # Stand-ins and link emulators get their own event loop thread, so the
+    # firmware's blocking calls (urequests, umqtt) can't stall them
+    import broker_standin
+
+    async def main():
+        ssl_ctx = broker_standin.make_ssl(args.tls[0], args.tls[1]) if args.tls else None
+        b = await broker_standin.serve("127.0.0.1", 0, broker, ssl_ctx)
+        h = await asyncio.start_server(http.handle, "127.0.0.1", 0)
+        bl = Link(b.sockets[0].getsockname()[1], args.delay_ms, args.loss, args.rto_ms, 1)
+        hl = Link(h.sockets[0].getsockname()[1], args.delay_ms, args.loss, args.rto_ms, 2)
+        bs = await asyncio.start_server(bl.handle, "127.0.0.1", 0)
+        hs = await asyncio.start_server(hl.handle, "127.0.0.1", 0)
+        ready["loop"] = asyncio.get_running_loop()
+        ready["mqtt_port"] = bs.sockets[0].getsockname()[1]
+        ready["http_port"] = hs.sockets[0].getsockname()[1]
+        ready["event"].set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    v = sorted(values)
+    return round(v[min(len(v) - 1, int(p / 100.0 * len(v)))], 1)
+
+
+def _dist(values):
+    return {"n": len(values), "p50": _pct(values, 50), "p90": _pct(values, 90),
+            "p99": _pct(values, 99), "max": round(max(values), 1) if values else None}
+
+
+def run_one(args):
+    import hostsim
+    hostsim.install(virtual_time=False)
+    os.chdir(tempfile.mkdtemp(prefix="e2e-"))
+
+    import broker_standin
+    broker = broker_standin.Broker()
+    http = HTTPStandin()
+    mqtt_rx = []   # (t, topic, payload, bytes)
+    broker.on_publish = lambda topic, payload: mqtt_rx.append(
+        (time.monotonic(), topic, payload, len(topic) + len(payload) + 4))
+    ready = {"event": threading.Event()}
+    threading.Thread(target=_servers, args=(args, broker, http, ready), daemon=True).start()
+    ready["event"].wait(10)
+
+    import config
+    host = "localhost" if args.tls else "127.0.0.1"
+    config.BLYNK_HOSTS = ("%s:%d" % (host, ready["mqtt_port"]),)
+    config.STATUS_HTTP_ENABLED = False
+    config.TRACE_ENABLED = False
+    config.APP_LOOP_INTERVAL_S = args.loop_s
+    config.HTTP_BLYNK_UPDATE_INTERVAL_S = args.http_s
+    config.DNS_SERVER = "127.0.0.1"
+    hostsim.http_target = "http://127.0.0.1:%d" % ready["http_port"]
+
+    real_stdout = sys.stdout
+    sys.stdout = io.StringIO() if not args.verbose else sys.stderr
+    import umqtt.simple
+    hostsim.use_stream_sockets(umqtt.simple)
+    import blynk_mqtt
+    if args.tls:
+        blynk_mqtt.ssl_ctx = hostsim.SSLContext(args.tls[0])
+        blynk_mqtt.mqtt.ssl = blynk_mqtt.ssl_ctx
+    else:
+        # Plain MQTT: don't build the firmware's TLS context on CPython
+        blynk_mqtt.init_ssl = lambda: None
+    import main
+
+    dev = main.plant_device
+    soil_vcc = config.PIN_SOIL_MOISTURE_VCC
+    pump_pin = config.PIN_PUMP_CONTROL
+    # Soil ADC value giving each percentage (20..99, above any watering threshold)
+    raw_for = {}
+    for raw in range(min(config.CAL_SOIL_ADC_DRY, config.CAL_SOIL_ADC_WET),
+                     max(config.CAL_SOIL_ADC_DRY, config.CAL_SOIL_ADC_WET) + 1):
+        raw_for.setdefault(dev._map_value(raw, config.CAL_SOIL_ADC_DRY, config.CAL_SOIL_ADC_WET, 0, 100), raw)
+    sampled = {}   # soil percent -> time of the ADC sample that produced it
+    seq = [0]
+    pump_changes = []
+
+    def on_pin(pin, value):
+        now = time.monotonic()
+        if pin == soil_vcc and value:
+            seq[0] += 1
+            p = 20 + seq[0] % 80
+            hostsim.adc[config.PIN_SOIL_MOISTURE_ADC] = raw_for[p]
+            sampled[p] = now
+        elif pin == pump_pin:
+            pump_changes.append((now, value))
+    hostsim.on_pin_change = on_pin
+    hostsim.adc[config.PIN_WATER_LEVEL_ADC] = config.CAL_WATER_ADC_FULL
+    hostsim.adc[config.PIN_LDR_ADC] = config.CAL_LDR_ADC_BRIGHT
+
+    downlinks = []   # (publish time, expected pin value)
+    up_http, up_mqtt = [], []
+    vsoil = "V%d=" % config.VPIN_SOIL_MOISTURE_PERCENT
+    pump_topic = ("ds/%s/dp/V%d" % (config.DEVICE_ID, config.VPIN_PUMP_SWITCH)).encode()
+
+    async def downlink_driver():
+        # One pump command at a time, alternating on/off
+        loop = ready["loop"]
+        value = 1
+        while True:
+            await asyncio.sleep(args.downlink_s)
+            if not broker.clients:
+                continue
+            done = threading.Event()
+
+            def send(v=value):
+                broker.publish(broker.clients[-1], "downlink/ds/Water Pump Manual Control", str(v))
+                downlinks.append((time.monotonic(), v))
+                done.set()
+            loop.call_soon_threadsafe(send)
+            done.wait(1)
+            value ^= 1
+
+    async def bench():
+        dev.system_active = True
+        tasks = [main.app_task(), main.network_task(), dev.message_task(), dev.downlink_task(), dev.store.task(),
+                 main.inputs.bus.task(),
+                 dev.dht_reader.task(), dev.tones.task(), downlink_driver()]
+        running = [asyncio.ensure_future(t) for t in tasks]
+        t0 = time.monotonic()
+        await asyncio.sleep(args.duration)
+        for t in running:
+            t.cancel()
+        return t0, time.monotonic()
+
+    try:
+        t0, t1 = asyncio.run(bench())
+    finally:
+        sys.stdout = real_stdout
+    wall = t1 - t0
+
+    def sample_time(p, t_arrival):
+        ts = sampled.get(p)
+        return ts if ts is not None and ts <= t_arrival else None
+
+    http_bytes = 0
+    for t, path, nbytes in http.requests:
+        http_bytes += nbytes
+        for part in path.split("&"):
+            if part.startswith(vsoil):
+                ts = sample_time(int(part[len(vsoil):]), t)
+                if ts is not None:
+                    up_http.append((t - ts) * 1000)
+    mqtt_bytes = 0
+    for t, topic, payload, nbytes in mqtt_rx:
+        mqtt_bytes += nbytes
+        if topic == pump_topic:
+            # Pump status goes out in the same cycle as the newest sample;
+            # skip the ones a downlink triggered in between
+            before = [v for v in sampled.values() if v <= t]
+            if not before:
+                continue
+            ts = max(before)
+            if not any(ts < tp <= t for tp, _ in downlinks):
+                up_mqtt.append((t - ts) * 1000)
+    down = []
+    lost = 0
+    for tp, v in downlinks:
+        hit = [t for t, pv in pump_changes if t >= tp and pv == v]
+        if hit and hit[0] - tp < args.downlink_s:
+            down.append((hit[0] - tp) * 1000)
+        else:
+            lost += 1
+    return {
+        "delay_ms": args.delay_ms, "loss": args.loss, "tls": bool(args.tls),
+        "seconds": round(wall, 1), "cycles": seq[0],
+        "uplink_http_ms": _dist(up_http), "uplink_mqtt_ms": _dist(up_mqtt),
+        "downlink_ms": _dist(down), "downlink_lost": lost,
+        "mqtt_msgs_per_s": round(len(mqtt_rx) / wall, 2), "mqtt_bytes_per_s": round(mqtt_bytes / wall, 1),
+        "http_reqs_per_s": round(len(http.requests) / wall, 2), "http_bytes_per_s": round(http_bytes / wall, 1),
+        "mqtt_connects": broker.connections,
+    }
+
+
+def _fmt(d):
+    if not d["n"]:
+        return "%-28s" % "-"
+    return "%-28s" % ("%s/%s/%s (n=%d)" % (d["p50"], d["p90"], d["p99"], d["n"]))
+
+
+def matrix(args):
+    print("%-6s %-5s %-28s %-28s %-28s %-5s %s" % ("delay", "loss", "uplink http p50/p90/p99 ms",
+                                                 "uplink mqtt p50/p90/p99 ms", "downlink p50/p90/p99 ms",
+                                                 "lost", "msgs/s mqtt+http"))
+    results = []
+    for delay in args.delay_ms.split(","):
+        for loss in args.loss.split(","):
+            cmd = [sys.executable, __file__, "--one", "--delay-ms", delay, "--loss", loss,
+                   "--rto-ms", str(args.rto_ms), "--duration", str(args.duration),
+                   "--loop-s", str(args.loop_s), "--http-s", str(args.http_s),
+                   "--downlink-s", str(args.downlink_s)]
+            if args.tls:
+                cmd += ["--tls"] + args.tls
+            res = subprocess.run(cmd, capture_output=True, text=True)
+            if res.returncode:
+                sys.stderr.write(res.stderr)
+                continue
+            r = json.loads(res.stdout.strip().splitlines()[-1])
+            results.append(r)
+            print("%-6s %-5s %s %s %s %-5d %.2f+%.2f" % (delay, loss, _fmt(r["uplink_http_ms"]),
+                  _fmt(r["uplink_mqtt_ms"]), _fmt(r["downlink_ms"]), r["downlink_lost"],
+                  r["mqtt_msgs_per_s"], r["http_reqs_per_s"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="End-to-end sensor-to-cloud latency benchmark")
+    ap.add_argument("--delay-ms", default="0,50,200", help="one-way link delay(s), comma separated")
+    ap.add_argument("--loss", default="0,0.05", help="chunk loss probability(ies), comma separated")
+    ap.add_argument("--rto-ms", type=int, default=200, help="extra delay of a lost chunk")
+    ap.add_argument("--duration", type=float, default=20, help="seconds per configuration")
+    ap.add_argument("--loop-s", type=float, default=0.5, help="APP_LOOP_INTERVAL_S for the run")
+    ap.add_argument("--http-s", type=int, default=1, help="HTTP_BLYNK_UPDATE_INTERVAL_S for the run")
+    ap.add_argument("--downlink-s", type=float, default=1.0, help="seconds between pump downlinks")
+    ap.add_argument("--tls", nargs=2, metavar=("CERT", "KEY"), help="TLS broker with this self-signed cert")
+    ap.add_argument("--json", help="also write the results here")
+    ap.add_argument("--one", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--verbose", action="store_true", help="show firmware output (with --one)")
+    a = ap.parse_args()
+    if a.one:
+        a.delay_ms = int(a.delay_ms)
+        a.loss = float(a.loss)
+        print(json.dumps(run_one(a)))
+    else:
+        matrix(a)
@@ -0,0 +1,160 @@
+# Speed and equivalence of the compiled hot paths in lib/fastpath.py.
+#
+# On the Pico (fastpath.py and config.py on the device):
+#   mpremote run tools/fastpath_bench.py
+# times every @micropython.native/viper function against its pure-Python
+# reference (per call, loop overhead subtracted) and checks that both give
+# the same results on the test inputs.
+#
+# On a PC:
+#   python tools/fastpath_bench.py
+# CPython has no native emitter and fastpath uses the references there. So
+# the compiled variants' source is run as plain Python (decorators as
+# no-ops, viper pointer types as mere annotations) and compared with the
+# references: every MQTT length up to 2^21, and every 3rd ADC value through
+# each calibration. 32-bit viper integer limits don't come into play:
+# MQTT lengths are capped by asserts in umqtt.
+import sys
+
+MICROPYTHON = sys.implementation.name == "micropython"
+
+
+class FakeADC:
+    # Deterministic read_u16(); every 7th read fails like a busy ADC
+    def __init__(self):
+        self.n = 0
+
+    def read_u16(self):
+        self.n += 1
+        if self.n % 7 == 0:
+            raise OSError(5)
+        return (self.n * 40503) & 0xFFFF
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, n):
+        self.pos += n
+        return self.data[self.pos - n:self.pos]
+
+
+def map_cases(config):
+    # (in_min, in_max, out_min, out_max) as Device uses them, plus edge cases
+    return ((config.CAL_SOIL_ADC_DRY, config.CAL_SOIL_ADC_WET, 0, 100),
+            (config.CAL_WATER_ADC_EMPTY, config.CAL_WATER_ADC_FULL, 0, 100),
+            (config.CAL_LDR_ADC_BRIGHT, config.CAL_LDR_ADC_DARK, 100, 10),
+            (0, 65535, -50, 50),
+            (1000, 1000, 0, 100))
+
+
+def check(fast, ref, config, step, max_len):
+    # Returns {function: inputs compared}; raises on the first difference
+    counts = {}
+
+    def same(name, a, b, args):
+        if a != b or type(a) != type(b):
+            raise AssertionError("%s%r: %r != %r" % (name, args, a, b))
+        counts[name] = counts.get(name, 0) + 1
+
+    for case in map_cases(config):
+        for x in range(-100, 65636, step):
+            for clamp in (True, False):
+                args = (x,) + case + (clamp,)
+                same("map_value", fast.map_value(*args), ref.map_value_py(*args), args)
+    for samples in (0, 1, 5, 15, 60):
+        a, b = FakeADC(), FakeADC()
+        for _ in range(50):
+            same("adc_avg", fast.adc_avg(a, samples, 0), ref.adc_avg_py(b, samples, 0), (samples,))
+    buf_a = bytearray(6)
+    buf_b = bytearray(6)
+    for sz in list(range(max_len)) + list(range(max_len, 2097152, 997)):
+        i = fast.put_varint(buf_a, sz)
+        same("put_varint", (i, bytes(buf_a[:i + 1])), (ref.put_varint_py(buf_b, sz), bytes(buf_b[:i + 1])), (sz,))
+        if sz % step == 0 or sz < 20000:
+            data = bytes(buf_a[1:i + 1])
+            same("recv_varint", fast.recv_varint(Reader(data).read), ref.recv_varint_py(Reader(data).read), (sz,))
+    return counts
+
+
+def load_compiled_source(path):
+    # Execute fastpath.py as MicroPython would, so its native/viper branch is defined
+    import builtins
+    import types
+    fake_sys = types.SimpleNamespace(implementation=types.SimpleNamespace(name="micropython"))
+    ident = lambda f: f
+    fake_mpy = types.SimpleNamespace(native=ident, viper=ident)
+
+    def _import(name, *args, **kw):
+        if name == "sys":
+            return fake_sys
+        if name == "micropython":
+            return fake_mpy
+        return builtins.__import__(name, *args, **kw)
+
+    b = dict(vars(builtins), __import__=_import, ptr8=bytearray, ptr16=bytearray, ptr32=bytearray, uint=int)
+    ns = {"__builtins__": b, "__name__": "fastpath_compiled"}
+    with open(path) as f:
+        exec(compile(f.read(), path, "exec"), ns)
+    assert ns["put_varint"] is not ns["put_varint_py"]
+    return types.SimpleNamespace(**ns)
+
+
+def bench(fast, ref, config, n):
+    import utime
+    soil = map_cases(config)[0]
+
+    def noop(*args):
+        pass
+
+    def per_call_us(fn, args):
+        t0 = utime.ticks_us()
+        for _ in range(n):
+            fn(*args)
+        return utime.ticks_diff(utime.ticks_us(), t0) / n
+
+    adc = FakeADC()
+    buf = bytearray(6)
+    data = b"\xff\xff\x7f"
+    rows = (("adc_avg (15 reads)", fast.adc_avg, ref.adc_avg_py, (adc, 15, 0)),
+            ("map_value", fast.map_value, ref.map_value_py, (30000,) + soil),
+            ("put_varint (3 bytes)", fast.put_varint, ref.put_varint_py, (buf, 2000000)),
+            ("recv_varint (3 bytes)", lambda: fast.recv_varint(Reader(data).read),
+             lambda: ref.recv_varint_py(Reader(data).read), ()))
+    print("%-22s %10s %10s %8s" % ("function", "python us", "fast us", "speedup"))
+    for name, f, r, args in rows:
+        base = per_call_us(noop, args)
+        if not args:
+            base = per_call_us(lambda: Reader(data), ())   # the reader setup isn't the decoder's cost
+        tf = per_call_us(f, args) - base
+        tr = per_call_us(r, args) - base
+        print("%-22s %10.2f %10.2f %7.2fx" % (name, tr, tf, tr / tf if tf > 0 else 0))
+
+
+def report(counts):
+    for name in sorted(counts):
+        print("%-12s %8d inputs identical" % (name, counts[name]))
+
+
+def main():
+    if MICROPYTHON:
+        import config
+        import fastpath
+        report(check(fastpath, fastpath, config, 97, 20000))
+        bench(fastpath, fastpath, config, 2000)
+        return
+    import os
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    import hostsim
+    hostsim.install(virtual_time=False)
+    import config
+    import fastpath
+    fast = load_compiled_source(os.path.join(os.path.dirname(here), "lib", "fastpath.py"))
+    report(check(fast, fastpath, config, 3, 2097152))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+# Host-side simulation of the MicroPython modules the firmware imports.
+#
+# install() puts stand-ins for utime, uasyncio, machine, dht, network,
+# urequests and micropython into sys.modules and adds the MicroPython-only
+# helpers the firmware uses on CPython's own modules (time.ticks_ms,
+# asyncio.sleep_ms, gc.mem_free, sys.print_exception, ...). The firmware
+# modules (demo.py, lib/*) can then be imported unchanged.
+#
+# Two clock modes:
+#   virtual=True   time only moves when the firmware sleeps or advance() is
+#                  called; sleeps return immediately, so logic runs far
+#                  faster than real time (used by tools/replay.py).
+#   virtual=False  real monotonic time and real asyncio sleeps (used by the
+#                  end-to-end benchmark against local stand-in servers).
+#
+# Simulated hardware is plain module state: set adc[pin] to the raw value an
+# ADC pin should return, dht_value to (temp, hum) or None for a read error,
+# and read pins[pin].value() / pin_log for outputs.
+#
+# Real mode networking: use_stream_sockets(module) gives a library such as
+# umqtt.simple MicroPython-style read()/write() sockets, SSLContext wraps a
+# CPython context for it, and http_target redirects every urequests call to
+# a local stand-in server ("http://127.0.0.1:8081").
+import asyncio
+import calendar
+import gc
+import os
+import socket as _socket
+import ssl as _ssl
+import sys
+import time
+import traceback
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_HALF = _TICKS_PERIOD >> 1
+
+virtual = True
+_now_ms = 0.0
+_epoch = 0
+
+adc = {}            # pin number -> raw value (int or callable returning int)
+dht_value = (22, 50)
+pins = {}           # pin number -> Pin
+pin_log = []        # (ms, pin, value) for every output change
+http_log = []       # (ms, url) for every urequests.get
+http_target = None  # "http://host:port" to send urequests traffic to instead
+on_pin_change = None
+
+
+# --- clock -----------------------------------------------------------------
+
+def now_ms():
+    if virtual:
+        return _now_ms
+    return (time.monotonic() - _mono0) * 1000.0
+
+def set_time(epoch_s):
+    # Set wall clock (UTC seconds since 1970) without moving ticks
+    global _epoch
+    _epoch = epoch_s - now_ms() / 1000.0
+
+def advance(ms):
+    global _now_ms
+    if virtual and ms > 0:
+        _now_ms += ms
+
+def advance_to(epoch_s):
+    # Move virtual time forward so the wall clock reads epoch_s
+    advance((epoch_s - _epoch) * 1000.0 - _now_ms)
+
+_mono0 = time.monotonic()
+
+
+def _make_utime():
+    m = types.ModuleType("utime")
+    m.time = lambda: int(_epoch + now_ms() / 1000.0)
+    m.time_ns = lambda: int((_epoch + now_ms() / 1000.0) * 1e9)
+    m.ticks_ms = lambda: int(now_ms()) % _TICKS_PERIOD
+    m.ticks_us = lambda: int(now_ms() * 1000) % _TICKS_PERIOD
+    m.ticks_diff = lambda a, b: ((a - b + _TICKS_HALF) % _TICKS_PERIOD) - _TICKS_HALF
+    m.ticks_add = lambda a, b: (a + b) % _TICKS_PERIOD
+
+    def sleep_ms(ms):
+        if virtual:
+            advance(ms)
+        else:
+            time.sleep(ms / 1000.0)
+    m.sleep_ms = sleep_ms
+    m.sleep_us = lambda us: sleep_ms(us / 1000.0)
+    m.sleep = lambda s: sleep_ms(s * 1000.0)
+    m.gmtime = lambda t=None: tuple(time.gmtime(m.time() if t is None else t))[:8]
+    m.localtime = m.gmtime  # MicroPython has no time zones
+    m.mktime = lambda t: calendar.timegm(tuple(t[:6]) + (0, 0, 0))
+    return m
+
+
+# --- uasyncio --------------------------------------------------------------
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._ev = asyncio.Event()
+
+    def set(self):
+        self._ev.set()
+
+    def clear(self):
+        self._ev.clear()
+
+    async def wait(self):
+        await self._ev.wait()
+        self._ev.clear()
+
+
+class RecordingLoop:
+    # Stand-in event loop for virtual mode: tasks are recorded, not run
+    def __init__(self):
+        self.created = []
+
+    def create_task(self, coro):
+        self.created.append(getattr(coro, "__qualname__", repr(coro)))
+        coro.close()
+
+    def run_forever(self):
+        pass
+
+    def close(self):
+        pass
+
+
+recording_loop = RecordingLoop()
+
+
+def run_sync(coro):
+    # Drive a coroutine that never really suspends (virtual mode)
+    try:
+        while True:
+            coro.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+def _make_uasyncio():
+    m = types.ModuleType("uasyncio")
+    for name in ("Event", "Lock", "CancelledError", "TimeoutError", "wait_for",
+                 "gather", "start_server", "open_connection", "run", "Task"):
+        setattr(m, name, getattr(asyncio, name, None))
+    m.ThreadSafeFlag = ThreadSafeFlag
+
+    async def sleep(s):
+        if virtual:
+            advance(s * 1000.0)
+        else:
+            await asyncio.sleep(s)
+
+    async def sleep_ms(ms):
+        await sleep(ms / 1000.0)
+
+    def get_event_loop():
+        if virtual:
+            return recording_loop
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            return loop
+
+    def create_task(coro):
+        return get_event_loop().create_task(coro)
+
+    m.sleep = sleep
+    m.sleep_ms = sleep_ms
+    m.get_event_loop = get_event_loop
+    m.create_task = create_task
+    m.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000.0)
+    return m
+
+
+# --- machine / dht / network / urequests / micropython -------------------------
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 8
+    IRQ_FALLING = 4
+
+    def __init__(self, id, mode=IN, pull=None, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = 1 if pull == Pin.PULL_UP else 0
+        self.handler = None
+        pins[id] = self
+        if value is not None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        v = 1 if v else 0
+        if v != self._value:
+            self._value = v
+            pin_log.append((now_ms(), self.id, v))
+            if on_pin_change:
+                on_pin_change(self.id, v)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    high = on
+    low = off
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        self.handler = handler
+
+    def toggle_input(self, v):
+        # Drive an input pin from the test side and fire its IRQ
+        self._value = v
+        if self.handler:
+            self.handler(self)
+
+
+class ADC:
+    def __init__(self, pin):
+        self.pin = pin.id if isinstance(pin, Pin) else pin
+
+    def read_u16(self):
+        v = adc.get(self.pin, 32768)
+        return int(v() if callable(v) else v)
+
+
+class PWM:
+    def __init__(self, pin):
+        self.pin = pin
+        self._freq = 0
+        self._duty = 0
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+
+    def duty_u16(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        self._duty = 0
+
+
+class RTC:
+    def datetime(self, dt=None):
+        if dt is None:
+            tm = time.gmtime(int(_epoch + now_ms() / 1000.0))
+            return (tm[0], tm[1], tm[2], tm[6], tm[3], tm[4], tm[5], 0)
+        set_time(calendar.timegm((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0, 0)))
+
+
+def _make_machine():
+    m = types.ModuleType("machine")
+    m.Pin = Pin
+    m.ADC = ADC
+    m.PWM = PWM
+    m.RTC = RTC
+    m.reset = lambda: None
+    m.freq = lambda f=None: 150_000_000
+    m.unique_id = lambda: b"hostsim!"
+    m.disable_irq = lambda: 0
+    m.enable_irq = lambda state=0: None
+    return m
+
+
+class DHT11:
+    def __init__(self, pin):
+        self.pin = pin
+        self._t = self._h = None
+
+    def measure(self):
+        if dht_value is None:
+            raise OSError(110)
+        self._t, self._h = dht_value
+
+    def temperature(self):
+        return self._t
+
+    def humidity(self):
+        return self._h
+
+
+class WLAN:
+    connected = True
+    ap_up = True      # tests: False makes connect() fail until set back
+    rssi = -55
+    last_connect = None
+
+    def __init__(self, iface=0):
+        self._active = True
+
+    def active(self, v=None):
+        if v is None:
+            return self._active
+        self._active = v
+
+    def isconnected(self):
+        return WLAN.connected
+
+    def status(self, param=None):
+        if param == "rssi":
+            return WLAN.rssi
+        return 3 if WLAN.connected else 0
+
+    def connect(self, ssid=None, key=None, **kw):
+        WLAN.last_connect = kw
+        WLAN.connected = WLAN.ap_up
+
+    def disconnect(self):
+        WLAN.connected = False
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def config(self, *args, **kw):
+        if args:
+            return {"bssid": b"\0" * 6, "channel": 1, "ssid": "host"}.get(args[0])
+
+
+def _make_network():
+    m = types.ModuleType("network")
+    m.WLAN = WLAN
+    m.STA_IF = 0
+    m.AP_IF = 1
+    m.STAT_IDLE = 0
+    m.STAT_CONNECTING = 1
+    m.STAT_WRONG_PASSWORD = -3
+    m.STAT_NO_AP_FOUND = -2
+    m.STAT_CONNECT_FAIL = -1
+    m.STAT_GOT_IP = 3
+    return m
+
+
+class Response:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode("utf-8", "replace")
+
+    def close(self):
+        pass
+
+
+def _make_urequests():
+    m = types.ModuleType("urequests")
+
+    def get(url, timeout=None, headers=None):
+        http_log.append((now_ms(), url))
+        if virtual:
+            return Response(200, b"")
+        import urllib.request
+        if http_target:
+            url = http_target + "/" + url.split("://", 1)[-1].split("/", 1)[-1]
+        with urllib.request.urlopen(url, timeout=timeout) as r:
+            return Response(r.status, r.read())
+    m.get = get
+    return m
+
+
+def _make_micropython():
+    m = types.ModuleType("micropython")
+    ident = lambda f: f
+    m.native = ident
+    m.viper = ident
+    m.const = lambda x: x
+    m.schedule = lambda f, arg: f(arg)
+    m.alloc_emergency_exception_buf = lambda n: None
+    m.mem_info = lambda *a: None
+    return m
+
+
+# --- sockets (real mode) ------------------------------------------------------
+
+class StreamSocket:
+    # MicroPython stream socket API (read/write, None when a non-blocking
+    # read has no data) on top of a CPython socket or SSLSocket
+    def __init__(self, sock):
+        self.sock = sock
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def read(self, n):
+        buf = b""
+        while len(buf) < n:
+            try:
+                chunk = self.sock.recv(n - len(buf))
+            except (BlockingIOError, _ssl.SSLWantReadError):
+                if not buf:
+                    return None
+                continue
+            if not chunk:
+                break
+            buf += chunk
+        return buf
+
+    def write(self, buf, n=None):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        data = bytes(buf if n is None else buf[:n])
+        self.sock.sendall(data)
+        return len(data)
+
+
+class SSLContext:
+    # ssl.SSLContext stand-in whose wrap_socket() takes/returns StreamSockets
+    def __init__(self, cafile):
+        self.ctx = _ssl.create_default_context(cafile=cafile)
+
+    def wrap_socket(self, sock, server_hostname=None, session=None):
+        return StreamSocket(self.ctx.wrap_socket(sock.sock, server_hostname=server_hostname, session=session))
+
+
+def use_stream_sockets(module):
+    # Point a library's "socket" global at one that makes StreamSockets
+    m = types.ModuleType("socket")
+    for name in dir(_socket):
+        if name.isupper() or name == "getaddrinfo":
+            setattr(m, name, getattr(_socket, name))
+    m.socket = lambda *args: StreamSocket(_socket.socket(*args))
+    module.socket = m
+
+
+# --- install -----------------------------------------------------------------
+
+def install(virtual_time=True, epoch_s=None, root=ROOT):
+    # Register the simulated modules and put the firmware tree on sys.path
+    global virtual, _now_ms, _epoch
+    virtual = virtual_time
+    _now_ms = 0.0
+    _epoch = time.time() if epoch_s is None else epoch_s
+    utime = _make_utime()
+    uasyncio = _make_uasyncio()
+    sys.modules.update({
+        "utime": utime,
+        "uasyncio": uasyncio,
+        "machine": _make_machine(),
+        "dht": types.ModuleType("dht"),
+        "network": _make_network(),
+        "urequests": _make_urequests(),
+        "micropython": _make_micropython(),
+    })
+    sys.modules["dht"].DHT11 = DHT11
+    # MicroPython extras on CPython's own modules (used by lib/blynk_mqtt.py etc.)
+    for name in ("ticks_ms", "ticks_us", "ticks_diff", "ticks_add", "sleep_ms", "sleep_us"):
+        setattr(time, name, getattr(utime, name))
+    asyncio.sleep_ms = uasyncio.sleep_ms
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+    if not hasattr(gc, "mem_free"):
+        gc.mem_free = lambda: 200_000
+        gc.mem_alloc = lambda: 60_000
+        gc.threshold = lambda n=None: -1
+    if not hasattr(sys, "print_exception"):
+        sys.print_exception = lambda e, f=None: traceback.print_exception(type(e), e, e.__traceback__)
+    for p in (os.path.join(root, "lib"), root):
+        if p not in sys.path:
+            sys.path.insert(0, p)
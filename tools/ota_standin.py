@@ -0,0 +1,116 @@
+# Local file server for testing OTA updates (lib/ota.py) on a PC or a Pico.
+#
+# Packs firmware files into an update bundle and serves it over HTTP:
+#   python tools/ota_standin.py --ver 1.1 main.py demo.py config.py lib/ota.py
+#   python tools/ota_standin.py --rate-kbps 20 --fail-after 5000 main.py
+# File names are relative to --root (default: the firmware tree) and are
+# installed under the same names on the device. The announcement to send on
+# downlink/ota/json (Blynk console, or Broker.publish in broker_standin.py)
+# is printed at startup.
+#
+# Fault injection: --rate-kbps throttles the transfer, --fail-after closes
+# the connection after N bytes, --corrupt flips a byte (hash mismatch),
+# --status answers with another HTTP status.
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import struct
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAGIC = b"PPKG\x01"
+
+
+def pack(root, names):
+    # Bundle layout: see lib/ota.py
+    out = bytearray(MAGIC + struct.pack("<H", len(names)))
+    for name in names:
+        with open(os.path.join(root, name), "rb") as f:
+            data = f.read()
+        n = name.replace(os.sep, "/").encode()
+        out += struct.pack("<BI", len(n), len(data)) + n + data
+    return bytes(out)
+
+
+class OTAServer:
+    def __init__(self, bundle, rate_kbps=0, fail_after=0, corrupt=False, status=200):
+        self.bundle = bytearray(bundle)
+        if corrupt:
+            self.bundle[len(self.bundle) // 2] ^= 0xFF
+        self.rate_kbps = rate_kbps
+        self.fail_after = fail_after
+        self.status = status
+        self.requests = 0
+        self.sent = 0
+
+    async def handle(self, reader, writer):
+        try:
+            req = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        self.requests += 1
+        print("[ota] %s from %s" % (req.split(b"\r\n", 1)[0].decode(), writer.get_extra_info("peername")))
+        if self.status != 200:
+            writer.write(b"HTTP/1.0 %d Error\r\n\r\n" % self.status)
+            writer.close()
+            return
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                     b"Content-Length: %d\r\n\r\n" % len(self.bundle))
+        step = 1024
+        pos = 0
+        try:
+            while pos < len(self.bundle):
+                end = min(pos + step, len(self.bundle))
+                if self.fail_after and end > self.fail_after:
+                    end = self.fail_after
+                    if end <= pos:
+                        print("[ota] dropping connection after %d bytes" % pos)
+                        break
+                writer.write(self.bundle[pos:end])
+                await writer.drain()
+                self.sent += end - pos
+                if self.rate_kbps:
+                    await asyncio.sleep((end - pos) / (self.rate_kbps * 128.0))
+                pos = end
+            else:
+                print("[ota] sent %d bytes" % pos)
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+def announcement(bundle, url, ver):
+    return {"url": url, "size": len(bundle), "sha256": hashlib.sha256(bundle).hexdigest(), "ver": ver}
+
+
+async def _main(args):
+    bundle = pack(args.root, args.files)
+    srv = OTAServer(bundle, args.rate_kbps, args.fail_after, args.corrupt, args.status)
+    server = await asyncio.start_server(srv.handle, args.host, args.port)
+    host = args.advertise or ("127.0.0.1" if args.host == "0.0.0.0" else args.host)
+    url = "http://%s:%d/bundle.bin" % (host, args.port)
+    print("[ota] %d files, %d bytes" % (len(args.files), len(bundle)))
+    print("[ota] downlink/ota/json payload:")
+    print(json.dumps(announcement(bundle, url, args.ver)))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="OTA bundle file server stand-in")
+    ap.add_argument("files", nargs="+", help="firmware files to bundle, relative to --root")
+    ap.add_argument("--root", default=os.path.dirname(HERE))
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--advertise", help="host name/IP the device should use in the URL")
+    ap.add_argument("--ver", default="dev")
+    ap.add_argument("--rate-kbps", type=float, default=0, help="throttle to N kbit/s")
+    ap.add_argument("--fail-after", type=int, default=0, help="close the connection after N bytes")
+    ap.add_argument("--corrupt", action="store_true", help="flip one byte of the bundle")
+    ap.add_argument("--status", type=int, default=200, help="HTTP status to answer with")
+    try:
+        asyncio.run(_main(ap.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,183 @@
+# Replay a sensor trace (recorded by lib/tracelog.py) through the Device
+# decision logic on a PC, much faster than real time.
+#
+#   python tools/replay.py trace.bin                      # decisions of this tree
+#   python tools/replay.py trace.bin --firmware ../old    # another checkout
+#   python tools/replay.py trace.bin --compare ../old     # diff two firmwares
+#
+# Each sensor cycle produces one tab-separated line:
+#   utc  messages  pump-events  spawned-tasks
+# so two runs can be compared line by line. The firmware's own config.py is
+# used, except that the time zone is taken from the trace.
+import argparse
+import io
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+MAGIC = b"PTRC\x01"
+FORMATS = {
+    b"C"[0]: "<IHHBI",
+    b"S"[0]: "<IhHHHbBB",
+    b"D"[0]: "<IBB",
+    b"P"[0]: "<IB",
+}
+
+
+def read_trace(path):
+    # Yields (kind_char, fields) and, for downlinks, (topic, payload) tails
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos < len(data):
+        if data.startswith(MAGIC, pos):
+            pos += len(MAGIC)
+            continue
+        kind = data[pos]
+        fmt = FORMATS.get(kind)
+        if fmt is None:
+            raise ValueError("bad record type 0x%02x at offset %d" % (kind, pos))
+        size = struct.calcsize(fmt)
+        if pos + 1 + size > len(data):
+            break  # truncated tail (power loss mid-write)
+        fields = struct.unpack_from(fmt, data, pos + 1)
+        pos += 1 + size
+        if kind == b"D"[0]:
+            tl, pl = fields[1], fields[2]
+            topic = data[pos:pos + tl]
+            payload = data[pos + tl:pos + tl + pl]
+            pos += tl + pl
+            yield "D", fields, (topic, payload)
+        else:
+            yield chr(kind), fields, None
+
+
+class FakeMQTT:
+    def __init__(self):
+        self.sock = object()
+        self.published = []
+        # Traffic counters read by netstats.mqtt()
+        self.ssl = None
+        self.ssl_reused = False
+        self.tx_bytes = self.rx_bytes = self.tx_pkts = self.rx_pkts = 0
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self.published.append((topic, msg))
+        self.tx_bytes += len(topic) + len(msg) + 4
+        self.tx_pkts += 1
+
+    def check_msg(self):
+        pass
+
+
+def run(trace_path, firmware, out):
+    import hostsim
+    hostsim.install(virtual_time=True, epoch_s=0, root=firmware)
+    # Keep the firmware's state files out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix="replay-"))
+    import config
+    config.TRACE_ENABLED = False
+    config.TIME_DST_RULE = None
+    devnull = io.StringIO()
+    real_stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        import demo
+        dev = demo.Device(FakeMQTT())
+    finally:
+        sys.stdout = real_stdout
+    dev.system_active = True
+    pump_pin = config.PIN_PUMP_CONTROL
+    cycles = 0
+    first_t = last_t = None
+    t0 = time.perf_counter()
+    for kind, f, tail in read_trace(trace_path):
+        if first_t is None and kind != "C":
+            first_t = f[0]
+        if kind != "C" and f[0] * 1000.0 > hostsim.now_ms():
+            hostsim.advance_to(f[0])
+        if hasattr(dev, "apply_settled_downlinks"):
+            # Settings whose settle window ended before this record
+            sys.stdout = devnull
+            dev.apply_settled_downlinks()
+            sys.stdout = real_stdout
+        sys.stdout = devnull
+        try:
+            if kind == "C":
+                (dev.min_seconds_between_watering_config, dev.pump_run_duration_auto_s,
+                 dev.pump_run_duration_manual_s, dev.soil_watering_threshold_config,
+                 dev.last_watering_s) = f
+            elif kind == "P":
+                dev.system_active = bool(f[1])
+            elif kind == "D":
+                dev.blynk_process_mqtt_message(tail[0], tail[1])
+            elif kind == "S":
+                utc, tz, soil, water, ldr, temp, hum, _ = f
+                config.TIME_UTC_OFFSET_MIN = tz
+                hostsim.adc[config.PIN_SOIL_MOISTURE_ADC] = soil
+                hostsim.adc[config.PIN_WATER_LEVEL_ADC] = water
+                hostsim.adc[config.PIN_LDR_ADC] = ldr
+                dev.dht_reader.temperature = None if temp == -128 else temp
+                dev.dht_reader.humidity = None if hum == 255 else hum
+                del hostsim.pin_log[:]
+                del hostsim.recording_loop.created[:]
+                hostsim.run_sync(dev.read_all_sensors_sequentially())
+                hostsim.run_sync(dev.run_smart_plant_logic())
+                pump = ",".join("%s@%d" % ("on" if v else "off", (ms / 1000.0) - utc)
+                                for ms, p, v in hostsim.pin_log if p == pump_pin)
+                tasks = ",".join(hostsim.recording_loop.created)
+                sys.stdout = real_stdout
+                out.write("%d\t%s\t%s\t%s\n" % (utc, ",".join(dev.last_decision), pump, tasks))
+                cycles += 1
+                last_t = utc
+        finally:
+            sys.stdout = real_stdout
+            devnull.seek(0)
+            devnull.truncate()
+    wall = time.perf_counter() - t0
+    span = (last_t - first_t) if cycles else 0
+    sys.stderr.write("replayed %d cycles (%.1f h of data) in %.2f s, %.0fx real time\n"
+                     % (cycles, span / 3600.0, wall, span / wall if wall else 0))
+
+
+def compare(trace_path, fw_a, fw_b):
+    outs = []
+    for fw in (fw_a, fw_b):
+        res = subprocess.run([sys.executable, __file__, trace_path, "--firmware", fw],
+                             capture_output=True, text=True, check=True)
+        sys.stderr.write("%s: %s" % (fw, res.stderr))
+        outs.append(res.stdout.splitlines())
+    a, b = outs
+    diffs = 0
+    for la, lb in zip(a, b):
+        if la != lb:
+            diffs += 1
+            print("- " + la)
+            print("+ " + lb)
+    if len(a) != len(b):
+        print("cycle count differs: %d vs %d" % (len(a), len(b)))
+    print("%d of %d cycles differ" % (diffs, min(len(a), len(b))))
+    return 1 if diffs or len(a) != len(b) else 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Replay a sensor trace through the watering logic")
+    ap.add_argument("trace")
+    ap.add_argument("--firmware", default=os.path.dirname(HERE), help="firmware tree (default: this one)")
+    ap.add_argument("--compare", metavar="DIR", help="second firmware tree to diff against")
+    ap.add_argument("--out", help="write decisions here instead of stdout")
+    a = ap.parse_args()
+    trace_path = os.path.abspath(a.trace)
+    if a.compare:
+        sys.exit(compare(trace_path, os.path.abspath(a.firmware), os.path.abspath(a.compare)))
+    if a.out:
+        with open(a.out, "w") as fh:
+            run(trace_path, os.path.abspath(a.firmware), fh)
+    else:
+        run(trace_path, os.path.abspath(a.firmware), sys.stdout)
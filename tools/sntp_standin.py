@@ -0,0 +1,70 @@
+# Local SNTP server stand-in for exercising lib/timesvc.py on a PC.
+#
+#   python tools/sntp_standin.py --port 12300 --offset 2.5 --drift-ppm 40
+# Then set config.TIME_NTP_HOST = "127.0.0.1" and TIME_NTP_PORT = 12300.
+#
+# --offset shifts the served time, --drift-ppm makes the served clock run
+# fast/slow so the client's drift estimate can be checked, and --delay-ms /
+# --loss add reply latency and random packet loss.
+import argparse
+import random
+import socket
+import struct
+import time
+
+NTP_DELTA = 2208988800
+
+
+def _ntp_ts(t):
+    secs = int(t)
+    return secs + NTP_DELTA, int((t - secs) * (1 << 32)) & 0xFFFFFFFF
+
+
+class SNTPServer:
+    def __init__(self, offset=0.0, drift_ppm=0.0, delay_ms=0, loss=0.0):
+        self.offset = offset
+        self.drift_ppm = drift_ppm
+        self.delay_ms = delay_ms
+        self.loss = loss
+        self.t0 = time.time()
+        self.requests = 0
+
+    def now(self):
+        t = time.time()
+        return t + self.offset + (t - self.t0) * self.drift_ppm / 1e6
+
+    def reply(self, req):
+        # Build a mode-4 (server) response for a client request
+        rx = _ntp_ts(self.now())
+        if self.delay_ms:
+            time.sleep(self.delay_ms / 1000)
+        tx = _ntp_ts(self.now())
+        return struct.pack("!BBBb11I", 0x24, 1, 0, -20, 0, 0, 0x4C4F434C,
+                           rx[0], rx[1], *struct.unpack("!II", req[40:48]),
+                           rx[0], rx[1], tx[0], tx[1])
+
+    def serve(self, host, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+        print("[sntp] listening on %s:%d" % (host, port))
+        while True:
+            req, addr = sock.recvfrom(512)
+            self.requests += 1
+            if len(req) < 48 or random.random() < self.loss:
+                continue
+            sock.sendto(self.reply(req), addr)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local SNTP server stand-in")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=12300)
+    ap.add_argument("--offset", type=float, default=0.0, help="seconds added to served time")
+    ap.add_argument("--drift-ppm", type=float, default=0.0)
+    ap.add_argument("--delay-ms", type=int, default=0)
+    ap.add_argument("--loss", type=float, default=0.0, help="fraction of requests to drop")
+    a = ap.parse_args()
+    try:
+        SNTPServer(a.offset, a.drift_ppm, a.delay_ms, a.loss).serve(a.host, a.port)
+    except KeyboardInterrupt:
+        pass